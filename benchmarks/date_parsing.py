@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Times string2naive_datetime on the timestamps in the sample data, against
+parsing them with dateutil alone.
+
+Run from the top of the source tree:
+
+    python benchmarks/date_parsing.py [iterations]
+"""
+import glob
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import dateutil.parser
+import dateutil.tz
+
+import bugimporters.helpers
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                           'bugimporters', 'tests', 'sample-data')
+
+TIMESTAMP_PATTERNS = [
+    # GitHub
+    re.compile(r'"(?:created_at|updated_at|createdAt|updatedAt)": "([^"]+)"'),
+    # Google and Bugzilla
+    re.compile(r'<(?:published|updated|creation_ts|delta_ts)>([^<]+)<'),
+    # Trac
+    re.compile(r'title="(?:See timeline at )?([^"]*\d\d:\d\d[^"]*?)'
+               r'(?: in Timeline)?"'),
+    ]
+
+
+def sample_timestamps():
+    timestamps = []
+    for path in sorted(glob.glob(os.path.join(SAMPLE_DATA, '*')) +
+                       glob.glob(os.path.join(SAMPLE_DATA, '*', '*'))):
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            data = f.read()
+        for pattern in TIMESTAMP_PATTERNS:
+            timestamps.extend(pattern.findall(data))
+    return timestamps
+
+
+def dateutil_only(s):
+    time_zoned = dateutil.parser.parse(s)
+    if time_zoned.tzinfo:
+        return time_zoned.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+    return time_zoned
+
+
+def main(iterations):
+    timestamps = sample_timestamps()
+
+    def parse_with_dateutil():
+        for s in timestamps:
+            dateutil_only(s)
+
+    def parse_with_string2naive_datetime():
+        for s in timestamps:
+            bugimporters.helpers.string2naive_datetime(s, 'benchmark')
+
+    print '%d timestamps' % len(timestamps)
+    for name, func in [('dateutil.parser.parse', parse_with_dateutil),
+                       ('string2naive_datetime',
+                        parse_with_string2naive_datetime)]:
+        best = min(timeit.repeat(func, number=iterations, repeat=3))
+        print '%-45s %8.3f us per timestamp' % (
+            name, best * 1000000.0 / iterations / len(timestamps))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
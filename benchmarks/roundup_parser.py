@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Times RoundupBugParser on a saved bugs.python.org issue page.
+
+Run from the top of the source tree:
+
+    python benchmarks/roundup_parser.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import bugimporters.main
+import bugimporters.roundup
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'bugimporters', 'tests', 'sample-data',
+                      'python-roundup-8264.html')
+
+TRACKER = bugimporters.main.dict2obj(dict(
+        tracker_name='Python',
+        base_url='http://bugs.python.org/',
+        closed_status='resolved',
+        bitesized_field='Keywords',
+        bitesized_text='easy',
+        documentation_field='Components',
+        documentation_text='Documentation',
+        ))
+
+
+def main(iterations):
+    with open(SAMPLE) as f:
+        html = f.read()
+    rbp = bugimporters.roundup.RoundupBugParser(
+        bug_url='http://bugs.python.org/issue8264')
+    rbp.set_bug_html_data(html)
+
+    def parse_only():
+        rbp.get_parsed_data_dict(TRACKER)
+
+    def load_and_parse():
+        parser = bugimporters.roundup.RoundupBugParser(
+            bug_url='http://bugs.python.org/issue8264')
+        parser.set_bug_html_data(html)
+        parser.get_parsed_data_dict(TRACKER)
+
+    for name, func in [('get_parsed_data_dict', parse_only),
+                       ('set_bug_html_data + get_parsed_data_dict',
+                        load_and_parse)]:
+        best = min(timeit.repeat(func, number=iterations, repeat=3))
+        print '%-45s %8.3f ms per issue' % (name, best * 1000.0 / iterations)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -16,9 +16,36 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import twisted.internet.threads
+import twisted.python.threadpool
 import twisted.web.client
 import datetime
 
+# How many URLs may wait for a connection before URLs that produce more work
+# (such as the next page of a listing) are held back, unless the tracker model
+# sets max_waiting_urls.
+DEFAULT_MAX_WAITING_URLS = 1000
+
+# Thread pools for parsing documents, by size. See BugImporter.parse_then.
+_parse_pools = {}
+
+
+def parse_pool(size):
+    '''Returns the thread pool of size threads that documents are parsed
+    in, starting it the first time it is asked for. It is stopped along
+    with the reactor.'''
+    try:
+        return _parse_pools[size]
+    except KeyError:
+        from twisted.internet import reactor
+        pool = twisted.python.threadpool.ThreadPool(
+            minthreads=0, maxthreads=size, name='bugimporters-parse')
+        pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', pool.stop)
+        _parse_pools[size] = pool
+        return pool
+
 
 class BugImporter(object):
 
@@ -28,19 +55,77 @@ class BugImporter(object):
     def log_error(self, failure):
         failure.printTraceback()
 
-    def add_url_to_waiting_list(self, url, callback, c_args={}, errback=None, e_args={}):
+    def inc_stat(self, key, count=1):
+        # Keep our own tally, and pass it on to scrapy's stats if we are
+        # running under a crawler.
+        self.stats[key] += count
+        if self.crawler_stats is not None:
+            self.crawler_stats.inc_value(key, count)
+
+    def parse_then(self, handle, parse, *args, **kwargs):
+        '''Calls parse(*args, **kwargs), and hands what it returns to
+        handle, returning what that returns.
+
+        If the tracker model sets parse_threads, parse runs in a thread pool
+        of that size instead, and a Deferred is returned. lxml lets go of
+        the GIL as it parses, so big documents no longer hold up the
+        reactor. handle is still called on the reactor thread.'''
+        threads = getattr(self.tm, 'parse_threads', None)
+        if not threads:
+            return handle(parse(*args, **kwargs))
+        from twisted.internet import reactor
+        d = twisted.internet.threads.deferToThreadPool(
+            reactor, parse_pool(threads), parse, *args, **kwargs)
+        d.addCallback(handle)
+        return d
+
+    def add_url_to_waiting_list(self, url, callback, c_args={}, errback=None, e_args={},
+            priority=False):
         # FIXME: change default errback to a basic logging one.
         errback = errback or self.log_error
-        self.waiting_urls[url] = (callback, c_args, errback, e_args)
+        # Priority URLs (e.g. the next page of a listing) are handed to the
+        # reactor before any other waiting URL.
+        if priority:
+            waiting_urls = self.priority_waiting_urls
+        else:
+            waiting_urls = self.waiting_urls
+        waiting_urls[url] = (callback, c_args, errback, e_args)
+
+    def add_producer_url_to_waiting_list(self, url, callback, c_args={},
+            errback=None, e_args={}):
+        # The response to a producer URL adds more URLs to the waiting list,
+        # so while that list is full it is held back until the list drains.
+        if self.waiting_list_is_full():
+            self.held_urls.append((url, callback, c_args, errback, e_args))
+        else:
+            self.add_url_to_waiting_list(url, callback, c_args, errback,
+                    e_args, priority=True)
+
+    def waiting_list_is_full(self):
+        max_waiting = (getattr(self.tm, 'max_waiting_urls', None) or
+                       DEFAULT_MAX_WAITING_URLS)
+        return len(self.waiting_urls) >= max_waiting
+
+    def release_held_urls(self):
+        while self.held_urls and not self.waiting_list_is_full():
+            url, callback, c_args, errback, e_args = self.held_urls.pop(0)
+            self.add_url_to_waiting_list(url, callback, c_args, errback,
+                    e_args, priority=True)
+
+    def has_waiting_urls(self):
+        return bool(self.priority_waiting_urls or self.waiting_urls or
+                    self.held_urls)
 
     def get_next_waiting_url(self):
         # If there are no more waiting URLs, returns None.
         # Otherwise, returns a (url, callback, c_args, errback, e_args) tuple.
-        try:
-            url, (callback, c_args, errback, e_args) = self.waiting_urls.popitem()
-        except KeyError:
-            return None
-        return (url, callback, c_args, errback, e_args)
+        for waiting_urls in (self.priority_waiting_urls, self.waiting_urls):
+            try:
+                url, (callback, c_args, errback, e_args) = waiting_urls.popitem()
+            except KeyError:
+                continue
+            return (url, callback, c_args, errback, e_args)
+        return None
 
     def add_url_to_deferred_list(self, url):
         # If the URL has previously been added to the reactor, returns None.
@@ -60,7 +145,7 @@ class BugImporter(object):
     def remove_url_from_deferred_list(self, result, url):
         self.deferred_urls[url] -= 1
         self.rm.decrement_deferred_count()
-        if self.urls_we_are_waiting_on[url] < 0:
+        if self.deferred_urls[url] < 0:
             # FIXME: log error with Twisted
             #logging.error("Eeek, " + url + " went negative.")
             pass
@@ -72,14 +157,19 @@ class BugImporter(object):
         return (sum(self.deferred_urls.values()) < max_conns)
 
     def push_urls_onto_reactor(self, result=None):
-        if not self.waiting_urls and sum(self.deferred_urls.values()) < 1:
+        if not self.has_waiting_urls() and sum(self.deferred_urls.values()) < 1:
             # There are no more URLs to process, so finish.
             self.determine_if_finished()
         else:
             # If we have space, push some more URLs on.
-            while self.waiting_urls and self.has_spare_connections():
+            while self.has_spare_connections():
+                # Let held URLs back in if there is room for them.
+                self.release_held_urls()
                 # Get the next URL.
-                url, callback, c_args, errback, e_args = self.get_next_waiting_url()
+                next_url = self.get_next_waiting_url()
+                if next_url is None:
+                    break
+                url, callback, c_args, errback, e_args = next_url
 
                 # Add the URL to the reactor.
                 d = self.add_url_to_deferred_list(url)
@@ -106,6 +196,11 @@ class BugImporter(object):
         # downloading, along with the callback and errback that handle the
         # resultant data.
         self.waiting_urls = {}
+        # The same, for URLs that should jump the queue.
+        self.priority_waiting_urls = {}
+        # A list of (url, callback, c_args, errback, e_args) tuples for
+        # producer URLs held back while the waiting list is full.
+        self.held_urls = []
         # Create a dictionary that maps URLs to a number. This means that not
         # only can we check how many URLs are currently active (and so check
         # we are not over the limit for this tracker) but by storing all URLs
@@ -118,6 +213,12 @@ class BugImporter(object):
 
         self.data_transits = data_transits
 
+        # Counts of things worth knowing about a run, such as entries that
+        # were skipped. BugImportSpider points crawler_stats at scrapy's
+        # stats collector.
+        self.stats = collections.Counter()
+        self.crawler_stats = None
+
     def finish_import(self):
         # This importer has finished, so let the reactor manager know that it
         # may be able to stop the reactor.
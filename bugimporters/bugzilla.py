@@ -39,6 +39,10 @@ class BugzillaBugImporter(BugImporter):
         # Create a list to store bug ids obtained from queries.
         self.bug_ids = []
 
+        # Project names, by (product, component), as this run has worked
+        # them out.
+        self.bug_project_names = {}
+
     def process_queries(self, queries):
         # Add all the queries to the waiting list.
         for query in queries:
@@ -195,18 +199,24 @@ class BugzillaBugImporter(BugImporter):
 
     def handle_bug_xml(self, bug_list_xml_string):
         logging.info("STARTING XML")
+        return self.parse_then(self.handle_bug_list_xml_parsed,
+                               self.parse_bug_list_xml, bug_list_xml_string)
+
+    @staticmethod
+    def parse_bug_list_xml(bug_list_xml_string):
         # Turn the string into an XML tree.
         try:
-            bug_list_xml = lxml.etree.XML(bug_list_xml_string)
+            return lxml.etree.XML(bug_list_xml_string)
         except Exception:
             logging.exception("Eek, XML parsing failed. Jumping to the errback.")
             logging.error("If this keeps happening, you might want to "
                           "delete/disable the bug tracker causing this.")
             raise
 
-        return self.handle_bug_list_xml_parsed(bug_list_xml)
-
     def handle_bug_list_xml_parsed(self, bug_list_xml):
+        bitesized_matcher = self.tm.get_keyword_matcher('bitesized_text')
+        documentation_matcher = self.tm.get_keyword_matcher(
+            'documentation_text')
         for bug_xml in bug_list_xml.xpath('bug'):
             # Create a BugzillaBugParser with the XML data.
             bbp = self.bug_parser(bug_xml)
@@ -214,21 +224,31 @@ class BugzillaBugImporter(BugImporter):
             # Get the parsed data dict from the BugzillaBugParser.
             data = bbp.get_parsed_data_dict(base_url=self.tm.get_base_url(),
                                             bitesized_type=self.tm.bitesized_type,
-                                            bitesized_text=self.tm.bitesized_text,
+                                            bitesized_matcher=bitesized_matcher,
                                             documentation_type=self.tm.documentation_type,
-                                            documentation_text=self.tm.documentation_text)
+                                            documentation_matcher=documentation_matcher)
 
             data.update({
                 'canonical_bug_link': bbp.bug_url,
                 'tracker': self.tm,
-                '_project_name': bbp.generate_bug_project_name(
-                        bug_project_name_format=self.tm.bug_project_name_format,
-                        tracker_name=self.tm.tracker_name),
+                '_project_name': self.bug_project_name(bbp),
             })
 
             self.data_transits['bug']['update'](data)
 
 
+    def bug_project_name(self, bbp):
+        # Each tracker has only so many products and components, so each
+        # pair is only worked out once.
+        key = (bbp.product, bbp.component)
+        try:
+            return self.bug_project_names[key]
+        except KeyError:
+            name = self.bug_project_names[key] = bbp.generate_bug_project_name(
+                    bug_project_name_format=self.tm.bug_project_name_format,
+                    tracker_name=self.tm.tracker_name)
+            return name
+
     def determine_if_finished(self):
         # If we got here then there are no more URLs in the waiting list.
         # So if self.bug_ids is also empty then we are done.
@@ -290,8 +310,8 @@ class BugzillaBugParser:
         return string2naive_datetime(date_string)
 
     def get_parsed_data_dict(self,
-                             base_url, bitesized_type, bitesized_text,
-                             documentation_type, documentation_text):
+                             base_url, bitesized_type, bitesized_matcher,
+                             documentation_type, documentation_matcher):
         # Generate the bug_url.
         self.bug_url = urlparse.urljoin(
                 base_url,
@@ -305,7 +325,7 @@ class BugzillaBugParser:
         status = self.get_tag_text_from_xml(xml_data, 'bug_status')
         looks_closed = status in ('RESOLVED', 'WONTFIX', 'CLOSED', 'ASSIGNED')
 
-        ret_dict = bugimporters.items.ParsedBug({
+        ret_dict = bugimporters.items.BugRecord({
             'title': self.get_tag_text_from_xml(xml_data, 'short_desc'),
             'description': (self.get_tag_text_from_xml(xml_data, 'long_desc/thetext') or
                            '(Empty description)'),
@@ -324,25 +344,25 @@ class BugzillaBugParser:
                        keywords_text.split(','))
         # Check for the bitesized keyword
         if bitesized_type:
-            b_list = bitesized_text.split(',')
+            b_matcher = bitesized_matcher
             if bitesized_type == 'key':
-                ret_dict['good_for_newcomers'] = any(b in keywords for b in b_list)
+                ret_dict['good_for_newcomers'] = b_matcher.any_of(keywords)
             elif bitesized_type == 'wboard':
                 whiteboard_text = self.get_tag_text_from_xml(xml_data, 'status_whiteboard')
-                ret_dict['good_for_newcomers'] = any(b in whiteboard_text for b in b_list)
+                ret_dict['good_for_newcomers'] = b_matcher.in_text(whiteboard_text)
             else:
                 ret_dict['good_for_newcomers'] = False
         else:
             ret_dict['good_for_newcomers'] = False
         # Chemck whether this is a documentation bug.
         if documentation_type:
-            d_list = documentation_text.split(',')
+            d_matcher = documentation_matcher
             if documentation_type == 'key':
-                ret_dict['concerns_just_documentation'] = any(d in keywords for d in d_list)
+                ret_dict['concerns_just_documentation'] = d_matcher.any_of(keywords)
             elif documentation_type == 'comp':
-                ret_dict['concerns_just_documentation'] = any(d == self.component for d in d_list)
+                ret_dict['concerns_just_documentation'] = d_matcher.any_of([self.component])
             elif documentation_type == 'prod':
-                ret_dict['concerns_just_documentation'] = any(d == self.product for d in d_list)
+                ret_dict['concerns_just_documentation'] = d_matcher.any_of([self.product])
             else:
                 ret_dict['concerns_just_documentation'] = False
         else:
@@ -364,55 +384,115 @@ class BugzillaBugParser:
                 component=self.component)
 
 ### Custom bug parsers
+GNOME_PROJECT_NAMES = {
+    'general': 'GNOME (general)',
+    'website': 'GNOME (website)',
+    }
+
 class GnomeBugzilla(BugzillaBugParser):
     def generate_bug_project_name(self, bug_project_name_format, tracker_name):
-        bug_project_name = self.product
-        gnome2openhatch = {'general': 'GNOME (general)',
-                           'website': 'GNOME (website)'}
-        if bug_project_name in gnome2openhatch:
-            bug_project_name=gnome2openhatch[bug_project_name]
-        return bug_project_name
+        return GNOME_PROJECT_NAMES.get(self.product, self.product)
+
+### Special-case the project names we know about
+MOZILLA_PROJECT_NAMES = {
+    'Core': 'Mozilla Core',
+    'Firefox': 'Firefox',
+    'MailNews Core': 'Mozilla Messaging',
+    'addons.mozilla.org': 'addons.mozilla.org',
+    'Thunderbird': 'Thunderbird',
+    'Testing': 'Mozilla automated testing',
+    'Directory': 'Mozilla LDAP',
+    'mozilla.org': 'mozilla.org',
+    'SeaMonkey': 'SeaMonkey',
+    'Toolkit': 'Mozilla Toolkit',
+    'support.mozilla.com': 'support.mozilla.com',
+    'Camino': 'Camino',
+    'Calendar': 'Mozilla Calendar',
+    'Mozilla Localizations': 'Mozilla Localizations',
+    'Mozilla QA': 'Mozilla QA',
+    'Mozilla Services': 'Mozilla Services',
+    'Webtools': 'Mozilla Webtools',
+    'Input': 'Mozilla Input',
+    'Fennec': 'Fennec',
+    }
 
 class MozillaBugParser(BugzillaBugParser):
     def generate_bug_project_name(self, bug_project_name_format, tracker_name):
-        ### Special-case the project names we know about
-        mozilla2openhatch = {'Core': 'Mozilla Core',
-                             'Firefox': 'Firefox',
-                             'MailNews Core': 'Mozilla Messaging',
-                             'addons.mozilla.org': 'addons.mozilla.org',
-                             'Thunderbird': 'Thunderbird',
-                             'Testing': 'Mozilla automated testing',
-                             'Directory': 'Mozilla LDAP',
-                             'mozilla.org': 'mozilla.org',
-                             'SeaMonkey': 'SeaMonkey',
-                             'Toolkit': 'Mozilla Toolkit',
-                             'support.mozilla.com': 'support.mozilla.com',
-                             'Camino': 'Camino',
-                             'Calendar': 'Mozilla Calendar',
-                             'Mozilla Localizations': 'Mozilla Localizations',
-                             'Mozilla QA': 'Mozilla QA',
-                             'Mozilla Services': 'Mozilla Services',
-                             'Webtools': 'Mozilla Webtools',
-                             'Input': 'Mozilla Input',
-                             'Fennec': 'Fennec',
-                             }
         if self.product == 'Other Applications':
             bug_project_name = 'Mozilla ' + self.component
         else:
-            bug_project_name = mozilla2openhatch[self.product]
+            bug_project_name = MOZILLA_PROJECT_NAMES[self.product]
         return bug_project_name
 
+# MediaWiki extensions whose names need the "for MediaWiki" to make sense.
+MEDIAWIKI_GENERIC_EXTENSIONS = frozenset(['FCKeditor', 'Gadgets'])
+
 class MediaWikiBugParser(BugzillaBugParser):
     def generate_bug_project_name(self, bug_project_name_format, tracker_name):
         product = self.product
         if product == 'MediaWiki extensions':
             bug_project_name = self.component
-            if bug_project_name in ('FCKeditor', 'Gadgets'):
+            if bug_project_name in MEDIAWIKI_GENERIC_EXTENSIONS:
                 bug_project_name += ' for MediaWiki'
         else:
             bug_project_name = product
         return bug_project_name
 
+KDE_PROJECTS = frozenset([
+    'Akonadi',
+    'Phonon',
+    'kmail',
+    'Rocs',
+    'akregator',
+    'amarok',
+    'ark',
+    'cervisia',
+    'k3b',
+    'kappfinder',
+    'kbabel',
+    'kdeprint',
+    'kdesktop',
+    'kfile',
+    'kfourinline',
+    'khotkeys',
+    'kio',
+    'kmplot',
+    'koffice',
+    'kompare',
+    'konquerorr',
+    'kopete',
+    'kpat',
+    'kphotoalbum',
+    'krita',
+    'ksmserver',
+    'kspread',
+    'ksysguard',
+    'ktimetracker',
+    'kwin',
+    'kword',
+    'marble',
+    'okular',
+    'plasma',
+    'printer-applet',
+    'rsibreak',
+    'step',
+    'systemsettings',
+    'kdelibs',
+    'kcontrol',
+    'korganizer',
+    'kipiplugins',
+    'dolphin',
+    'umbrello',
+    ])
+
+KDE_RENAMED_PROJECTS = {
+    'konqueror': 'boomski',
+    'digikamimageplugins': 'digikam image plugins',
+    'Network Management': 'KDE Network Management',
+    'telepathy': 'telepathy for KDE',
+    'docs': 'KDE documentation',
+    }
+
 class KDEBugzilla(BugzillaBugParser):
 
     def extract_tracker_specific_data(self, xml_data, ret_dict):
@@ -432,70 +512,12 @@ class KDEBugzilla(BugzillaBugParser):
 
     def generate_bug_project_name(self, bug_project_name_format, tracker_name):
         product = self.product
-        reasonable_products = set([
-            'Akonadi',
-            'Phonon'
-            'kmail',
-            'Rocs',
-            'akregator',
-            'amarok',
-            'ark',
-            'cervisia',
-            'k3b',
-            'kappfinder',
-            'kbabel',
-            'kdeprint',
-            'kdesktop',
-            'kfile',
-            'kfourinline',
-            'khotkeys',
-            'kio',
-            'kmail',
-            'kmplot',
-            'koffice',
-            'kompare',
-            'konquerorr',
-            'kopete',
-            'kpat',
-            'kphotoalbum',
-            'krita',
-            'ksmserver',
-            'kspread',
-            'ksysguard',
-            'ktimetracker',
-            'kwin',
-            'kword',
-            'marble',
-            'okular',
-            'plasma',
-            'printer-applet',
-            'rsibreak',
-            'step',
-            'systemsettings',
-            'kdelibs',
-            'kcontrol',
-            'korganizer',
-            'kipiplugins',
-            'Phonon',
-            'dolphin',
-            'umbrello']
-            )
-        products_to_be_renamed = {
-            'konqueror': 'boomski',
-            'digikamimageplugins': 'digikam image plugins',
-            'Network Management': 'KDE Network Management',
-            'telepathy': 'telepathy for KDE',
-            'docs': 'KDE documentation',
-            }
-        component = self.component
-        things = (product, component)
-
-        if product in reasonable_products:
+        if product in KDE_PROJECTS:
             bug_project_name = product
+        elif product in KDE_RENAMED_PROJECTS:
+            bug_project_name = KDE_RENAMED_PROJECTS[product]
         else:
-            if product in products_to_be_renamed:
-                bug_project_name = products_to_be_renamed[product]
-            else:
-                logging.info("Guessing on KDE subproject name. Found %s" %  repr(things))
-                bug_project_name = product
+            logging.info("Guessing on KDE subproject name. Found %r",
+                         (product, self.component))
+            bug_project_name = product
         return bug_project_name
@@ -14,46 +14,653 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import datetime
+import functools
 import importlib
 import json
+import logging
+import re
 import scrapy.http
 import scrapy.spider
+import time
+import urlparse
 
 import bugimporters.items
 from bugimporters.base import BugImporter, printable_datetime
-from bugimporters.helpers import string2naive_datetime
+from bugimporters.helpers import (string2naive_datetime, set_query_params,
+        open_store, BoundedDict)
+
+# The most issues the GitHub API will return on one page.
+MAX_PAGE_SIZE = 100
+
+# How many issues' comments are fetched at once for each repository, unless
+# the tracker sets comment_concurrency.
+DEFAULT_COMMENT_CONCURRENCY = 2
+
+# How long, in seconds, a user's real name is trusted before their profile is
+# fetched again, unless the tracker sets user_cache_ttl.
+DEFAULT_USER_CACHE_TTL = 7 * 24 * 60 * 60
+
+# The real names of GitHub users, keyed by login, as dicts of the name and
+# when it was fetched. Every GitHub importer in the process shares them, and
+# the logins whose profiles any of them is fetching right now.
+USER_CACHE_SIZE = 5000
+user_cache = BoundedDict(USER_CACHE_SIZE)
+users_in_flight = set()
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# The fields of an issue that the GraphQL importer asks for.
+ISSUE_FIELDS = '''
+fragment issueFields on Issue {
+  number title body state createdAt updatedAt url
+  author { login ... on User { name } ... on Organization { name } }
+  assignees(first: 10) { nodes { login } }
+  labels(first: 100) { nodes { name } }
+  comments(first: 100) {
+    totalCount pageInfo { hasNextPage endCursor } nodes { author { login } }
+  }
+}
+'''
+
+ISSUE_LIST_QUERY = ISSUE_FIELDS + '''
+query($owner: String!, $name: String!, $states: [IssueState!],
+      $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    issues(states: $states, first: $first, after: $after,
+           orderBy: {field: CREATED_AT, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { ...issueFields }
+    }
+  }
+}
+'''
+
+
+# The further comments of an issue with more than ISSUE_FIELDS brings back.
+ISSUE_COMMENTS_QUERY = '''
+query($owner: String!, $name: String!, $number: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    issue(number: $number) {
+      comments(first: 100, after: $after) {
+        pageInfo { hasNextPage endCursor } nodes { author { login } }
+      }
+    }
+  }
+}
+'''
+
+
+def issue_show_query(numbers):
+    '''Builds a query for the given issues of one repository, each under
+    the alias issue<number>.'''
+    issues = '\n'.join('    issue%d: issue(number: %d) { ...issueFields }'
+                       % (number, number) for number in numbers)
+    return ISSUE_FIELDS + '''
+query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+%s
+  }
+}
+''' % issues
+
+
+LINK_RE = re.compile(r'<([^>]*)>\s*;\s*rel="([^"]*)"')
+
+
+def parse_link_header(value):
+    '''Turns a Link header into a dict mapping each rel to its URL.'''
+    links = {}
+    for url, rels in LINK_RE.findall(value or ''):
+        for rel in rels.split():
+            links[rel] = url
+    return links
+
+
+def page_number(url):
+    query = urlparse.urlsplit(url).query
+    return int(dict(urlparse.parse_qsl(query)).get('page', 1))
+
+
+class RateLimit(object):
+    '''What is left of the GitHub API's hourly request budget.
+
+    Every repository we import draws on the same budget, so one RateLimit
+    is shared by all the importers in a run. While plenty is left, requests
+    go out as fast as they are made. Once less than a tenth remains, they
+    are spread evenly over the rest of the window, and once it is spent
+    they wait for the window to reset.'''
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        # The earliest time the next paced request may go out.
+        self.next_slot = 0
+
+    def update(self, headers):
+        try:
+            limit = int(headers.get('X-RateLimit-Limit'))
+            remaining = int(headers.get('X-RateLimit-Remaining'))
+            reset = int(headers.get('X-RateLimit-Reset'))
+        except (TypeError, ValueError):
+            return
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def exhausted(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    def seconds_until_reset(self, now=None):
+        if self.reset is None:
+            return 0
+        if now is None:
+            now = time.time()
+        return max(0, self.reset - now)
+
+    def reserve(self, count, now=None):
+        '''Takes count requests from the budget, and returns how many
+        seconds to wait before making them.'''
+        if not count or self.remaining is None:
+            return 0
+        if now is None:
+            now = time.time()
+        window = self.seconds_until_reset(now)
+        if not window:
+            # The budget has been refilled since we last heard about it.
+            return 0
+        if self.remaining < count:
+            return window
+        self.remaining -= count
+        if self.remaining >= self.limit // 10:
+            return 0
+        spacing = window / float(self.remaining + count)
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + spacing * count
+        return slot - now
+
+    def clear(self):
+        self.__init__()
+
+
+rate_limit = RateLimit()
+
+# The GraphQL API has a budget of its own.
+graphql_rate_limit = RateLimit()
+
+
+def rate_limit_for(request):
+    if request.meta.get('graphql'):
+        return graphql_rate_limit
+    return rate_limit
+
 
 class GitHubBugImporter(BugImporter):
+    '''
+    Imports issues through the GitHub API, one repository per tracker.
+
+    Requests are made conditional on the ETag of the last response for the
+    same URL, since GitHub does not count 304 responses against the rate
+    limit. The ETags and bodies are kept in the store at the tracker's
+    cache_path; without one, requests are not made conditional, since
+    nothing would ask for the same URL again.
+
+    If the tracker sets fetch_comment_authors, the comments of each issue
+    are fetched too, so that people_involved counts the commenters. At
+    most comment_concurrency of those requests are made at once. The
+    commenters are stored along with the issue's updated_at and comment
+    count, and only fetched again once one of those has changed.
+
+    If the tracker sets skip_pull_requests, the pull requests that GitHub
+    lists among the issues are dropped before they are parsed.
+
+    If the tracker sets fetch_submitter_realnames, submitter_realname is
+    filled in from the reporter's profile. Bugs are never held back for
+    it: one whose reporter is not in the user cache, or whose cached name
+    is out of date, is handed on with whatever name we have, and the
+    profile is fetched in the background for later bugs and runs.
+
+    With a cache_path, queries are also synced incrementally. Each one
+    remembers when it last ran to the end and the issues it found. Later
+    runs only ask GitHub for issues updated since then, and fill in the
+    rest from the store. Those requests are not made conditional: their
+    since parameter changes every run, so their ETags would never be
+    asked for again.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(GitHubBugImporter, self).__init__(*args, **kwargs)
+        # Maps the key of each query being synced incrementally to its
+        # progress in this run.
+        self.syncs = {}
+        # Requests for the comments of issues, waiting for one of the
+        # comment_concurrency slots, and how many of those are in use.
+        self.comment_queue = collections.deque()
+        self.comment_requests_in_flight = 0
+        # Requests for user profiles, waiting to be handed to scrapy.
+        self.user_queue = []
+
     def process_queries(self, queries):
         for query in queries:
-            url = query.get_query_url()
+            query_url = query.get_query_url()
+            url = self.first_page_url(query_url)
+            sync_key = None
+            if getattr(self.tm, 'cache_path', None):
+                sync_key, url = self.start_sync(query_url, url)
 
-            yield scrapy.http.Request(
+            r = self.conditional_request(
                 url=url,
                 callback=self.handle_bug_list_response)
+            r.meta['query_page'] = 1
+            r.meta['sync_key'] = sync_key
+            yield r
+
+    def start_sync(self, query_url, url):
+        '''Sets up the incremental sync of a query, and returns its key and
+        the URL to ask for its first page at.'''
+        # Queries for different states of one repository each need their
+        # own sync time, so the key is the query URL, not just the repo.
+        sync_key = query_url.encode('utf-8')
+        query = dict(urlparse.parse_qsl(urlparse.urlsplit(query_url).query))
+        self.syncs[sync_key] = {
+            'state': query.get('state', 'open'),
+            'started': datetime.datetime.utcnow().strftime(
+                '%Y-%m-%dT%H:%M:%SZ'),
+            'pending': 1,
+            'issues': {},
+        }
+        since = self.store.get('sync:' + sync_key)
+        if since:
+            # Issues that have changed state since are wanted too, so that
+            # the stored copies can be brought up to date.
+            url = set_query_params(url, [('since', since),
+                                         ('sort', 'updated'),
+                                         ('state', 'all')])
+        return sync_key, url
+
+    def get_query_page_size(self):
+        return getattr(self.tm, 'query_page_size', None) or MAX_PAGE_SIZE
+
+    def first_page_url(self, query_url):
+        # GitHub returns 30 issues a page unless asked for more. If the
+        # query already says how many it wants, leave it alone.
+        query = urlparse.urlsplit(query_url).query
+        if 'per_page' in dict(urlparse.parse_qsl(query)):
+            return query_url
+        return set_query_params(query_url,
+                                [('per_page', str(self.get_query_page_size()))])
+
+    @property
+    def store(self):
+        return open_store(getattr(self.tm, 'cache_path', None))
+
+    def keeps_etags(self, url):
+        if not getattr(self.tm, 'cache_path', None):
+            return False
+        query = urlparse.urlsplit(url).query
+        return 'since' not in dict(urlparse.parse_qsl(query))
+
+    def conditional_request(self, url, callback):
+        r = scrapy.http.Request(url=url, callback=callback)
+        # Let 304s and 403s through to the callback, rather than having
+        # them dropped as errors.
+        r.meta['handle_httpstatus_list'] = [304, 403]
+        if self.keeps_etags(url):
+            cached = self.store.get('etag:' + url.encode('utf-8'))
+            if cached is not None:
+                r.headers['If-None-Match'] = cached['etag']
+        return r
+
+    def handle_response(self, response, handler, refused=None):
+        '''Deals with the rate limit and conditional requests for a
+        response, before handing it to handler. Whatever handler returns
+        is held back for as long as the rate limit says.
+
+        If GitHub refuses the request for some other reason than the rate
+        limit, refused is called with the response instead, if given, and
+        what it returns is passed on the same way.'''
+        limiter = rate_limit_for(response.request)
+        limiter.update(response.headers)
+
+        if response.status == 403:
+            if not limiter.exhausted():
+                logging.error('GitHub refused %s', response.url)
+                if refused is None:
+                    return self.pass_on([])
+                return self.pass_on(refused(response))
+            # Ask again once the budget has been refilled.
+            retry = response.request.replace(dont_filter=True)
+            return self.later([retry], limiter.seconds_until_reset())
+
+        key = 'etag:' + response.url.encode('utf-8')
+        if response.status == 304:
+            cached = self.store.get(key)
+            if cached is None:
+                # We have lost the body that goes with the ETag we sent.
+                retry = response.request.replace(dont_filter=True)
+                del retry.headers['If-None-Match']
+                return [retry]
+            request = response.request
+            headers = {}
+            if cached['link']:
+                headers['Link'] = cached['link']
+            response = response.replace(status=200, body=cached['body'],
+                                        headers=headers)
+            response.request = request
+        elif (response.headers.get('ETag') and
+              response.request.method == 'GET' and
+              self.keeps_etags(response.url)):
+            self.store[key] = {'etag': response.headers['ETag'],
+                               'body': response.body,
+                               'link': response.headers.get('Link')}
+
+        return self.pass_on(handler(response))
+
+    def pass_on(self, results):
+        '''Hands on results, along with the queued comment and user
+        requests that can start now, held back for as long as the rate
+        limit says. Every callback and errback ends here, so that a
+        request that fails never leaves the queues stuck.'''
+        # Bugs waiting on their comments come back as None.
+        results = [result for result in results if result is not None]
+        results.extend(self.start_comment_requests())
+        results.extend(self.start_user_requests())
+        requests = [r for r in results if isinstance(r, scrapy.http.Request)]
+        graphql_count = sum(1 for r in requests if r.meta.get('graphql'))
+        return self.later(results, max(
+            rate_limit.reserve(len(requests) - graphql_count),
+            graphql_rate_limit.reserve(graphql_count)))
+
+    @staticmethod
+    def later(results, delay):
+        if not delay:
+            return results
+        from twisted.internet import reactor, task
+        return task.deferLater(reactor, delay, lambda: results)
 
     def handle_bug_list_response(self, response):
+        return self.handle_response(response, self.handle_bug_list)
+
+    def handle_bug_list(self, response):
         issue_list = json.loads(response.body)
 
+        next_pages = self.next_page_requests(response, len(issue_list))
+        for request in next_pages:
+            yield request
+
+        if getattr(self.tm, 'skip_pull_requests', False):
+            issue_list = self.without_pull_requests(issue_list)
+
+        sync_key = response.meta.get('sync_key')
+        if sync_key is not None:
+            for item in self.sync_page(sync_key, issue_list, len(next_pages)):
+                yield item
+            return
+
         for bug in issue_list:
             yield self.handle_bug(bug)
 
+    @staticmethod
+    def is_pull_request(issue):
+        # Older versions of the API give every issue a pull_request, with
+        # its URLs set to null unless it really is one.
+        pull_request = issue.get('pull_request')
+        return bool(pull_request and pull_request.get('html_url'))
+
+    def without_pull_requests(self, issue_list):
+        issues = [issue for issue in issue_list
+                  if not self.is_pull_request(issue)]
+        skipped = len(issue_list) - len(issues)
+        if skipped:
+            self.inc_stat('github/pull_requests_skipped', skipped)
+        return issues
+
+    @staticmethod
+    def issue_in_state(issue, state):
+        return state == 'all' or issue['state'] == state
+
+    def sync_page(self, sync_key, issue_list, next_page_count):
+        sync = self.syncs[sync_key]
+        for issue in issue_list:
+            sync['issues'][issue['html_url']] = issue
+            if self.issue_in_state(issue, sync['state']):
+                yield self.handle_bug(issue)
+
+        sync['pending'] += next_page_count - 1
+        if not sync['pending']:
+            for item in self.finish_sync(sync_key):
+                yield item
+
+    def finish_sync(self, sync_key):
+        '''Once every page of a query is in, merges what it found into the
+        stored issues, and hands on the stored ones that were not updated.
+
+        If a page never arrives, none of this happens, and the next run
+        syncs from the same time as this one did.'''
+        sync = self.syncs.pop(sync_key)
+        issues = self.store.get('issues:' + sync_key, {})
+        issues.update(sync['issues'])
+        issues = dict((url, issue) for url, issue in issues.items()
+                      if self.issue_in_state(issue, sync['state']))
+        self.store['issues:' + sync_key] = issues
+        self.store['sync:' + sync_key] = sync['started']
+
+        for url, issue in issues.items():
+            if url not in sync['issues']:
+                yield self.handle_bug(issue)
+
+    def next_page_requests(self, response, issue_count):
+        '''Works out which further pages of a query to fetch.
+
+        The first page's Link header gives the number of the last page, and
+        then all the remaining pages are asked for at once. If there is no
+        Link header, a full page means there may be another one.'''
+        if response.meta.get('query_pages_known'):
+            return []
+
+        page = response.meta.get('query_page', 1)
+        links = parse_link_header(response.headers.get('Link'))
+        if 'last' in links:
+            return [self.page_request(links['last'], number, pages_known=True)
+                    for number in range(page + 1,
+                                        page_number(links['last']) + 1)]
+        if 'next' in links:
+            return [self.page_request(links['next'], page + 1)]
+        if not links and issue_count >= self.get_query_page_size():
+            return [self.page_request(response.url, page + 1)]
+        return []
+
+    def page_request(self, url, number, pages_known=False):
+        r = self.conditional_request(
+            url=set_query_params(url, [('page', str(number))]),
+            callback=self.handle_bug_list_response)
+        r.meta['query_page'] = number
+        r.meta['query_pages_known'] = pages_known
+        return r
+
     def process_bugs(self, bug_list):
         for bug_url, bug_data in bug_list:
-            r = scrapy.http.Request(
+            r = self.conditional_request(
                 url=bug_url,
                 callback=self.handle_bug_show_response)
             yield r
 
     def handle_bug_show_response(self, response):
+        return self.handle_response(response, self.handle_bug_show)
+
+    def handle_bug_show(self, response):
         bug_data = json.loads(response.body)
-        return self.handle_bug(bug_data)
+        return [self.handle_bug(bug_data)]
 
     def handle_bug(self, bug_data):
+        '''Returns the parsed bug; or None, if its comments need fetching
+        first, in which case it is handed on once they are in.'''
+        commenters = None
+        if getattr(self.tm, 'fetch_comment_authors', False):
+            commenters = self.stored_commenters(bug_data)
+            if commenters is None:
+                self.queue_comment_request(bug_data)
+                return None
+        return self.parse_bug(bug_data, commenters)
+
+    def parse_bug(self, bug_data, commenters=None):
         gbp = GitHubBugParser(self.tm, self.tm.github_name,
             self.tm.github_repo)
-        return gbp.parse(bug_data)
+        parsed = gbp.parse(bug_data, commenters)
+        if getattr(self.tm, 'fetch_submitter_realnames', False):
+            self.fill_submitter_realname(parsed, bug_data['user'])
+        return parsed.to_item()
+
+    def fill_submitter_realname(self, parsed, user):
+        login = user['login']
+        cached = self.cached_user(login)
+        if cached is not None:
+            parsed['submitter_realname'] = cached['name']
+        if self.is_fresh(cached):
+            return
+        # Any importer that meets this login while its profile is on the
+        # way leaves it to the one that asked.
+        if login not in users_in_flight:
+            users_in_flight.add(login)
+            self.user_queue.append(self.user_request(user['url'], login))
+
+    def cached_user(self, login):
+        user = user_cache.get(login)
+        if user is None:
+            user = self.store.get('user:' + login.encode('utf-8'))
+            if user is not None:
+                user_cache[login] = user
+        return user
+
+    def is_fresh(self, user):
+        '''Whether a cached user was fetched recently enough to trust.'''
+        if user is None:
+            return False
+        ttl = getattr(self.tm, 'user_cache_ttl', None) or DEFAULT_USER_CACHE_TTL
+        return time.time() - user['fetched'] <= ttl
+
+    def user_request(self, url, login):
+        # Once the TTL is up, the profile is asked for conditionally, so an
+        # unchanged one costs nothing against the rate limit.
+        r = self.conditional_request(
+            url=url,
+            callback=self.handle_user_response)
+        # users_in_flight already keeps a login from being asked for twice
+        # at once; a later retry of the same URL must not be dropped as a
+        # duplicate, or the login would stay in flight for good.
+        r.dont_filter = True
+        r.errback = functools.partial(self.handle_user_failure, login)
+        r.meta['github_login'] = login
+        return r
+
+    def start_user_requests(self):
+        started, self.user_queue = self.user_queue, []
+        return started
+
+    def handle_user_response(self, response):
+        return self.handle_response(response, self.handle_user,
+                                    refused=self.handle_user_refused)
+
+    def handle_user(self, response):
+        login = response.meta['github_login']
+        data = json.loads(response.body)
+        user = {'name': data.get('name') or '', 'fetched': time.time()}
+        user_cache[login] = user
+        self.store['user:' + login.encode('utf-8')] = user
+        users_in_flight.discard(login)
+        return []
+
+    def handle_user_refused(self, response):
+        users_in_flight.discard(response.meta['github_login'])
+        return []
+
+    def handle_user_failure(self, login, failure):
+        logging.error('Could not fetch the GitHub user %s: %s',
+                      login, failure.getErrorMessage())
+        users_in_flight.discard(login)
+        return self.pass_on([])
+
+    @staticmethod
+    def commenters_key(bug_data):
+        return 'comments:' + bug_data['html_url'].encode('utf-8')
+
+    def stored_commenters(self, bug_data):
+        '''Returns the commenters on an issue, if we know them already.'''
+        if not bug_data['comments']:
+            return set()
+        stored = self.store.get(self.commenters_key(bug_data))
+        if (stored is None or
+                stored['updated_at'] != bug_data['updated_at'] or
+                stored['comments'] != bug_data['comments']):
+            return None
+        return set(stored['authors'])
+
+    def queue_comment_request(self, bug_data):
+        url = bug_data.get('comments_url') or (
+            bug_data['url'].rstrip('/') + '/comments')
+        fetch = {'bug_data': bug_data, 'authors': set()}
+        self.comment_queue.append(self.comment_request(
+            set_query_params(url, [('per_page', str(MAX_PAGE_SIZE))]),
+            fetch))
+
+    def comment_request(self, url, fetch):
+        r = self.conditional_request(
+            url=url,
+            callback=self.handle_comments_response)
+        r.errback = functools.partial(self.handle_comments_failure, fetch)
+        r.meta['comment_fetch'] = fetch
+        return r
+
+    def get_comment_concurrency(self):
+        return (getattr(self.tm, 'comment_concurrency', None) or
+                DEFAULT_COMMENT_CONCURRENCY)
+
+    def start_comment_requests(self):
+        started = []
+        while (self.comment_queue and self.comment_requests_in_flight <
+               self.get_comment_concurrency()):
+            self.comment_requests_in_flight += 1
+            started.append(self.comment_queue.popleft())
+        return started
+
+    def handle_comments_response(self, response):
+        return self.handle_response(response, self.handle_comments,
+                                    refused=self.handle_comments_refused)
+
+    def handle_comments(self, response):
+        fetch = response.meta['comment_fetch']
+        for comment in json.loads(response.body):
+            if comment.get('user'):
+                fetch['authors'].add(comment['user']['login'])
+
+        # Further pages of comments keep this request's slot.
+        next_url = parse_link_header(response.headers.get('Link')).get('next')
+        if next_url:
+            yield self.comment_request(next_url, fetch)
+            return
+
+        self.comment_requests_in_flight -= 1
+        bug_data = fetch['bug_data']
+        self.store[self.commenters_key(bug_data)] = {
+            'updated_at': bug_data['updated_at'],
+            'comments': bug_data['comments'],
+            'authors': sorted(fetch['authors']),
+        }
+        yield self.parse_bug(bug_data, fetch['authors'])
+
+    def handle_comments_refused(self, response):
+        return self.give_up_on_comments(response.meta['comment_fetch'])
+
+    def handle_comments_failure(self, fetch, failure):
+        logging.error('Could not fetch the comments on %s: %s',
+                      fetch['bug_data']['html_url'], failure.getErrorMessage())
+        return self.pass_on(self.give_up_on_comments(fetch))
+
+    def give_up_on_comments(self, fetch):
+        # Hand the bug on anyway, with people_involved guessed as before.
+        self.comment_requests_in_flight -= 1
+        return [self.parse_bug(fetch['bug_data'])]
 
 class GitHubBugParser(object):
     def __init__(self, tm, github_name, github_repo):
@@ -62,7 +669,14 @@ class GitHubBugParser(object):
         self.github_repo = github_repo
 
     @staticmethod
-    def github_count_people_involved(issue):
+    def github_count_people_involved(issue, commenters=None):
+        if commenters is not None:
+            people = set(commenters)
+            people.add(issue['user']['login'])
+            if issue['assignee']:
+                people.add(issue['assignee']['login'])
+            return len(people)
+
         # The reporter counts as a person.
         people = 1
 
@@ -71,23 +685,24 @@ class GitHubBugParser(object):
             people += 1
 
         if issue['comments'] > 0:
-            # FIXME: pull comments to get an accurate count; for now,
-            # we'll just bump the involved people count even though
-            # the commenter might be the reporting user.
+            # Without the comments (see fetch_comment_authors), we just
+            # bump the involved people count even though the commenter
+            # might be the reporting user.
             people += 1
 
         return people
 
-    def parse(self, issue):
-        parsed = bugimporters.items.ParsedBug({
+    def parse(self, issue, commenters=None):
+        parsed = bugimporters.items.BugRecord({
             'title': issue['title'],
             'description': issue['body'],
             'status': issue['state'],
-            'people_involved': self.github_count_people_involved(issue),
+            'people_involved': self.github_count_people_involved(
+                issue, commenters),
             'date_reported': printable_datetime(string2naive_datetime(issue['created_at'])),
             'last_touched': printable_datetime(string2naive_datetime(issue['updated_at'])),
             'submitter_username': issue['user']['login'],
-            'submitter_realname': '', # FIXME: can get this from ['user']['url']
+            'submitter_realname': '', # See fetch_submitter_realnames.
             'canonical_bug_link': issue['html_url'],
             'looks_closed': (issue['state'] == 'closed'),
             'last_polled': printable_datetime(),
@@ -97,11 +712,207 @@ class GitHubBugParser(object):
         issue_labels = set([
             l['name'] for l in issue['labels']
         ])
+        self.set_label_flags(parsed, issue_labels)
+
+        return parsed
+
+    def set_label_flags(self, parsed, issue_labels):
+        parsed['good_for_newcomers'] = self.tm.get_keyword_matcher(
+            'bitesized_tag').any_of(issue_labels)
+        parsed['concerns_just_documentation'] = self.tm.get_keyword_matcher(
+            'documentation_tag').any_of(issue_labels)
+
+
+class GitHubGraphQLBugImporter(GitHubBugImporter):
+    '''
+    Imports issues through the GitHub GraphQL API.
+
+    One request brings back up to 100 issues, along with their labels, the
+    real name of their author and who commented on them, which the REST
+    API would need further requests for. Issues with more than 100
+    comments are held back while the rest of their comments are fetched,
+    100 at a time. Set github_token on the tracker, since the GraphQL API
+    does not answer anonymous requests, and graphql_url to use something
+    other than api.github.com.
+    '''
+    def process_queries(self, queries):
+        for query in queries:
+            states = self.graphql_states(query.get_query_url())
+            yield self.issue_list_request(states)
+
+    @staticmethod
+    def graphql_states(query_url):
+        # Queries are written as REST URLs, so that a tracker can switch
+        # between the two importers; only their state is used here.
+        query = dict(urlparse.parse_qsl(urlparse.urlsplit(query_url).query))
+        state = query.get('state', 'open')
+        if state == 'all':
+            return None
+        return [state.upper()]
+
+    def get_query_page_size(self):
+        return min(super(GitHubGraphQLBugImporter, self).get_query_page_size(),
+                   MAX_PAGE_SIZE)
+
+    def graphql_request(self, query, variables, callback):
+        headers = {'Content-Type': 'application/json'}
+        token = getattr(self.tm, 'github_token', None)
+        if token:
+            headers['Authorization'] = 'bearer ' + token
+        r = scrapy.http.Request(
+            url=getattr(self.tm, 'graphql_url', None) or GRAPHQL_URL,
+            method='POST',
+            body=json.dumps({'query': query, 'variables': variables}),
+            headers=headers,
+            callback=callback)
+        r.meta['handle_httpstatus_list'] = [403]
+        r.meta['graphql'] = True
+        return r
+
+    def repository_variables(self):
+        return {'owner': self.tm.github_name, 'name': self.tm.github_repo}
+
+    def issue_list_request(self, states, after=None):
+        variables = self.repository_variables()
+        variables.update({'states': states,
+                          'first': self.get_query_page_size(),
+                          'after': after})
+        r = self.graphql_request(ISSUE_LIST_QUERY, variables,
+                                 self.handle_issue_list_response)
+        r.meta['graphql_states'] = states
+        return r
+
+    @staticmethod
+    def graphql_data(response):
+        payload = json.loads(response.body)
+        # GraphQL reports problems, such as an issue that no longer exists,
+        # alongside whatever data it could find.
+        for error in payload.get('errors') or []:
+            logging.error('GitHub GraphQL error for %s: %s',
+                          response.url, error.get('message'))
+        return payload.get('data') or {}
+
+    def handle_issue_list_response(self, response):
+        return self.handle_response(response, self.handle_issue_list)
+
+    def handle_issue_list(self, response):
+        repository = self.graphql_data(response).get('repository')
+        if not repository:
+            return
+        issues = repository['issues']
+
+        # The next page can only be asked for once we have this page's
+        # cursor, so ask for it before anything else.
+        if issues['pageInfo']['hasNextPage']:
+            yield self.issue_list_request(response.meta['graphql_states'],
+                                          issues['pageInfo']['endCursor'])
+
+        for node in issues['nodes']:
+            yield self.handle_issue_node(node)
+
+    def process_bugs(self, bug_list):
+        numbers = [int(bug_url.rstrip('/').rsplit('/', 1)[1])
+                   for bug_url, bug_data in bug_list]
+        for start in range(0, len(numbers), MAX_PAGE_SIZE):
+            yield self.graphql_request(
+                issue_show_query(numbers[start:start + MAX_PAGE_SIZE]),
+                self.repository_variables(),
+                self.handle_issue_show_response)
+
+    def handle_issue_show_response(self, response):
+        return self.handle_response(response, self.handle_issue_show)
+
+    def handle_issue_show(self, response):
+        repository = self.graphql_data(response).get('repository') or {}
+        for node in repository.values():
+            if node is not None:
+                yield self.handle_issue_node(node)
+
+    def handle_issue_node(self, node):
+        '''Returns the parsed issue; or, if it has more comments than came
+        with it, the request for the next page of them.'''
+        comments = node['comments']
+        if comments['pageInfo']['hasNextPage']:
+            return self.issue_comments_request(
+                node, comments['pageInfo']['endCursor'])
+        return self.parse_issue_node(node)
+
+    def issue_comments_request(self, node, after):
+        variables = self.repository_variables()
+        variables.update({'number': node['number'], 'after': after})
+        r = self.graphql_request(ISSUE_COMMENTS_QUERY, variables,
+                                 self.handle_issue_comments_response)
+        r.errback = functools.partial(self.handle_issue_comments_failure,
+                                      node)
+        r.meta['graphql_issue'] = node
+        return r
+
+    def handle_issue_comments_response(self, response):
+        return self.handle_response(response, self.handle_issue_comments,
+                                    refused=self.handle_issue_comments_refused)
 
-        b_list = self.tm.bitesized_tag.split(',')
-        parsed['good_for_newcomers'] = not issue_labels.isdisjoint(b_list)
+    def handle_issue_comments(self, response):
+        node = response.meta['graphql_issue']
+        repository = self.graphql_data(response).get('repository') or {}
+        issue = repository.get('issue')
+        if not issue:
+            return [self.parse_issue_node(node)]
+        comments = issue['comments']
+        node['comments']['nodes'].extend(comments['nodes'])
+        node['comments']['pageInfo'] = comments['pageInfo']
+        return [self.handle_issue_node(node)]
 
-        d_list = self.tm.documentation_tag.split(',')
-        parsed['concerns_just_documentation'] = not issue_labels.isdisjoint(d_list)
+    def handle_issue_comments_refused(self, response):
+        return [self.parse_issue_node(response.meta['graphql_issue'])]
+
+    def handle_issue_comments_failure(self, node, failure):
+        # Hand the issue on anyway, counting the commenters we know of.
+        logging.error('Could not fetch the comments on %s: %s',
+                      node['url'], failure.getErrorMessage())
+        return self.pass_on([self.parse_issue_node(node)])
+
+    def parse_issue_node(self, node):
+        gbp = GitHubGraphQLBugParser(self.tm, self.tm.github_name,
+            self.tm.github_repo)
+        return gbp.parse(node).to_item()
+
+
+class GitHubGraphQLBugParser(GitHubBugParser):
+    @staticmethod
+    def github_count_people_involved(issue):
+        people = set()
+        if issue['author']:
+            people.add(issue['author']['login'])
+        for assignee in issue['assignees']['nodes']:
+            people.add(assignee['login'])
+        for comment in issue['comments']['nodes']:
+            # Comments by deleted accounts have no author.
+            if comment['author']:
+                people.add(comment['author']['login'])
+        # The reporter counts as a person, even if their account is gone.
+        return max(len(people), 1)
+
+    def parse(self, issue):
+        author = issue['author'] or {}
+        state = issue['state'].lower()
+        parsed = bugimporters.items.BugRecord({
+            'title': issue['title'],
+            'description': issue['body'],
+            'status': state,
+            'people_involved': self.github_count_people_involved(issue),
+            'date_reported': printable_datetime(string2naive_datetime(issue['createdAt'])),
+            'last_touched': printable_datetime(string2naive_datetime(issue['updatedAt'])),
+            'submitter_username': author.get('login', ''),
+            'submitter_realname': author.get('name') or '',
+            'canonical_bug_link': issue['url'],
+            'looks_closed': (state == 'closed'),
+            'last_polled': printable_datetime(),
+            '_project_name': self.tm.tracker_name,
+        })
+
+        issue_labels = set([
+            l['name'] for l in issue['labels']['nodes']
+        ])
+        self.set_label_flags(parsed, issue_labels)
 
         return parsed
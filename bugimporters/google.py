@@ -16,22 +16,49 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import cStringIO
 import logging
 import datetime
+import urlparse
 
+import atom.core
 from atom.core import Parse
-from gdata.projecthosting.data import IssuesFeed, IssueEntry
+from gdata.projecthosting.data import IssueEntry
 
 import bugimporters.items
 from bugimporters.base import BugImporter
-from bugimporters.helpers import string2naive_datetime, cached_property
+from bugimporters.helpers import (string2naive_datetime, cached_property,
+        set_query_params, BoundedDict)
+
+ATOM_ENTRY = '{http://www.w3.org/2005/Atom}entry'
+ATOM_LINK = '{http://www.w3.org/2005/Atom}link'
+
+# How many bug URLs from query feeds are remembered, so that a bug matched
+# by several queries is only handled once. Past that, the oldest are
+# forgotten, and a bug may now and then be handled twice.
+SEEN_BUG_URLS_SIZE = 10000
+
+
+# atom.core.parse only takes a string. The function it hands the parsed tree
+# to is private, so it is only used where this version of atom.core has it.
+_xml_element_from_tree = getattr(atom.core, '_xml_element_from_tree', None)
+
+
+def issue_entry_from_element(element):
+    '''Turns an <entry> element of a query feed into an IssueEntry, without
+    writing it out and parsing it all over again where that can be
+    helped.'''
+    if _xml_element_from_tree is None:
+        return atom.core.parse(atom.core.ElementTree.tostring(element),
+                               IssueEntry)
+    return _xml_element_from_tree(element, IssueEntry)
 
 
 class GoogleBugImporter(BugImporter):
 
     def __init__(self, *args, **kwargs):
-        # Create a list to store bug ids obtained from queries.
-        self.query_feeds = []
+        # The bug URLs we have seen in query feeds; see SEEN_BUG_URLS_SIZE.
+        self.seen_bug_urls = BoundedDict(SEEN_BUG_URLS_SIZE)
         # Call the parent __init__.
         super(GoogleBugImporter, self).__init__(*args, **kwargs)
 
@@ -40,54 +67,108 @@ class GoogleBugImporter(BugImporter):
 
         for query in queries:
             query_url = query.get_query_url()
-            self.add_url_to_waiting_list(
+            page_size = self.get_query_page_size()
+            if page_size:
+                query_url = set_query_params(query_url, [
+                        ('start-index', '1'),
+                        ('max-results', str(page_size))])
+            self.add_producer_url_to_waiting_list(
                     url=query_url,
-                    callback=self.handle_query_atom)
+                    callback=self.handle_query_atom,
+                    c_args={'query_url': query_url})
             query.last_polled = datetime.datetime.utcnow()
             query.save()
 
         # URLs are now all prepped, so start pushing them onto the reactor.
         self.push_urls_onto_reactor()
 
-    def handle_query_atom(self, query_atom):
-        # Turn the query_atom into an IssuesFeed.
+    def get_query_page_size(self):
+        # If the tracker sets query_page_size, queries are fetched in pages
+        # of that many issues.
+        return getattr(self.tm, 'query_page_size', None)
+
+    def handle_query_atom(self, query_atom, query_url=None):
+        # Handle each issue as soon as it has been parsed, rather than
+        # turning the whole feed into an IssuesFeed first.
         try:
-            query_feed = Parse(query_atom, IssuesFeed)
+            self.handle_query_issues(
+                    self.iter_query_issues(query_atom, query_url))
         except SyntaxError:
             logging.warn("For what it is worth, query_atom caused us to crash.")
             # FIXME: We should log the string that made us crash.
             return
-        # If we got data, we store it.
-        self.query_feeds.append(query_feed)
-
-    def prepare_bug_urls(self):
-        # Pull query_feeds our of the internal storage. This is done in case the
-        # list is simultaneously being written to, in which case just copying
-        # the entire thing followed by deleting the contents could lead to
-        # lost feeds.
-        query_feed_list = []
-        while self.query_feeds:
-            query_feed_list.append(self.query_feeds.pop())
-
-        # Convert query_feed_list into a list of issues.
-        issue_list = []
-        for feed in query_feed_list:
-            issue_list.extend(feed.entry)
-
-        # Convert the list of issues into a dict of bug URLs and issues.
-        bug_dict = {}
+
+    def iter_query_issues(self, query_atom, query_url=None):
+        """
+        Parse a page of query results one entry at a time, yielding each
+        as an IssueEntry, and dropping it once it has been handled.
+
+        The next page, if there is one, is queued as soon as we know
+        about it.
+        """
+        next_url = None
+        next_page_queued = False
+        entry_count = 0
+        feed = None
+        depth = 0
+        for event, element in atom.core.ElementTree.iterparse(
+                cStringIO.StringIO(query_atom), events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if feed is None:
+                    feed = element
+                elif element.tag == ATOM_ENTRY and not next_page_queued:
+                    # The feed's links all come before its entries.
+                    next_page_queued = self.queue_next_page(next_url)
+                continue
+
+            depth -= 1
+            if depth != 1:
+                continue
+            if element.tag == ATOM_LINK and element.get('rel') == 'next':
+                next_url = element.get('href')
+            elif element.tag == ATOM_ENTRY:
+                entry_count += 1
+                yield issue_entry_from_element(element)
+                feed.remove(element)
+
+        if not next_page_queued:
+            if next_url is None:
+                next_url = self.next_page_url(query_url, entry_count)
+            self.queue_next_page(next_url)
+
+    def next_page_url(self, query_url, entry_count):
+        # Without a next link, a full page means there may be another one.
+        page_size = self.get_query_page_size()
+        if not (query_url and page_size and entry_count >= page_size):
+            return None
+        query = dict(urlparse.parse_qsl(urlparse.urlsplit(query_url).query))
+        start_index = int(query.get('start-index', 1)) + entry_count
+        return set_query_params(query_url, [
+                ('start-index', str(start_index)),
+                ('max-results', str(page_size))])
+
+    def queue_next_page(self, next_url):
+        if not next_url:
+            return False
+        self.add_producer_url_to_waiting_list(
+                url=next_url,
+                callback=self.handle_query_atom,
+                c_args={'query_url': next_url})
+        self.push_urls_onto_reactor()
+        return True
+
+    def handle_query_issues(self, issue_list):
         for issue in issue_list:
             # Get the bug URL.
             bug_url = issue.get_alternate_link().href
-            # Add the issue to the bug_url_dict. This has the side-effect of
-            # removing duplicate bug URLs, as later ones just overwrite earlier
-            # ones.
-            bug_dict[bug_url] = issue
-
-        # And now go on to process the bug list.
-        # We just use all the bugs, as they all have complete data so there is
-        # no harm in updating fresh ones as there is no extra network hit.
-        self.process_bugs(bug_dict.items())
+            if bug_url in self.seen_bug_urls:
+                continue
+            self.seen_bug_urls[bug_url] = True
+            # We just use all the bugs, as they all have complete data so
+            # there is no harm in updating fresh ones as there is no extra
+            # network hit.
+            self.handle_bug_atom(issue, GoogleBugParser(bug_url))
 
     def process_bugs(self, bug_list):
         # If there are no bug URLs, finish now.
@@ -106,15 +187,27 @@ class GoogleBugImporter(BugImporter):
                 # Fetch the bug data.
                 self.add_url_to_waiting_list(
                         url=gbp.bug_atom_url,
-                        callback=self.handle_bug_atom,
+                        callback=self.handle_fetched_bug_atom,
                         c_args={'gbp': gbp})
 
         # URLs are now all prepped, so start pushing them onto the reactor.
         self.push_urls_onto_reactor()
 
-    def handle_bug_atom(self, bug_atom, gbp):
-        # Pass the GoogleBugParser the Atom data
+    def handle_fetched_bug_atom(self, bug_atom, gbp):
+        # Parsing the Atom string is the slow part, so it can happen in
+        # another thread.
+        return self.parse_then(lambda gbp: self.handle_bug_atom(None, gbp),
+                               self.set_bug_atom_data, gbp, bug_atom)
+
+    @staticmethod
+    def set_bug_atom_data(gbp, bug_atom):
         gbp.set_bug_atom_data(bug_atom)
+        return gbp
+
+    def handle_bug_atom(self, bug_atom, gbp):
+        # Pass the GoogleBugParser the Atom data, unless it already has it.
+        if bug_atom is not None:
+            gbp.set_bug_atom_data(bug_atom)
 
         # Get the parsed data dict from the GoogleBugParser
         data = gbp.get_parsed_data_dict(self.tm)
@@ -126,12 +219,9 @@ class GoogleBugImporter(BugImporter):
         self.data_transits['bug']['update'](data)
 
     def determine_if_finished(self):
-        # If we got here then there are no more URLs in the waiting list.
-        # So if self.bug_ids is also empty then we are done.
-        if self.query_feeds:
-            self.prepare_bug_urls()
-        else:
-            self.finish_import()
+        # If we got here then there are no more URLs in the waiting list, and
+        # every query feed has been handled as it arrived, so we are done.
+        self.finish_import()
 
 
 class GoogleBugParser(object):
@@ -209,7 +299,7 @@ class GoogleBugParser(object):
         else:
             author = issue.author
 
-        ret_dict = bugimporters.items.ParsedBug({
+        ret_dict = bugimporters.items.BugRecord({
                 'title': issue.title.text,
                 'description': issue.content.text,
                 'status': status,
@@ -227,14 +317,14 @@ class GoogleBugParser(object):
         labels = [label.text for label in issue.label]
         # Check for the bitesized keyword(s)
         if tm.bitesized_type:
-            b_list = tm.bitesized_text.split(',')
-            ret_dict['good_for_newcomers'] = any(b in labels for b in b_list)
+            ret_dict['good_for_newcomers'] = tm.get_keyword_matcher(
+                'bitesized_text').any_of(labels)
         else:
             ret_dict['good_for_newcomers'] = False
         # Check whether this is a documentation bug.
         if tm.documentation_type:
-            d_list = tm.documentation_text.split(',')
-            ret_dict['concerns_just_documentation'] = any(d in labels for d in d_list)
+            ret_dict['concerns_just_documentation'] = tm.get_keyword_matcher(
+                'documentation_text').any_of(labels)
         else:
             ret_dict['concerns_just_documentation'] = False
 
@@ -0,0 +1,266 @@
+# This file is part of OpenHatch.
+# Copyright (C) 2012 OpenHatch, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import logging
+import mmap
+import os
+import tarfile
+
+from bugimporters.base import BugImporter
+from bugimporters.google import GoogleBugParser
+
+# Files at least this big are memory-mapped rather than read.
+MMAP_THRESHOLD = 1024 * 1024
+
+# How much of a file JSONStream reads at a time.
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\r\n'
+
+# Owners are cleared in the archive by setting them to this.
+NO_OWNER = '----'
+
+
+class JSONStream(object):
+    """
+    Reads JSON values one at a time from a file-like object, holding only
+    as much of it in memory as the value being read.
+    """
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        # Drop what we have read, and add the next chunk to what we have not.
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skips whitespace, and returns the next character, or '' at the
+        end of the file."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected %r in JSON' % char)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # The value probably runs on into the next chunk.
+                if self.fill():
+                    continue
+                raise
+            # So might a number that ends where the buffer does.
+            if end == len(self.buf) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def array_items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError("Expected ',' or ']' in JSON array")
+
+
+def iter_archive_issues(f, chunk_size=CHUNK_SIZE):
+    """
+    Yield the issues in one JSON file of a Google Code archive.
+
+    The file can hold a single issue, a list of issues, or an object with
+    an "issues" list, as the archive's issues-page-N.json files do. Lists
+    are read one issue at a time.
+    """
+    stream = JSONStream(f, chunk_size)
+    first = stream.peek()
+    if first == '[':
+        for issue in stream.array_items():
+            yield issue
+        return
+
+    stream.expect('{')
+    issue = {}
+    while stream.peek() != '}':
+        key = stream.value()
+        stream.expect(':')
+        if key == 'issues' and stream.peek() == '[':
+            for item in stream.array_items():
+                yield item
+        else:
+            issue[key] = stream.value()
+        if stream.peek() == ',':
+            stream.pos += 1
+    stream.pos += 1
+    if 'comments' in issue:
+        yield issue
+
+
+class ArchiveText(object):
+    def __init__(self, text):
+        self.text = text
+
+
+class ArchiveUser(object):
+    def __init__(self, name):
+        self.name = ArchiveText(name)
+        self.username = ArchiveText(name)
+
+
+class ArchiveIssueEntry(object):
+    """
+    Stands in for a gdata IssueEntry, built from an issue in a Google Code
+    archive, so that GoogleBugParser can parse it just as it would have
+    parsed the issue from the feeds API.
+    """
+    def __init__(self, issue):
+        comments = sorted(issue['comments'], key=lambda c: c['timestamp'])
+        # The first comment is the report itself.
+        report = comments[0]
+        self.title = ArchiveText(issue.get('title', ''))
+        self.content = ArchiveText(report.get('content', ''))
+        self.published = ArchiveText(self.timestamp2string(report['timestamp']))
+        self.updated = ArchiveText(
+            self.timestamp2string(comments[-1]['timestamp']))
+        self.author = ArchiveUser(report['author'])
+        self.label = [ArchiveText(label) for label in issue.get('labels', [])]
+
+        status = issue.get('status')
+        self.status = ArchiveText(status) if status else None
+        self.state = ArchiveText(issue.get('state') or 'open')
+
+        # Owners and CCs are only recorded as changes made by comments.
+        owner = None
+        cc = []
+        for comment in comments:
+            updates = comment.get('updates') or {}
+            if 'owner' in updates:
+                owner = updates['owner']
+                if owner == NO_OWNER:
+                    owner = None
+            for name in updates.get('cc', []):
+                if name.startswith('-'):
+                    if name[1:] in cc:
+                        cc.remove(name[1:])
+                elif name not in cc:
+                    cc.append(name)
+        self.owner = ArchiveUser(owner) if owner else None
+        self.cc = [ArchiveUser(name) for name in cc]
+
+    @staticmethod
+    def timestamp2string(timestamp):
+        return datetime.datetime.utcfromtimestamp(timestamp).strftime(
+            '%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class GoogleCodeArchiveBugImporter(BugImporter):
+    """
+    Imports issues from a Google Code archive on local disk, rather than
+    from the feeds API, which no longer exists.
+
+    The tracker's archive_path is a directory, or a tarball, of the
+    archive's JSON files. Issues without comments, like the summaries in
+    issues-page-N.json, are skipped, since the full issue-N.json files
+    hold everything the feeds API used to give us.
+    """
+
+    def process_queries(self, queries):
+        # The archive holds every issue, so there is nothing to query.
+        self.import_archive()
+        self.determine_if_finished()
+
+    def process_bugs(self, bug_list):
+        bug_ids = set(GoogleBugParser.google_name_and_id_from_url(bug_url)[1]
+                      for bug_url, bug_data in bug_list)
+        if bug_ids:
+            self.import_archive(bug_ids)
+        self.determine_if_finished()
+
+    def import_archive(self, bug_ids=None):
+        for f in self.archive_files(self.tm.archive_path):
+            try:
+                for issue in iter_archive_issues(f):
+                    if 'comments' not in issue or not issue['comments']:
+                        continue
+                    if bug_ids is not None and issue['id'] not in bug_ids:
+                        continue
+                    self.handle_archive_issue(issue)
+            except ValueError:
+                logging.exception('Could not read %s', getattr(f, 'name', f))
+            finally:
+                f.close()
+
+    @staticmethod
+    def archive_files(archive_path):
+        """Yield a file object for each JSON file in the archive."""
+        if os.path.isfile(archive_path):
+            with tarfile.open(archive_path) as tarball:
+                for member in tarball:
+                    if member.isfile() and member.name.endswith('.json'):
+                        yield tarball.extractfile(member)
+            return
+
+        for dirpath, dirnames, filenames in os.walk(archive_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    if os.path.getsize(path) < MMAP_THRESHOLD:
+                        yield f
+                    else:
+                        yield mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def handle_archive_issue(self, issue):
+        bug_url = 'http://code.google.com/p/%s/issues/detail?id=%d' % (
+            self.tm.google_name, issue['id'])
+        gbp = GoogleBugParser(bug_url)
+        gbp.bug_atom = ArchiveIssueEntry(issue)
+        self.data_transits['bug']['update'](gbp.get_parsed_data_dict(self.tm))
+
+    def determine_if_finished(self):
+        # Everything is read as soon as it is asked for.
+        self.finish_import()
@@ -15,13 +15,93 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import codecs
+import collections
+import cStringIO
+import datetime
 import dateutil.parser
+import dateutil.tz
+import lxml.html
+import re
+import shelve
 import StringIO
+import threading
+import urllib
+import urlparse
 
 from decorator import decorator
 
 
-def string2naive_datetime(s):
+# The ISO 8601 dates nearly every tracker writes: GitHub's created_at,
+# Google's <published>, Bugzilla's creation_ts and newer Trac's span titles.
+ISO_DATETIME = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d+))?)?'
+    r' ?(?:(Z)|([+-])(\d\d):?(\d\d))?$')
+
+# Other formats trackers write their dates in, tried with strptime before
+# falling back to dateutil.
+DATE_FORMATS = [
+    '%m/%d/%Y %I:%M:%S %p',     # Older Trac
+    '%b %d, %Y %I:%M:%S %p',    # Trac 1.0
+    ]
+
+# A tracker writes all its dates the same way, so remember which format
+# worked for each one and try it first. See strptime_for_tracker.
+_date_format_by_tracker = {}
+
+
+def iso2naive_datetime(s):
+    """Parse an ISO 8601 date, returning it as a naive datetime in UTC, or
+    None if s is not one."""
+    match = ISO_DATETIME.match(s)
+    if match is None:
+        return None
+    (year, month, day, hour, minute, second, fraction,
+     utc, sign, offset_hours, offset_minutes) = match.groups()
+    d = datetime.datetime(int(year), int(month), int(day),
+                          int(hour), int(minute), int(second or 0),
+                          int((fraction or '0')[:6].ljust(6, '0')))
+    if sign:
+        offset = datetime.timedelta(hours=int(offset_hours),
+                                    minutes=int(offset_minutes))
+        if sign == '+':
+            d -= offset
+        else:
+            d += offset
+    return d
+
+
+def strptime_for_tracker(s, date_formats, tracker_key=None):
+    """Parse s with the first of date_formats that fits it, trying the one
+    that last fitted a date from tracker_key first. Returns None if none
+    of them fit."""
+    date_format = _date_format_by_tracker.get(tracker_key)
+    if date_format is not None:
+        try:
+            return datetime.datetime.strptime(s, date_format)
+        except ValueError:
+            pass
+    for date_format in date_formats:
+        try:
+            d = datetime.datetime.strptime(s, date_format)
+        except ValueError:
+            continue
+        _date_format_by_tracker[tracker_key] = date_format
+        return d
+    return None
+
+
+def string2naive_datetime(s, tracker_key=None):
+    s = s.strip()
+    d = iso2naive_datetime(s)
+    if d is not None:
+        return d
+
+    d = strptime_for_tracker(s, DATE_FORMATS, tracker_key)
+    if d is not None:
+        return d
+
     time_zoned = dateutil.parser.parse(s)
     if time_zoned.tzinfo:
         d_aware = time_zoned.astimezone(dateutil.tz.tzutc())
@@ -47,16 +127,209 @@ def cached_property(func):
     return property(get)
 
 
-def wrap_file_object_in_utf8_check(f):
-    ### For now, this does the horrifying thing of reading in the whole file.
-    ### Better ways would be apprediated.
-    bytes = f.read()
-    if type(bytes) == unicode:
-        as_unicode = bytes
+class BoundedDict(collections.OrderedDict):
+    '''A dict that holds at most max_size keys. Once it is full, storing a
+    new key forgets the one that was stored longest ago.'''
+
+    def __init__(self, max_size, *args, **kwargs):
+        self.max_size = max_size
+        collections.OrderedDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key in self:
+            del self[key]
+        collections.OrderedDict.__setitem__(self, key, value)
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+_stores = {}
+
+# How many keys open_store(None) holds before it forgets the oldest.
+MEMORY_STORE_SIZE = 10000
+
+
+def open_store(path=None):
+    '''Returns the store at path, opening it the first time it is asked for.
+
+    A store is a shelve file, so whatever is kept in it lasts between runs.
+    Its keys must be byte strings. If path is None, the store is a
+    BoundedDict of MEMORY_STORE_SIZE keys that lasts as long as this
+    process.'''
+    try:
+        return _stores[path]
+    except KeyError:
+        pass
+    if path is None:
+        store = BoundedDict(MEMORY_STORE_SIZE)
     else:
-        as_unicode = unicode(bytes, 'utf-8-sig')
-    as_utf8 = as_unicode.encode('utf-8')
-    return StringIO.StringIO(as_utf8)
+        store = shelve.open(path)
+        atexit.register(store.close)
+    _stores[path] = store
+    return store
+
+
+def set_query_params(url, params):
+    '''Returns url with each (key, value) pair in params set in its query
+    string, replacing any values those keys already had.'''
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    keys = set(key for (key, value) in params)
+    new_params = [(key, value) for (key, value) in
+                  urlparse.parse_qsl(query, keep_blank_values=True)
+                  if key not in keys]
+    new_params.extend(params)
+    return urlparse.urlunsplit(
+        (scheme, netloc, path, urllib.urlencode(new_params), fragment))
+
+
+def wrap_file_object_in_utf8_check(f):
+    '''Returns a file-like iterator over the lines of f, each one checked
+    and re-encoded as UTF-8. Lines are decoded as they are read, so the
+    whole file is never held in memory; csv.DictReader can consume the
+    result directly.'''
+    return UTF8CheckedFile(f)
+
+
+class UTF8CheckedFile(object):
+    '''Decodes the lines of a file object incrementally. Byte strings must
+    be valid UTF-8 (a UnicodeDecodeError is raised on the first bad line),
+    Unicode lines are passed through, and a leading BOM is dropped.'''
+
+    def __init__(self, f):
+        self._lines = iter(f)
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._first_line = True
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            try:
+                line = self._lines.next()
+            except StopIteration:
+                # Flush the decoder, so that a truncated multi-byte
+                # sequence at the very end still raises.
+                rest = self._decoder.decode('', True)
+                if rest:
+                    return rest.encode('utf-8')
+                raise
+            if type(line) == unicode:
+                as_unicode = line
+                if self._first_line:
+                    as_unicode = as_unicode.lstrip(u'\ufeff')
+            else:
+                as_unicode = self._decoder.decode(line)
+            self._first_line = False
+            if as_unicode:
+                return as_unicode.encode('utf-8')
+
+    def readline(self):
+        try:
+            return self.next()
+        except StopIteration:
+            return ''
+
+    def read(self):
+        return ''.join(self)
+
+
+class UTF8ValidatedFile(object):
+    '''Hands on the lines of a file object of UTF-8 bytes as they are,
+    raising a UnicodeDecodeError on the first line that is not valid
+    UTF-8. Unlike UTF8CheckedFile, nothing is re-encoded.'''
+
+    def __init__(self, f):
+        self._lines = iter(f)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self._lines.next()
+        # A newline byte is never part of a multi-byte sequence, so each
+        # line can be checked on its own.
+        line.decode('utf-8')
+        return line
+
+    def readline(self):
+        try:
+            return self.next()
+        except StopIteration:
+            return ''
+
+    def read(self):
+        return ''.join(self)
+
+
+def utf8_file_from_bytes(body, encoding=None):
+    '''Returns a file-like object over body that yields UTF-8 bytes, for
+    handing to csv readers. If body is already UTF-8 (or plain ASCII), it
+    is read in place with no copy, and each line is only checked; anything
+    else is transcoded line by line. Either way, bytes that are not valid
+    in their encoding raise a UnicodeDecodeError.'''
+    if type(body) == unicode:
+        return UTF8CheckedFile(StringIO.StringIO(body))
+    if encoding and codecs.lookup(encoding).name not in ('utf-8', 'ascii'):
+        return UTF8CheckedFile(codecs.iterdecode(
+            StringIO.StringIO(body), encoding))
+    f = cStringIO.StringIO(body)
+    if body.startswith(codecs.BOM_UTF8):
+        f.seek(len(codecs.BOM_UTF8))
+    return UTF8ValidatedFile(f)
+
+
+_html_parsers = threading.local()
+
+
+def html_parser_for_encoding(encoding):
+    '''Returns an lxml HTML parser that decodes documents as encoding, so
+    raw response bodies can be parsed without decoding them first. lxml
+    parsers must not be shared between threads, so each thread keeps its
+    own.'''
+    try:
+        parsers = _html_parsers.by_encoding
+    except AttributeError:
+        parsers = _html_parsers.by_encoding = {}
+    try:
+        return parsers[encoding]
+    except KeyError:
+        parser = parsers[encoding] = lxml.html.HTMLParser(encoding=encoding)
+        return parser
+
+
+class KeywordMatcher(object):
+    """
+    The comma-separated keywords a tracker model gives as its
+    bitesized_text or documentation_text, compiled so that each bug can be
+    checked against them without splitting them up again.
+    """
+    def __init__(self, text):
+        self.keywords = frozenset(text.split(','))
+        # Longest first, so the alternation prefers whole keywords.
+        self.pattern = re.compile('|'.join(
+            re.escape(keyword)
+            for keyword in sorted(self.keywords, key=len, reverse=True)))
+
+    def any_of(self, values):
+        """Whether any of values, such as a bug's labels, is a keyword."""
+        return not self.keywords.isdisjoint(values)
+
+    def in_text(self, text):
+        """Whether any keyword appears anywhere in text."""
+        return self.pattern.search(text) is not None
+
+
+_keyword_matchers = {}
+
+
+def keyword_matcher(text):
+    '''Returns the KeywordMatcher for text, compiling it the first time.'''
+    try:
+        return _keyword_matchers[text]
+    except KeyError:
+        matcher = _keyword_matchers[text] = KeywordMatcher(text)
+        return matcher
 
 
 @decorator
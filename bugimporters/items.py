@@ -23,3 +23,113 @@ class ParsedBug(scrapy.item.Item):
     as_appears_in_distribution = scrapy.item.Field()
     good_for_newcomers = scrapy.item.Field()
     concerns_just_documentation = scrapy.item.Field()
+
+
+# The fields of ParsedBug, in the order BugRecord keeps them.
+BUG_FIELDS = (
+    '_project_name',
+    '_tracker_name',
+    '_deleted',
+    'title',
+    'description',
+    'status',
+    'importance',
+    'people_involved',
+    'date_reported',
+    'last_touched',
+    'submitter_username',
+    'submitter_realname',
+    'canonical_bug_link',
+    'looks_closed',
+    'last_polled',
+    'as_appears_in_distribution',
+    'good_for_newcomers',
+    'concerns_just_documentation',
+    )
+
+_bug_field_set = frozenset(BUG_FIELDS)
+
+
+class BugRecord(object):
+    """
+    A bug as the parsers build it up. It reads and writes like a dict, or
+    a ParsedBug, with the same fields, but keeps them in slots, so it is
+    smaller and quicker to fill in than either. Importers that hand bugs
+    to Scrapy turn it into a ParsedBug with to_item() as they do.
+    """
+    __slots__ = BUG_FIELDS
+    __hash__ = None
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key not in _bug_field_set:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in _bug_field_set:
+            raise KeyError("BugRecord does not support field: %s" % (key,))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __contains__(self, key):
+        return key in _bug_field_set and hasattr(self, key)
+
+    def __iter__(self):
+        for key in BUG_FIELDS:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [getattr(self, key) for key in self]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self]
+
+    def get(self, key, default=None):
+        if key not in _bug_field_set:
+            return default
+        return getattr(self, key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def copy(self):
+        return BugRecord(self.items())
+
+    def to_item(self):
+        return ParsedBug(self.items())
+
+    def __eq__(self, other):
+        if not hasattr(other, 'keys'):
+            return NotImplemented
+        return dict(self.items()) == dict(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __reduce__(self):
+        return (BugRecord, (self.items(),))
+
+    def __repr__(self):
+        return 'BugRecord(%r)' % (dict(self.items()),)
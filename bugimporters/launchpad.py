@@ -22,6 +22,18 @@ import logging
 
 import bugimporters.items
 from bugimporters.base import BugImporter
+from bugimporters.helpers import BoundedDict, set_query_params
+
+
+# Bug owners, keyed by their person link. Prolific reporters own hundreds
+# of bugs, so every importer shares this cache and each person is fetched
+# once rather than once per bug.
+PERSON_CACHE_SIZE = 5000
+person_cache = BoundedDict(PERSON_CACHE_SIZE)
+
+# How many bugs' documents each importer keeps for bug tasks that turn up
+# after their bug has been handled.
+RECENT_BUG_DOCUMENTS_SIZE = 1000
 
 
 class LaunchpadBugImporter(BugImporter):
@@ -48,24 +60,83 @@ class LaunchpadBugImporter(BugImporter):
     The bug_link will return a https://launchpad.net/+apidoc/1.0.html#bug .
     This bug will contain a subscriptions_collection_link on with the
     total_size can be used for the people_involved.
+
+    The subscriptions collection always lives at <bug_link>/subscriptions,
+    so it is fetched at the same time as the bug. The owner_link is only
+    known once the bug arrives. A bug is handed on once its subscriptions
+    and its owner are both in.
+
+    Several bug_tasks can share one bug_link. The bug and its
+    subscriptions are only fetched once per run, for the first of them.
+
+    Once a query has been fetched to the end, its last_polled is set, and
+    later searches pass it as modified_since. A query any of whose pages,
+    or bugs, could not be fetched keeps its old last_polled, so the next
+    run tries them again.
     """
 
     def __init__(self, *args, **kwargs):
         super(LaunchpadBugImporter, self).__init__(*args, **kwargs)
+        # Maps a person link we are currently fetching to the list of
+        # LaunchpadBugs waiting on that person.
+        self.person_waiters = {}
+        # Maps the bug_link of a bug whose documents are still arriving to
+        # its LaunchpadBugDocuments.
+        self.bug_documents = {}
+        # The same, for the most recent bugs whose documents are all in.
+        self.recent_bug_documents = BoundedDict(RECENT_BUG_DOCUMENTS_SIZE)
 
     def process_queries(self, queries):
-        for query in queries:
-            url = query.get_query_url()
+        # Once every page has been fetched, the time this run started
+        # becomes each query's last_polled. The next run then only asks
+        # Launchpad for bug tasks modified since then.
+        self.run_started = datetime.datetime.utcnow()
+        self.queries = list(queries)
+        # Queries that something could not be fetched for in this run.
+        self.failed_queries = set()
+        self.bug_documents = {}
+        self.recent_bug_documents.clear()
+        for query in self.queries:
+            url = self.search_tasks_url(query.get_query_url(),
+                                        getattr(query, 'last_polled', None))
 
             logging.debug('querying %s', url)
-            self.add_url_to_waiting_list(
-                url=url,
-                callback=self.handle_bug_list)
-            query.last_polled = datetime.datetime.utcnow()
-            query.save()
+            self.add_bug_list_url(url, query)
         self.push_urls_onto_reactor()
 
-    def handle_bug_list(self, data):
+    def add_bug_list_url(self, url, query):
+        self.add_producer_url_to_waiting_list(
+            url=url,
+            callback=self.handle_bug_list,
+            c_args={'query': query},
+            errback=self.errback_bug_list,
+            e_args={'query': query})
+
+    def query_failed(self, query):
+        if query is not None:
+            self.failed_queries.add(query)
+
+    def errback_bug_list(self, failure, query):
+        self.query_failed(query)
+        return self.log_error(failure)
+
+    def search_tasks_url(self, url, modified_since=None):
+        """
+        Add the page size and modified_since parameters, if any, to a
+        searchTasks URL. Launchpad carries them over into each
+        next_collection_link.
+        """
+        params = []
+        page_size = getattr(self.tm, 'query_page_size', None)
+        if page_size:
+            params.append(('ws.size', str(page_size)))
+        if modified_since:
+            params.append(('modified_since', modified_since.isoformat()))
+        if not params:
+            return url
+        return set_query_params(url, params)
+
+    def handle_bug_list(self, data, query=None):
         """
         Callback for a collection of bug_tasks.
         """
@@ -73,16 +144,17 @@ class LaunchpadBugImporter(BugImporter):
         bug_collection = json.loads(data)
         url = bug_collection.get('next_collection_link')
         if url:  # Get the next page
-            self.add_url_to_waiting_list(
-                url=url,
-                callback=self.handle_bug_list)
+            # Ask for it ahead of this page's bugs, so that it is on its way
+            # while we work through them; unless the bugs from earlier pages
+            # have backed up, in which case it waits until they clear.
+            self.add_bug_list_url(url, query)
             self.push_urls_onto_reactor()
 
         # The bug data that show up in bug_collection['entries']
         # is equivalent to what we get back if we asked for the
         # data on that bug explicitly.
         self.process_bugs([(bug['web_link'], bug) for
-            bug in bug_collection['entries']])
+            bug in bug_collection['entries']], query)
 
     def _convert_web_to_api(self, url):
         parts = url.split('/')
@@ -92,13 +164,13 @@ class LaunchpadBugImporter(BugImporter):
             project, bug_id)
         return bug_api_url
 
-    def process_bugs(self, bug_list):
+    def process_bugs(self, bug_list, query=None):
         logging.debug('process_bugs')
         if not bug_list:
             self.determine_if_finished()
             return
         for bug_url, task_data in bug_list:
-            lp_bug = LaunchpadBug(self.tm)
+            lp_bug = LaunchpadBug(self.tm, query)
             if task_data:
                 self.handle_task_data_json(task_data, lp_bug)
             else:
@@ -106,9 +178,22 @@ class LaunchpadBugImporter(BugImporter):
                 self.add_url_to_waiting_list(
                         url=bug_api_url,
                         callback=self.handle_task_data,
-                        c_args={'lp_bug': lp_bug})
+                        c_args={'lp_bug': lp_bug},
+                        errback=self.errback_bug_part,
+                        e_args={'lp_bugs': [lp_bug]})
                 self.push_urls_onto_reactor()
 
+    def errback_bug_part(self, failure, lp_bugs):
+        # These bugs will not be handed on, so their queries are not done.
+        for lp_bug in lp_bugs:
+            self.query_failed(lp_bug.query)
+        return self.log_error(failure)
+
+    def errback_bug_documents(self, failure, bug_url):
+        documents = self.bug_documents.get(bug_url)
+        lp_bugs = documents.lp_bugs if documents is not None else []
+        return self.errback_bug_part(failure, lp_bugs)
+
     def handle_task_data(self, task_data, lp_bug):
         """
         Callback for a single bug_task.
@@ -128,50 +213,154 @@ class LaunchpadBugImporter(BugImporter):
 
         lp_bug.parse_task(data)
 
+        # Tasks of one bug in several projects or series all point at the
+        # same bug_link. The bug-level documents are fetched for the first
+        # of them, and shared with the rest.
         bug_url = data['bug_link']
+        documents = (self.bug_documents.get(bug_url) or
+                     self.recent_bug_documents.get(bug_url))
+        if documents is not None:
+            self.add_task_to_bug_documents(documents, lp_bug)
+            return
+        self.bug_documents[bug_url] = LaunchpadBugDocuments(lp_bug)
+
+        # The subscriptions collection hangs off the bug, so we can ask for
+        # it at the same time as the bug itself instead of waiting for the
+        # bug document to tell us where it is. Only the owner has to wait,
+        # since the owner_link is in the bug document.
+        sub_url = LaunchpadBug.subscriptions_link_from_bug_link(bug_url)
 
         self.add_url_to_waiting_list(
                 url=bug_url,
                 callback=self.handle_bug_data,
-                c_args={'lp_bug': lp_bug})
+                c_args={'bug_url': bug_url},
+                errback=self.errback_bug_documents,
+                e_args={'bug_url': bug_url})
+        self.add_url_to_waiting_list(
+                url=sub_url,
+                callback=self.handle_subscriptions_data,
+                c_args={'bug_url': bug_url},
+                errback=self.errback_bug_documents,
+                e_args={'bug_url': bug_url})
         self.push_urls_onto_reactor()
 
-    def handle_bug_data(self, bug_data, lp_bug):
+    def add_task_to_bug_documents(self, documents, lp_bug):
+        """
+        Share a bug's documents with another of its tasks, using whichever
+        of them have already arrived.
+        """
+        if not documents.complete():
+            documents.lp_bugs.append(lp_bug)
+        if documents.bug is not None:
+            self.handle_bug(documents.bug, lp_bug)
+        if documents.subscriptions is not None:
+            self.handle_subscriptions(documents.subscriptions, lp_bug)
+
+    def handle_bug_data(self, bug_data, bug_url):
         """
         Callback for a bug.
         """
         logging.debug('handle_bug_data')
-        data = json.loads(bug_data)
-        lp_bug.parse_bug(data)
+        documents = self.bug_documents[bug_url]
+        documents.bug = json.loads(bug_data)
+        for lp_bug in documents.lp_bugs:
+            self.handle_bug(documents.bug, lp_bug)
+        self.retire_bug_documents_if_complete(bug_url, documents)
 
-        sub_url = data['subscriptions_collection_link']
-        self.add_url_to_waiting_list(
-                url=sub_url,
-                callback=self.handle_subscriptions_data,
-                c_args={'lp_bug': lp_bug})
-        self.push_urls_onto_reactor()
+    def handle_bug(self, bug, lp_bug):
+        lp_bug.parse_bug(bug)
+
+        self.request_person(lp_bug)
 
-    def handle_subscriptions_data(self, sub_data, lp_bug):
+    def handle_subscriptions_data(self, sub_data, bug_url):
         """
         Callback for collection of bug_subscription.
         """
         logging.debug('handle_subscriptions_data')
-        data = json.loads(sub_data)
-        lp_bug.parse_subscriptions(data)
+        documents = self.bug_documents[bug_url]
+        documents.subscriptions = json.loads(sub_data)
+        for lp_bug in documents.lp_bugs:
+            self.handle_subscriptions(documents.subscriptions, lp_bug)
+        self.retire_bug_documents_if_complete(bug_url, documents)
+
+    def retire_bug_documents_if_complete(self, bug_url, documents):
+        """
+        Once both of a bug's documents are in, move them to the bounded
+        recent_bug_documents, so that later tasks of the bug can still use
+        them without the index growing for the whole run.
+        """
+        if not documents.complete():
+            return
+        documents.lp_bugs = []
+        del self.bug_documents[bug_url]
+        self.recent_bug_documents[bug_url] = documents
+
+    def handle_subscriptions(self, subscriptions, lp_bug):
+        lp_bug.parse_subscriptions(subscriptions)
+
+        self.bug_part_done(lp_bug, 'subscriptions')
+
+    def request_person(self, lp_bug):
+        """
+        Get the owner of lp_bug, from the person cache if we can.
 
+        Lookups of a person who is already being fetched join the queue of
+        bugs waiting on that fetch, rather than asking for the same URL
+        again.
+        """
+        owner_link = lp_bug.owner_link
+        person = person_cache.get(owner_link)
+        if person is not None:
+            self.handle_person(person, lp_bug)
+            return
+
+        waiters = self.person_waiters.get(owner_link)
+        if waiters is not None:
+            waiters.append(lp_bug)
+            return
+
+        self.person_waiters[owner_link] = [lp_bug]
         self.add_url_to_waiting_list(
-                url=lp_bug.owner_link,
+                url=owner_link,
                 callback=self.handle_user_data,
-                c_args={'lp_bug': lp_bug})
+                c_args={'owner_link': owner_link},
+                errback=self.errback_user_data,
+                e_args={'owner_link': owner_link})
         self.push_urls_onto_reactor()
 
-    def handle_user_data(self, user_data, lp_bug):
+    def handle_user_data(self, user_data, owner_link):
         """
         Callback for person.
         """
         logging.debug('handle_user_data')
         data = json.loads(user_data)
-        lp_bug.parse_user(data)
+        # Only keep what we need from the (rather large) person document.
+        person = {'name': data['name'],
+                  'display_name': data['display_name']}
+        person_cache[owner_link] = person
+
+        for lp_bug in self.person_waiters.pop(owner_link, []):
+            self.handle_person(person, lp_bug)
+
+    def errback_user_data(self, failure, owner_link):
+        waiters = self.person_waiters.pop(owner_link, [])
+        logging.error("Could not fetch %s, so %d bug(s) were dropped.",
+                      owner_link, len(waiters))
+        return self.errback_bug_part(failure, waiters)
+
+    def handle_person(self, person, lp_bug):
+        lp_bug.parse_user(person)
+
+        self.bug_part_done(lp_bug, 'owner')
+
+    def bug_part_done(self, lp_bug, part):
+        """
+        Record that one of the documents lp_bug needs has arrived, and
+        hand the bug on once they all have.
+        """
+        lp_bug.pending_parts.discard(part)
+        if lp_bug.pending_parts:
+            return
 
         full_data = lp_bug.get_data()
 
@@ -184,14 +373,48 @@ class LaunchpadBugImporter(BugImporter):
 
     def determine_if_finished(self):
         logging.debug('determine_if_finished')
+        if (not self.has_waiting_urls() and
+                sum(self.deferred_urls.values()) < 1):
+            # Every page has been fetched, so the next run can start from
+            # here; except for queries that lost a page or a bug on the way.
+            failed_queries = getattr(self, 'failed_queries', set())
+            for query in getattr(self, 'queries', []):
+                if query in failed_queries:
+                    continue
+                query.last_polled = self.run_started
+                query.save()
+            self.queries = []
         self.finish_import()
 
 
+class LaunchpadBugDocuments(object):
+    """
+    The bug and subscriptions documents of one Launchpad bug, and the
+    LaunchpadBugs (one per bug task) that share them.
+    """
+    def __init__(self, lp_bug):
+        self.bug = None
+        self.subscriptions = None
+        self.lp_bugs = [lp_bug]
+
+    def complete(self):
+        return self.bug is not None and self.subscriptions is not None
+
+
 class LaunchpadBug(object):
-    def __init__(self, tracker):
+    def __init__(self, tracker, query=None):
         self._tracker = tracker
-        self._data = bugimporters.items.ParsedBug()
+        # The query this bug turned up in, if any.
+        self.query = query
+        self._data = bugimporters.items.BugRecord()
         self._data['last_polled'] = datetime.datetime.utcnow()
+        # The documents still to arrive before this bug is complete. The
+        # bug document itself is implied by 'owner', which needs it.
+        self.pending_parts = set(['subscriptions', 'owner'])
+
+    @staticmethod
+    def subscriptions_link_from_bug_link(bug_link):
+        return bug_link.rstrip('/') + '/subscriptions'
 
     def _parse_datetime(self, ts):
         return dateutil.parser.parse(ts)
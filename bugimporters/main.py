@@ -6,17 +6,140 @@ import mock
 import importlib
 import scrapy.spider
 
+from bugimporters.helpers import keyword_matcher
+
+BUGIMPORTER_ALIASES = {
+    'trac': 'trac.TracBugImporter',
+    'roundup': 'roundup.RoundupBugImporter',
+    'github': 'github.GitHubBugImporter',
+    'google': 'google.GoogleBugImporter',
+    }
+
+# The keywords that decide good_for_newcomers and
+# concerns_just_documentation, under the names the backends use for them.
+KEYWORD_KEYS = ('bitesized_text', 'bitesized_tag',
+                'documentation_text', 'documentation_tag')
+
+
+class TrackerConfig(object):
+    """
+    One tracker from the configuration file, checked and prepared once, as
+    it is loaded, and read-only after that.
+
+    Every key of the entry becomes an attribute. Only tracker_name and
+    bugimporter are required. A mistake in the entry, down to a
+    bugimporter class that does not exist, raises ValueError here, rather
+    than partway through the crawl.
+
+    The importers get the compiled keyword matchers from
+    get_keyword_matcher(), and base_url always ends in a slash, so that
+    bug URLs can be joined onto it.
+    """
+    required_keys = ('tracker_name', 'bugimporter')
+
+    defaults = {
+        'old_trac': False,
+        'max_connections': 5,
+        'as_appears_in_distribution': '',
+        'queries': (),
+        }
+
+    def __init__(self, entry, validate=True):
+        values = dict(self.defaults)
+        values.update(entry)
+        if validate:
+            self.validate(values)
+            values['queries'] = tuple(values['queries'])
+            values['bugimporter'] = self.resolve_bugimporter(
+                values['bugimporter'])
+        if isinstance(values.get('base_url'), basestring):
+            values['base_url'] = self.normalize_base_url(values['base_url'])
+        values['keyword_matchers'] = dict(
+            (key, keyword_matcher(values[key])) for key in KEYWORD_KEYS
+            if isinstance(values.get(key), basestring))
+        self.__dict__.update(values)
+
+    @classmethod
+    def validate(cls, values):
+        name = values.get('tracker_name', '(unnamed tracker)')
+        for key in cls.required_keys:
+            if not values.get(key):
+                raise ValueError('%s: %s is required' % (name, key))
+
+        for key in KEYWORD_KEYS:
+            keywords = values.get(key)
+            if keywords is None:
+                continue
+            if not isinstance(keywords, basestring):
+                raise ValueError('%s: %s must be a comma-separated string'
+                                 % (name, key))
+
+        name_format = values.get('bug_project_name_format')
+        if name_format is not None:
+            try:
+                name_format.format(tracker_name='', product='', component='')
+            except (KeyError, IndexError, ValueError, AttributeError), e:
+                raise ValueError('%s: bad bug_project_name_format %r: %s'
+                                 % (name, name_format, e))
+
+        try:
+            cls.load_bugimporter(cls.resolve_bugimporter(values['bugimporter']))
+        except (ImportError, AttributeError), e:
+            raise ValueError('%s: bad bugimporter %r: %s'
+                             % (name, values['bugimporter'], e))
+
+    @staticmethod
+    def resolve_bugimporter(bugimporter):
+        if '.' not in bugimporter:
+            try:
+                bugimporter = BUGIMPORTER_ALIASES[bugimporter]
+            except KeyError:
+                raise ValueError('Unknown bugimporter: %s' % (bugimporter,))
+        return bugimporter
+
+    @staticmethod
+    def load_bugimporter(bugimporter):
+        module, class_name = bugimporter.split('.', 1)
+        bug_import_module = importlib.import_module('bugimporters.%s' % (
+                module,))
+        return getattr(bug_import_module, class_name)
+
+    @staticmethod
+    def normalize_base_url(base_url):
+        base_url = base_url.strip()
+        if not base_url.endswith('/'):
+            base_url += '/'
+        return base_url
+
+    def get_base_url(self):
+        return self.base_url
+
+    def get_keyword_matcher(self, key):
+        return self.keyword_matchers.get(key)
+
+    def get_bug_import_class(self):
+        return self.load_bugimporter(self.resolve_bugimporter(self.bugimporter))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TrackerConfig is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError('TrackerConfig is read-only')
+
+    def __repr__(self):
+        return '<TrackerConfig %s>' % (
+            getattr(self, 'tracker_name', '(unnamed tracker)'),)
+
+
 def dict2obj(d):
-    class Trivial(object):
-        def get_base_url(self):
-            return self.base_url
-    ret = Trivial()
-    for thing in d:
-        setattr(ret, thing, d[thing])
-    ret.old_trac = False # FIXME, hack
-    ret.max_connections = 5 # FIXME, hack
-    ret.as_appears_in_distribution = ''# FIXME, hack
-    return ret
+    '''Returns d as an object, with its keys as attributes, without the
+    checks a TrackerConfig makes of a configured tracker.'''
+    return TrackerConfig(d, validate=False)
+
+
+def load_tracker_configs(data):
+    return [TrackerConfig(d) for d in data]
+
 
 class FakeReactorManager(object):
     def __init__(self):
@@ -38,9 +161,7 @@ def main(raw_arguments):
             yaml.safe_dump(output, output_file)
 
 def main_worker(data):
-    objs = []
-    for d in data:
-        objs.append(dict2obj(d))
+    objs = load_tracker_configs(data)
 
     all_bug_data = []
     for obj in objs:
@@ -52,21 +173,7 @@ def main_worker(data):
                     'update': bug_transit,
                     'delete_by_url': lambda *args: {}}
 
-        bugimporter_aliases = {
-            'trac': 'trac.TracBugImporter',
-            'roundup': 'roundup.RoundupBugImporter',
-            'github': 'github.GitHubBugImporter',
-            'google': 'google.GoogleBugImporter',
-            }
-
-        raw_bug_importer = obj.bugimporter
-        if '.' not in raw_bug_importer:
-            raw_bug_importer = bugimporter_aliases[raw_bug_importer]
-
-        module, class_name = raw_bug_importer.split('.', 1)
-        bug_import_module = importlib.import_module('bugimporters.%s' % (
-                module,))
-        bug_import_class = getattr(bug_import_module, class_name)
+        bug_import_class = obj.get_bug_import_class()
         bug_importer = bug_import_class(
             obj, FakeReactorManager(),
             data_transits={'bug': generate_bug_transit(),
@@ -100,29 +207,15 @@ class BugImportSpider(scrapy.spider.BaseSpider):
     name = "Spider for importing using oh-bugimporters"
 
     def start_requests(self):
-        objs = []
-        for d in self.input_data:
-            objs.append(dict2obj(d))
+        objs = load_tracker_configs(self.input_data)
 
         for obj in objs:
-            bugimporter_aliases = {
-                'trac': 'trac.TracBugImporter',
-                'roundup': 'roundup.RoundupBugImporter',
-                'github': 'github.GitHubBugImporter',
-                'google': 'google.GoogleBugImporter',
-                }
-
-            raw_bug_importer = obj.bugimporter
-            if '.' not in raw_bug_importer:
-                raw_bug_importer = bugimporter_aliases[raw_bug_importer]
-
-            module, class_name = raw_bug_importer.split('.', 1)
-            bug_import_module = importlib.import_module('bugimporters.%s' % (
-                    module,))
-            bug_import_class = getattr(bug_import_module, class_name)
+            bug_import_class = obj.get_bug_import_class()
             bug_importer = bug_import_class(
                 obj, reactor_manager=None,
                 data_transits=None)
+            if hasattr(self, '_crawler'):
+                bug_importer.crawler_stats = self.crawler.stats
             class StupidQuery(object):
                 def __init__(self, url):
                     self.url = url
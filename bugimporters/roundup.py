@@ -16,9 +16,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import cStringIO
 import datetime
 import logging
 import lxml
+import lxml.cssselect
 import re
 import urlparse
 import scrapy.http
@@ -29,11 +31,34 @@ except ImportError:
     from unicodecsv import UnicodeDictReader as DictReader
 
 import bugimporters.items
-from bugimporters.helpers import cached_property
+from bugimporters.helpers import (cached_property, html_parser_for_encoding,
+        strptime_for_tracker)
 from bugimporters.base import BugImporter
 
 
+# Compiled once, rather than for every issue page we parse.
+AUTHOR_RE = re.compile(r"Author: (([^(]*) \()?([^)]*)")
+# Some trackers follow the nosy list on the issue page with its length.
+NOSY_COUNT_RE = re.compile(r"\(\d+\)$")
+SYNOPSIS_SELECTOR = lxml.cssselect.CSSSelector(
+    'form[name=itemSynopsis] + p > b, form[name=itemSynopsis] + hr + p > b, '
+    'form[name=itemSynopsis] + p > strong, form[name=itemSynopsis] + hr + p > strong')
+MESSAGE_SELECTOR = lxml.cssselect.CSSSelector('table.messages td.content')
+
+# FIXME: I make guesses as to the timezone.
+DATE_FORMATS = [
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d.%H:%M",
+    "%Y-%m-%d.%H:%M:%S"]
+
+
 class RoundupBugImporter(BugImporter):
+    # The issue properties requested when issues are exported in batches.
+    # The tracker's bitesized and documentation properties are added to
+    # these.
+    export_columns = ['id', 'title', 'status', 'priority', 'creation',
+                      'activity', 'creator', 'nosy']
 
     def __init__(self, *args, **kwargs):
         super(RoundupBugImporter, self).__init__(*args, **kwargs)
@@ -50,16 +75,19 @@ class RoundupBugImporter(BugImporter):
         return self.handle_query_csv(response.body)
 
     def handle_query_csv(self, query_csv):
-        # Turn the string into a list so csv.DictReader can handle it.
-        query_csv_list = query_csv.split('\n')
-        dictreader = DictReader(query_csv_list)
+        # Read the CSV in place rather than splitting it into a list.
+        dictreader = DictReader(cStringIO.StringIO(query_csv))
         bug_ids = [int(line['id']) for line in dictreader]
+        if self.get_export_batch_size():
+            return self.prepare_export_urls(bug_ids)
         return self.prepare_bug_urls(bug_ids)
 
+    def bug_id2url(self, bug_id):
+        return urlparse.urljoin(self.tm.get_base_url(), "issue%d" % bug_id)
+
     def prepare_bug_urls(self, bug_ids):
         # Convert the obtained bug ids to URLs.
-        bug_url_list = [urlparse.urljoin(self.tm.get_base_url(),
-                                "issue%d" % bug_id) for bug_id in bug_ids]
+        bug_url_list = [self.bug_id2url(bug_id) for bug_id in bug_ids]
 
         # Put the bug list in the form required for process_bugs.
         # The second entry of the tuple is None as Roundup never supplies data
@@ -79,12 +107,20 @@ class RoundupBugImporter(BugImporter):
     def handle_bug_html_response(self, response):
         # Create a RoundupBugParser instance to store the bug data
         rbp = RoundupBugParser(response.request.url)
-        return self.handle_bug_html(response.body, rbp)
+        return self.handle_bug_html(response.body, rbp,
+                                    encoding=response.encoding)
 
-    def handle_bug_html(self, bug_html, rbp):
+    def handle_bug_html(self, bug_html, rbp, encoding=None):
         # Pass the RoundupBugParser the HTML data.
-        rbp.set_bug_html_data(bug_html)
+        return self.parse_then(self.handle_parsed_bug_html,
+                               self.set_bug_html_data, rbp, bug_html, encoding)
+
+    @staticmethod
+    def set_bug_html_data(rbp, bug_html, encoding):
+        rbp.set_bug_html_data(bug_html, encoding=encoding)
+        return rbp
 
+    def handle_parsed_bug_html(self, rbp):
         # Get the parsed data dict from the RoundupBugParser.
         data = rbp.get_parsed_data_dict(self.tm)
         data.update({
@@ -92,7 +128,113 @@ class RoundupBugImporter(BugImporter):
             '_tracker_name': self.tm.tracker_name
         })
 
-        return bugimporters.items.ParsedBug(data)
+        return data.to_item()
+
+    ### Batched CSV export
+    #
+    # If the tracker sets export_batch_size, issues are not fetched one
+    # HTML page at a time. Instead, Roundup's export_csv action is asked
+    # for the interesting columns of export_batch_size issues at once.
+    #
+    # The export cannot provide the description, the submitter's real name
+    # or the list of people who wrote messages. Without
+    # export_html_fallback the records are degraded: description and
+    # submitter_realname are left blank, and people_involved counts only
+    # the submitter and the nosy list, so a message author who has left
+    # the nosy list is missed. If the tracker sets export_html_fallback,
+    # each issue's page is fetched for those fields as well, and the
+    # record matches one imported from the page alone; that costs as many
+    # requests as not batching at all. Issues missing from the export, or
+    # whose row lacks a column we need, are imported from their HTML page
+    # as usual.
+
+    def get_export_batch_size(self):
+        return getattr(self.tm, 'export_batch_size', None)
+
+    def get_export_property(self, kind):
+        # bitesized_field and documentation_field name the label shown on
+        # the issue page, e.g. 'Keywords'. The export wants the property
+        # name, which is usually the same in lower case; trackers where it
+        # isn't can set bitesized_property or documentation_property.
+        field = getattr(self.tm, kind + '_field', None)
+        if not field:
+            return None
+        return getattr(self.tm, kind + '_property', None) or field.lower()
+
+    def get_export_columns(self):
+        columns = list(self.export_columns)
+        for kind in ('bitesized', 'documentation'):
+            prop = self.get_export_property(kind)
+            if prop and prop not in columns:
+                columns.append(prop)
+        return columns
+
+    def prepare_export_urls(self, bug_ids):
+        batch_size = self.get_export_batch_size()
+        columns = ','.join(self.get_export_columns())
+        for i in xrange(0, len(bug_ids), batch_size):
+            batch = bug_ids[i:i + batch_size]
+            export_url = urlparse.urljoin(
+                self.tm.get_base_url(),
+                'issue?@action=export_csv&@columns=%s&@filter=id&id=%s' % (
+                    columns, ','.join(str(bug_id) for bug_id in batch)))
+            r = scrapy.http.Request(
+                url=export_url,
+                callback=self.handle_export_csv_response)
+            r.meta['bug_ids'] = batch
+            yield r
+
+    def handle_export_csv_response(self, response):
+        return self.handle_export_csv(response.body,
+                                      response.request.meta['bug_ids'])
+
+    def handle_export_csv(self, export_csv, bug_ids):
+        html_bug_ids = set(bug_ids)
+        fetch_html = getattr(self.tm, 'export_html_fallback', False)
+        bitesized_property = self.get_export_property('bitesized')
+        documentation_property = self.get_export_property('documentation')
+
+        for row in DictReader(cStringIO.StringIO(export_csv)):
+            try:
+                bug_id = int(row['id'])
+            except (KeyError, ValueError):
+                logging.warning("Skipping odd Roundup export row: %s", row)
+                continue
+            if bug_id not in html_bug_ids:
+                continue
+
+            rbp = RoundupBugParser(self.bug_id2url(bug_id))
+            try:
+                data = rbp.get_parsed_data_dict_from_export(
+                    self.tm, row, bitesized_property, documentation_property)
+            except (KeyError, ValueError):
+                # The export left out something we need, so this issue
+                # falls back to its HTML page.
+                logging.info("Roundup export row for issue %d is "
+                             "incomplete; fetching its page.", bug_id)
+                continue
+            data['_tracker_name'] = self.tm.tracker_name
+            html_bug_ids.discard(bug_id)
+
+            if fetch_html:
+                r = scrapy.http.Request(
+                    url=rbp.bug_url,
+                    callback=self.handle_bug_html_fallback_response)
+                r.meta['partial_bug'] = data
+                yield r
+            else:
+                yield data.to_item()
+
+        # Anything the export did not give us is imported the slow way.
+        for r in self.prepare_bug_urls(sorted(html_bug_ids)):
+            yield r
+
+    def handle_bug_html_fallback_response(self, response):
+        rbp = RoundupBugParser(response.request.url)
+        rbp.set_bug_html_data(response.body, encoding=response.encoding)
+        data = response.request.meta['partial_bug']
+        data.update(rbp.get_message_data_dict(data['submitter_username']))
+        return data.to_item()
 
 
 class RoundupBugParser(object):
@@ -104,71 +246,173 @@ class RoundupBugParser(object):
     def bug_html_url(self):
         return self.bug_url
 
-    def set_bug_html_data(self, bug_html):
-        self.bug_html = lxml.html.document_fromstring(bug_html)
+    def set_bug_html_data(self, bug_html, encoding=None):
+        if encoding and type(bug_html) != unicode:
+            # Let lxml decode the raw bytes itself.
+            self.bug_html = lxml.html.document_fromstring(
+                bug_html, parser=html_parser_for_encoding(encoding))
+        else:
+            self.bug_html = lxml.html.document_fromstring(bug_html)
 
     @staticmethod
-    def roundup_tree2metadata_dict(tree):
-        '''
-        Input: tree is a parsed HTML document that lxml.html can understand.
-
-        Output: For each <th>key</th><td>value</td> in the tree,
-        append {'key': 'value'} to a dictionary.
-        Return the dictionary when done.'''
-
-        ret = {}
-        for th in tree.cssselect('th'):
+    def scan_th_elements(tree):
+        '''Walks every <th> in the tree once.
+
+        Returns a (metadata, authors) tuple: metadata maps each
+        <th>key</th><td>value</td> pair to {'key': 'value'}, and authors
+        maps username=>realname for every "Author:" heading.'''
+        metadata = {}
+        authors = {}
+        for th in tree.iter('th'):
+            text = th.text_content().strip()
+            if text.startswith('Author:'):
+                match = AUTHOR_RE.match(text)
+                if match:
+                    _, realname, username = match.groups()
+                    authors[username] = realname
             # Get next sibling
-            key_with_colon = th.text_content().strip()
-            key = key_with_colon.rsplit(':', 1)[0]
             try:
                 td = th.itersiblings().next()
             except StopIteration:
                 # If there isn't an adjacent TD, don't use this TH.
                 continue
-            value = td.text_content().strip()
-            ret[key] = value
+            key = text.rsplit(':', 1)[0]
+            metadata[key] = td.text_content().strip()
+        return metadata, authors
 
-        return ret
+    @staticmethod
+    def roundup_tree2metadata_dict(tree):
+        '''
+        Input: tree is a parsed HTML document that lxml.html can understand.
+
+        Output: For each <th>key</th><td>value</td> in the tree,
+        append {'key': 'value'} to a dictionary.
+        Return the dictionary when done.'''
+        return RoundupBugParser.scan_th_elements(tree)[0]
 
     def get_all_submitter_realname_pairs(self, tree):
         '''Input: the tree
         Output: A dictionary mapping username=>realname'''
+        return self.scan_th_elements(tree)[1]
+
+    def get_submitter_realname(self, tree, submitter_username):
+        return self.get_all_submitter_realname_pairs(tree).get(
+            submitter_username)
 
-        ret = {}
-        for th in tree.cssselect('th'):
-            match = re.match("Author: (([^(]*) \()?([^)]*)", th.text_content().strip())
-            if match:
-                _, realname, username = match.groups()
-                ret[username] = realname
+    def str2datetime_obj(self, date_string, tracker_key=None):
+        ret = strptime_for_tracker(date_string, DATE_FORMATS, tracker_key)
+        if ret is None:
+            raise ValueError("Unrecognised Roundup date: %r" % (date_string,))
         return ret
 
-    def get_submitter_realname(self, tree, submitter_username):
-        try:
-            return self.get_all_submitter_realname_pairs(tree)[submitter_username]
-        except KeyError:
-            return None
+    @staticmethod
+    def get_closed_status_set(tm):
+        # Create a lookup set where all the values in here represent
+        # status values that "look closed"
+        closed_status_set = set()
+        for status_name in tm.closed_status.split(','):
+            closed_status_set.add(status_name.strip().lower())
+        return closed_status_set
+
+    @staticmethod
+    def split_export_multilink(value):
+        '''Roundup exports a multilink property as its labels joined by
+        semicolons (older versions write a Python list of ids instead).
+        Returns the individual values.'''
+        value = value.strip().strip('[]')
+        separator = ';' if ';' in value else ','
+        values = [v.strip().strip('\'"') for v in value.split(separator)]
+        return [v for v in values if v]
+
+    @staticmethod
+    def split_nosy_list(value):
+        '''Returns the usernames in the nosy list shown on an issue page.'''
+        value = NOSY_COUNT_RE.sub('', value.strip())
+        return [v.strip() for v in value.split(',') if v.strip()]
 
-    def str2datetime_obj(self, date_string, possibility_index=0):
-        # FIXME: I make guesses as to the timezone.
-        possible_date_strings = [
-                "%Y-%m-%d %H:%M",
-                "%Y-%m-%d %H:%M:%S",
-                "%Y-%m-%d.%H:%M",
-                "%Y-%m-%d.%H:%M:%S"]
+    @staticmethod
+    def count_people_involved(submitter_username, nosy, authors=()):
+        '''Counts the submitter, everyone on the nosy list and every
+        message author once each. The export only knows the first two, so
+        both import modes agree whenever the authors are still nosy.'''
+        people = set(nosy) | set(authors)
+        if submitter_username:
+            people.add(submitter_username)
+        return len(people)
+
+    def get_description(self):
+        # For description, just grab the first "message"
         try:
-            return datetime.datetime.strptime(date_string, possible_date_strings[possibility_index])
-        except ValueError:
-            # A keyerror raised here means we ran out of a possibilities.
-            return self.str2datetime_obj(date_string, possibility_index=possibility_index + 1)
+            return MESSAGE_SELECTOR(self.bug_html)[0].text_content().strip()
+        except IndexError:
+            # This Roundup issue has no messages.
+            return ""
+
+    def get_message_data_dict(self, submitter_username):
+        '''Returns the fields that only the issue page can tell us.'''
+        metadata_dict, authors = self.scan_th_elements(self.bug_html)
+        nosy = self.split_nosy_list(metadata_dict.get('Nosy List', ''))
+        return {
+            'description': self.get_description(),
+            'submitter_realname': authors.get(submitter_username),
+            'people_involved': self.count_people_involved(
+                submitter_username, nosy, authors),
+            }
+
+    def get_parsed_data_dict_from_export(self, tm, row,
+                                         bitesized_property=None,
+                                         documentation_property=None):
+        '''Builds a BugRecord from one row of an export_csv response.
+        Raises KeyError or ValueError if the row is missing something we
+        need.'''
+        status = row['status']
+        submitter_username = row['creator']
+        nosy = self.split_export_multilink(row.get('nosy', ''))
+
+        ret = bugimporters.items.BugRecord()
+        ret.update({'title': row['title'],
+               'description': '',
+               'importance': row['priority'],
+               'status': status,
+               'looks_closed': (status.lower() in
+                                self.get_closed_status_set(tm)),
+               'submitter_username': submitter_username,
+               'submitter_realname': '',
+               'people_involved': self.count_people_involved(
+                   submitter_username, nosy),
+               'date_reported': self.str2datetime_obj(
+                   row['creation'], tm.tracker_name).isoformat(),
+               'last_touched': self.str2datetime_obj(
+                   row['activity'], tm.tracker_name).isoformat(),
+               'canonical_bug_link': self.bug_url,
+               'last_polled': datetime.datetime.utcnow().isoformat(),
+               '_project_name': tm.tracker_name,
+               })
+
+        # Check for the bitesized keyword
+        if bitesized_property:
+            ret['good_for_newcomers'] = tm.get_keyword_matcher(
+                'bitesized_text').in_text(row[bitesized_property])
+        else:
+            ret['good_for_newcomers'] = False
+        # Check whether this is a documentation bug.
+        if documentation_property:
+            ret['concerns_just_documentation'] = tm.get_keyword_matcher(
+                'documentation_text').in_text(row[documentation_property])
+        else:
+            ret['concerns_just_documentation'] = False
+
+        # Set as_appears_in_distribution.
+        ret['as_appears_in_distribution'] = tm.as_appears_in_distribution
+
+        return ret
 
     def get_parsed_data_dict(self, tm):
-        metadata_dict = RoundupBugParser.roundup_tree2metadata_dict(self.bug_html)
+        # One pass over the page gets both the metadata table and the
+        # authors of every message.
+        metadata_dict, authors = self.scan_th_elements(self.bug_html)
 
-        data = [
-                x.text_content() for x in self.bug_html.cssselect(
-                    'form[name=itemSynopsis] + p > b, form[name=itemSynopsis] + hr + p > b, ' +
-                    'form[name=itemSynopsis] + p > strong, form[name=itemSynopsis] + hr + p > strong')]
+        data = [x.text_content() for x in SYNOPSIS_SELECTOR(self.bug_html)]
         if len(data) > 4:
             if data[-1] == metadata_dict['Status']:
                 data = data[:4]
@@ -180,32 +424,24 @@ class RoundupBugParser(object):
             logging.error("It was: %s", data)
             date_reported, submitter_username, last_touched, last_toucher = [None] * 4
 
-        # For description, just grab the first "message"
-        try:
-            description = self.bug_html.cssselect('table.messages td.content')[0].text_content().strip()
-        except IndexError:
-            # This Roundup issue has no messages.
-            description = ""
-
-        # Create a lookup set where all the values in here represent
-        # status values that "look closed"
-        closed_status_set = set()
-        for status_name in tm.closed_status.split(','):
-            closed_status_set.add(status_name.strip().lower())
+        description = self.get_description()
+        nosy = self.split_nosy_list(metadata_dict.get('Nosy List', ''))
+        closed_status_set = self.get_closed_status_set(tm)
 
-        ret = bugimporters.items.ParsedBug()
+        ret = bugimporters.items.BugRecord()
         ret.update({'title': metadata_dict['Title'],
                'description': description,
                'importance': metadata_dict['Priority'],
                'status': metadata_dict['Status'],
                'looks_closed': (metadata_dict['Status'].lower() in closed_status_set),
                'submitter_username': submitter_username,
-               'submitter_realname': self.get_submitter_realname(
-                   self.bug_html,
-                   submitter_username),
-               'people_involved': len(self.get_all_submitter_realname_pairs(self.bug_html)),
-               'date_reported': self.str2datetime_obj(date_reported).isoformat(),
-               'last_touched': self.str2datetime_obj(last_touched).isoformat(),
+               'submitter_realname': authors.get(submitter_username),
+               'people_involved': self.count_people_involved(
+                   submitter_username, nosy, authors),
+               'date_reported': self.str2datetime_obj(
+                   date_reported, tm.tracker_name).isoformat(),
+               'last_touched': self.str2datetime_obj(
+                   last_touched, tm.tracker_name).isoformat(),
                'canonical_bug_link': self.bug_url,
                'last_polled': datetime.datetime.utcnow().isoformat(),
                '_project_name': tm.tracker_name,
@@ -213,14 +449,16 @@ class RoundupBugParser(object):
 
         # Check for the bitesized keyword
         if tm.bitesized_field:
-            b_list = tm.bitesized_text.split(',')
-            ret['good_for_newcomers'] = any(b in metadata_dict.get(tm.bitesized_field, '') for b in b_list)
+            ret['good_for_newcomers'] = tm.get_keyword_matcher(
+                'bitesized_text').in_text(
+                metadata_dict.get(tm.bitesized_field, ''))
         else:
             ret['good_for_newcomers'] = False
         # Check whether this is a documentation bug.
         if tm.documentation_field:
-            d_list = tm.documentation_text.split(',')
-            ret['concerns_just_documentation'] = any(d in metadata_dict.get(tm.documentation_field, '') for d in d_list)
+            ret['concerns_just_documentation'] = tm.get_keyword_matcher(
+                'documentation_text').in_text(
+                metadata_dict.get(tm.documentation_field, ''))
         else:
             ret['concerns_just_documentation'] = False
 
@@ -2,6 +2,8 @@ import twisted
 
 from mock import Mock
 
+from bugimporters.helpers import keyword_matcher
+
 
 class TrackerModel(Mock):
     """This is a Mock, rather than a regular object,
@@ -9,6 +11,7 @@ class TrackerModel(Mock):
     object. Those method calls are not essential."""
 
     max_connections = 5
+    max_waiting_urls = None
     tracker_name = 'Twisted',
     base_url = 'http://twistedmatrix.com/trac/'
     bug_project_name_format = '{tracker_name}'
@@ -18,10 +21,21 @@ class TrackerModel(Mock):
     documentation_text = 'documentation'
     as_appears_in_distribution = ''
     old_trac = False
+    query_page_size = None
+    cache_path = None
+    fetch_comment_authors = False
+    comment_concurrency = None
+    fetch_submitter_realnames = False
+    user_cache_ttl = None
+    skip_pull_requests = False
+    parse_threads = None
 
     def get_base_url(self):
         return self.base_url
 
+    def get_keyword_matcher(self, key):
+        return keyword_matcher(getattr(self, key))
+
 class HaskellTrackerModel(TrackerModel):
     """This is a Mock for the Haskell(GHC) tracker. Since it uses Trac we
     just need to extend TrackerModel and overwrite it's specific bitesized
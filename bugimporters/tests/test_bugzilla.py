@@ -0,0 +1,34 @@
+import logging
+
+import lxml.etree
+
+from bugimporters.bugzilla import BugzillaBugImporter, KDEBugzilla
+from bugimporters.tests import ReactorManager, TrackerModel
+
+
+def kde_bug(product, component):
+    bug_xml = lxml.etree.XML(
+        '<bug><bug_id>1</bug_id><product>%s</product>'
+        '<component>%s</component></bug>' % (product, component))
+    return KDEBugzilla(bug_xml)
+
+
+class TestBugProjectName(object):
+    def setup_method(self, method):
+        self.im = BugzillaBugImporter(TrackerModel(), ReactorManager(),
+                                      bug_parser=KDEBugzilla)
+
+    def test_kde_names(self):
+        assert self.im.bug_project_name(kde_bug('kmail', 'ui')) == 'kmail'
+        assert self.im.bug_project_name(kde_bug('Phonon', 'ui')) == 'Phonon'
+        assert self.im.bug_project_name(kde_bug('docs', 'ui')) == \
+            'KDE documentation'
+
+    def test_unknown_pairs_are_worked_out_once(self, monkeypatch):
+        guesses = []
+        monkeypatch.setattr(logging, 'info',
+                            lambda *args: guesses.append(args))
+        for i in range(3):
+            assert self.im.bug_project_name(kde_bug('kfoo', 'ui')) == 'kfoo'
+        assert self.im.bug_project_name(kde_bug('kfoo', 'ui2')) == 'kfoo'
+        assert len(guesses) == 2
@@ -1,9 +1,20 @@
 import autoresponse
+import BaseHTTPServer
 import datetime
+import json
 import os
+import scrapy.dupefilter
+import scrapy.http
+import threading
+import time
+import twisted.internet.defer
+import urllib2
+import urlparse
 
 from bugimporters.base import printable_datetime
-from bugimporters.github import GitHubBugImporter
+from bugimporters.github import (GitHubBugImporter, GitHubGraphQLBugImporter,
+        RateLimit)
+import bugimporters.github
 import bugimporters.main
 from bugimporters.tests import TrackerModel
 
@@ -33,7 +44,7 @@ class TestGitHubBugImporter(object):
         spider.input_data = [self.tm.__dict__]
 
         url2filename = {
-            'https://api.github.com/repos/openhatch/tests/issues?state=open':
+            'https://api.github.com/repos/openhatch/tests/issues?state=open&per_page=100':
                 os.path.join(HERE, 'sample-data', 'github', 'issue-list'),
         }
         ar = autoresponse.Autoresponder(url2filename=url2filename,
@@ -73,7 +84,7 @@ class TestGitHubBugImporter(object):
         spider.input_data = [self.tm.__dict__]
 
         url2filename = {
-            'https://api.github.com/repos/openhatch/tests/issues?state=closed':
+            'https://api.github.com/repos/openhatch/tests/issues?state=closed&per_page=100':
                 os.path.join(HERE, 'sample-data', 'github', 'issue-list-closed'),
         }
         ar = autoresponse.Autoresponder(url2filename=url2filename,
@@ -129,3 +140,592 @@ class TestGitHubBugImporter(object):
         self.assertEqual(bug['good_for_newcomers'], True)
         self.assertEqual(bug['concerns_just_documentation'], False)
         self.assertEqual(bug['looks_closed'], False)
+
+
+class GitHubImporterTestCase(object):
+    '''Sets up a GitHubBugImporter, and answers its requests one at a
+    time.'''
+    importer_class = GitHubBugImporter
+
+    def setup_method(self, method):
+        bugimporters.github.rate_limit.clear()
+        bugimporters.github.graphql_rate_limit.clear()
+        self.tm = TrackerModel()
+        self.tm.tracker_name = 'openhatch tests'
+        self.tm.github_name = 'openhatch'
+        self.tm.github_repo = 'tests'
+        self.tm.bitesized_tag = 'lowfruit'
+        self.tm.documentation_tag = 'docs'
+        self.im = self.importer_class(self.tm)
+
+    def respond(self, request, filename=None, link=None, status=200,
+                headers=None):
+        headers = dict(headers or {})
+        if link:
+            headers['Link'] = link
+        body = ''
+        if isinstance(filename, list):
+            body = json.dumps(filename)
+        elif filename:
+            body = open(os.path.join(HERE, 'sample-data', 'github',
+                                     filename)).read()
+        response = scrapy.http.Response(url=request.url, body=body,
+                                        headers=headers, status=status)
+        response.request = request
+        return request.callback(response)
+
+    def first_request(self, query_url):
+        return list(self.im.process_queries(
+            [bugimporters.main.dict2obj({'get_query_url': lambda: query_url})]
+        ))[0]
+
+    @staticmethod
+    def fetch(request):
+        '''Sends request over HTTP, and hands the response to its
+        callback.'''
+        headers = dict((name, values[-1])
+                       for name, values in request.headers.items())
+        reply = urllib2.urlopen(urllib2.Request(
+            request.url, data=request.body or None, headers=headers))
+        response = scrapy.http.Response(url=request.url, body=reply.read(),
+                                        headers=dict(reply.info().items()),
+                                        status=reply.getcode())
+        response.request = request
+        return request.callback(response)
+
+    def crawl(self, requests):
+        '''Fetches requests, and whatever requests their responses lead
+        to, and returns the items found on the way.'''
+        items = []
+        work_queue = list(requests)
+        while work_queue:
+            thing = work_queue.pop(0)
+            if isinstance(thing, scrapy.http.Request):
+                work_queue.extend(self.fetch(thing))
+            else:
+                items.append(thing)
+        return items
+
+
+class TestGitHubPagination(GitHubImporterTestCase):
+    def test_first_page_asks_for_100(self):
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues?state=open')
+        assert request.url == ('https://api.github.com/repos/openhatch/tests/'
+                               'issues?state=open&per_page=100')
+
+    def test_page_size_in_query_is_kept(self):
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues?per_page=10')
+        assert request.url == ('https://api.github.com/repos/openhatch/tests/'
+                               'issues?per_page=10')
+
+    def test_remaining_pages_are_fetched_together(self):
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+        base = 'https://api.github.com/repos/openhatch/tests/issues?per_page=100'
+        results = self.respond(request, 'issue-list',
+                               link='<%s&page=2>; rel="next", '
+                                    '<%s&page=4>; rel="last"' % (base, base))
+
+        requests = [r for r in results if isinstance(r, scrapy.http.Request)]
+        assert [r.url for r in requests] == [
+            base + '&page=2', base + '&page=3', base + '&page=4']
+        assert len(results) == 4
+
+        # Those pages don't go looking for more.
+        results = self.respond(requests[-1], 'issue-list',
+                               link='<%s&page=1>; rel="first"' % base)
+        assert len(results) == 1
+
+    def test_last_page_has_no_next(self):
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+        base = 'https://api.github.com/repos/openhatch/tests/issues?per_page=100'
+        results = self.respond(request, 'issue-list',
+                               link='<%s&page=1>; rel="first"' % base)
+        assert len(results) == 1
+
+    def test_full_page_without_links_asks_for_the_next(self):
+        self.tm.query_page_size = 1
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+        results = self.respond(request, 'issue-list')
+        assert results[0].url == ('https://api.github.com/repos/openhatch/'
+                                  'tests/issues?per_page=1&page=2')
+        assert len(results) == 2
+
+
+class TestGitHubConditionalRequests(GitHubImporterTestCase):
+    def test_not_modified_uses_the_stored_body(self, tmpdir):
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        bug_url = 'https://api.github.com/repos/openhatch/tests/issues/42'
+        request = list(self.im.process_bugs([(bug_url, None)]))[0]
+        assert 'If-None-Match' not in request.headers
+        results = self.respond(request, 'issue-show',
+                               headers={'ETag': '"abc"'})
+        assert results[0]['title'] == 'yo dawg'
+
+        # A later run asks whether the issue has changed.
+        request = list(self.im.process_bugs([(bug_url, None)]))[0]
+        assert request.headers['If-None-Match'] == '"abc"'
+        assert 304 in request.meta['handle_httpstatus_list']
+        results = self.respond(request, status=304)
+        assert len(results) == 1
+        assert results[0]['title'] == 'yo dawg'
+
+    def test_rate_limited_request_is_retried_after_reset(self):
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+        reset = int(time.time()) + 600
+        result = self.respond(request, status=403, headers={
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(reset)})
+        assert isinstance(result, twisted.internet.defer.Deferred)
+        result.cancel()
+
+    def test_nothing_is_kept_without_a_cache_path(self):
+        bug_url = 'https://api.github.com/repos/openhatch/tests/issues/42'
+        request = list(self.im.process_bugs([(bug_url, None)]))[0]
+        self.respond(request, 'issue-show', headers={'ETag': '"abc"'})
+        assert not [key for key in self.im.store if key.startswith('etag:')]
+
+        request = list(self.im.process_bugs([(bug_url, None)]))[0]
+        assert 'If-None-Match' not in request.headers
+
+    def test_graphql_has_a_budget_of_its_own(self):
+        request = self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+        self.respond(request, 'issue-list', headers={
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(int(time.time()) + 600)})
+        assert bugimporters.github.rate_limit.exhausted()
+        assert not bugimporters.github.graphql_rate_limit.exhausted()
+
+
+class TestRateLimit(object):
+    def make_rate_limit(self, remaining, reset):
+        rate_limit = RateLimit()
+        rate_limit.update({'X-RateLimit-Limit': '5000',
+                           'X-RateLimit-Remaining': str(remaining),
+                           'X-RateLimit-Reset': str(reset)})
+        return rate_limit
+
+    def test_unknown_budget_does_not_wait(self):
+        assert RateLimit().reserve(10) == 0
+
+    def test_plenty_left_does_not_wait(self):
+        assert self.make_rate_limit(4000, 3600).reserve(10, now=0) == 0
+
+    def test_low_budget_is_spread_over_the_window(self):
+        rate_limit = self.make_rate_limit(100, 1000)
+        assert rate_limit.reserve(1, now=0) == 0
+        assert rate_limit.reserve(1, now=0) == 10
+        assert round(rate_limit.reserve(1, now=0)) == 20
+
+    def test_spent_budget_waits_for_reset(self):
+        rate_limit = self.make_rate_limit(0, 1000)
+        assert rate_limit.reserve(1, now=400) == 600
+        # Once the window is over, the budget is assumed refilled.
+        assert rate_limit.reserve(1, now=1000) == 0
+
+
+class TestGitHubCommentAuthors(GitHubImporterTestCase):
+    def setup_method(self, method):
+        super(TestGitHubCommentAuthors, self).setup_method(method)
+        self.tm.fetch_comment_authors = True
+        self.tm.comment_concurrency = 2
+
+    def issues(self, count):
+        issue = json.load(open(os.path.join(HERE, 'sample-data', 'github',
+                                            'issue-show')))
+        issues = []
+        for number in range(1, count + 1):
+            issues.append(dict(issue,
+                number=number,
+                html_url='https://github.com/openhatch/tests/issues/%d' % number,
+                url='https://api.github.com/repos/openhatch/tests/issues/%d'
+                    % number))
+        return issues
+
+    def list_request(self):
+        return self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+
+    def test_comments_are_fetched_a_few_at_a_time(self, tmpdir):
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        results = self.respond(self.list_request(), self.issues(3))
+        # The bugs wait for their comments, two issues at a time.
+        assert [r.url for r in results] == [
+            'https://api.github.com/repos/openhatch/tests/issues/1/comments'
+            '?per_page=100',
+            'https://api.github.com/repos/openhatch/tests/issues/2/comments'
+            '?per_page=100']
+
+        results = self.respond(results[0], 'issue-42-comments')
+        bug, request = results
+        # The reporter, who is also the assignee, and one other commenter.
+        assert bug['people_involved'] == 2
+        assert request.url == ('https://api.github.com/repos/openhatch/tests/'
+                               'issues/3/comments?per_page=100')
+
+    def test_unchanged_issues_use_the_stored_commenters(self, tmpdir):
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        issues = self.issues(1)
+        request, = self.respond(self.list_request(), issues)
+        self.respond(request, 'issue-42-comments')
+
+        self.im = GitHubBugImporter(self.tm)
+        bug, = self.respond(self.list_request(), issues)
+        assert bug['people_involved'] == 2
+
+        # A new comment means asking again.
+        issues[0]['comments'] = 3
+        results = self.respond(self.list_request(), issues)
+        assert isinstance(results[0], scrapy.http.Request)
+
+    def test_failed_comments_fall_back_to_a_guess(self):
+        request, other = self.respond(self.list_request(), self.issues(3))
+        results = request.errback(autoresponse.Autoresponder.
+                                  manufacture_http_failure(404))
+        bug, next_request = results
+        assert bug['people_involved'] == 2
+        assert next_request.url == ('https://api.github.com/repos/openhatch/'
+                                    'tests/issues/3/comments?per_page=100')
+
+
+    def test_refused_and_failed_requests_leave_nothing_behind(self):
+        bugimporters.github.user_cache.clear()
+        bugimporters.github.users_in_flight.clear()
+        self.tm.fetch_submitter_realnames = True
+        refused = {'X-RateLimit-Limit': '5000',
+                   'X-RateLimit-Remaining': '4000',
+                   'X-RateLimit-Reset': str(int(time.time()) + 3600)}
+        bugs = []
+        requests = self.respond(self.list_request(), self.issues(4))
+        assert len(requests) == 2
+
+        # GitHub refuses both comment requests in flight, though the rate
+        # limit is nowhere near spent.
+        for request in list(requests):
+            requests.remove(request)
+            for result in self.respond(request, status=403, headers=refused):
+                if isinstance(result, scrapy.http.Request):
+                    requests.append(result)
+                else:
+                    bugs.append(result)
+        assert len(bugs) == 2
+        user_request, = [r for r in requests if 'github_login' in r.meta]
+        assert len(requests) == 3
+
+        # The rest of the comments, then the profile, fail to arrive.
+        requests.remove(user_request)
+        failure = autoresponse.Autoresponder.manufacture_http_failure(500)
+        for request in requests + [user_request]:
+            for result in request.errback(failure):
+                assert not isinstance(result, scrapy.http.Request)
+                bugs.append(result)
+        assert sorted(bug['canonical_bug_link'] for bug in bugs) == [
+            'https://github.com/openhatch/tests/issues/%d' % number
+            for number in range(1, 5)]
+        assert not self.im.comment_queue
+        assert self.im.comment_requests_in_flight == 0
+        assert not bugimporters.github.users_in_flight
+
+
+class TestGitHubSkipPullRequests(GitHubImporterTestCase):
+    def issue_and_pull_request(self):
+        issue = json.load(open(os.path.join(HERE, 'sample-data', 'github',
+                                            'issue-show')))
+        pull_request = dict(issue,
+            number=43,
+            html_url='https://github.com/openhatch/tests/pull/43',
+            pull_request={
+                'html_url': 'https://github.com/openhatch/tests/pull/43'})
+        return [issue, pull_request]
+
+    def list_request(self):
+        return self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+
+    def test_pull_requests_are_kept_by_default(self):
+        bugs = self.respond(self.list_request(), self.issue_and_pull_request())
+        assert len(bugs) == 2
+        assert not self.im.stats
+
+    def test_pull_requests_are_skipped(self):
+        self.tm.skip_pull_requests = True
+        bug, = self.respond(self.list_request(), self.issue_and_pull_request())
+        assert bug['canonical_bug_link'] == (
+            'https://github.com/openhatch/tests/issues/42')
+        assert self.im.stats['github/pull_requests_skipped'] == 1
+
+
+class TestGitHubSubmitterRealnames(GitHubImporterTestCase):
+    def setup_method(self, method):
+        super(TestGitHubSubmitterRealnames, self).setup_method(method)
+        bugimporters.github.user_cache.clear()
+        bugimporters.github.users_in_flight.clear()
+        self.im.store.clear()
+        self.tm.fetch_submitter_realnames = True
+
+    def list_request(self):
+        return self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues')
+
+    def split(self, results):
+        bugs = [r for r in results if not isinstance(r, scrapy.http.Request)]
+        requests = [r for r in results if isinstance(r, scrapy.http.Request)]
+        return bugs, requests
+
+    def scheduled(self, dupefilter, request):
+        # What scrapy's scheduler does before it fetches a request.
+        return request.dont_filter or not dupefilter.request_seen(request)
+
+    def test_bug_is_not_held_back_for_the_realname(self, tmpdir):
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        (bug,), (request,) = self.split(
+            self.respond(self.list_request(), 'issue-list'))
+        assert bug['submitter_realname'] == ''
+        assert request.url == 'https://api.github.com/orgs/openhatch'
+        assert self.respond(request, 'org-openhatch') == []
+
+        # Later bugs, and later runs, find the name in the cache.
+        bugimporters.github.user_cache.clear()
+        self.im = GitHubBugImporter(self.tm)
+        bug, = self.respond(self.list_request(), 'issue-list')
+        assert bug['submitter_realname'] == 'OpenHatch'
+
+    def test_lookups_are_shared_between_importers(self):
+        (bug,), (request,) = self.split(
+            self.respond(self.list_request(), 'issue-list'))
+        # Another tracker meets the same reporter while the profile is on
+        # its way, and does not ask for it again.
+        self.im = GitHubBugImporter(self.tm)
+        bug, = self.respond(self.list_request(), 'issue-list')
+        assert bug['submitter_realname'] == ''
+
+        self.respond(request, 'org-openhatch')
+        bug, = self.respond(self.list_request(), 'issue-list')
+        assert bug['submitter_realname'] == 'OpenHatch'
+
+    def test_stale_realname_is_used_while_it_is_fetched_again(self):
+        self.tm.user_cache_ttl = 60
+        bugimporters.github.user_cache['openhatch'] = {
+            'name': 'OpenHatch', 'fetched': time.time() - 120}
+        (bug,), (request,) = self.split(
+            self.respond(self.list_request(), 'issue-list'))
+        assert bug['submitter_realname'] == 'OpenHatch'
+        assert request.url == 'https://api.github.com/orgs/openhatch'
+
+    def test_failed_lookup_can_be_tried_again(self):
+        dupefilter = scrapy.dupefilter.RFPDupeFilter()
+        (bug,), (request,) = self.split(
+            self.respond(self.list_request(), 'issue-list'))
+        assert bug['submitter_realname'] == ''
+        assert self.scheduled(dupefilter, request)
+        assert request.errback(
+            autoresponse.Autoresponder.manufacture_http_failure(404)) == []
+
+        # The retry asks for the same URL, and still gets through.
+        (bug,), (request,) = self.split(
+            self.respond(self.list_request(), 'issue-list'))
+        assert self.scheduled(dupefilter, request)
+        self.respond(request, 'org-openhatch')
+        bug, = self.respond(self.list_request(), 'issue-list')
+        assert bug['submitter_realname'] == 'OpenHatch'
+
+
+class GraphQLHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        payload = json.loads(self.rfile.read(length))
+        self.server.requests.append((self.headers, payload))
+        filename = self.server.filename or self.server.cursor2filename[
+            payload['variables']['after']]
+        body = open(os.path.join(HERE, 'sample-data', 'github',
+                                 filename)).read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalGraphQLServer(BaseHTTPServer.HTTPServer):
+    '''Stands in for the GitHub GraphQL endpoint on a local port, answering
+    each request from sample data chosen by its query's cursor.'''
+    def __init__(self, cursor2filename=None, filename=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           GraphQLHandler)
+        self.cursor2filename = cursor2filename or {}
+        self.filename = filename
+        self.requests = []
+        self.url = 'http://127.0.0.1:%d/graphql' % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestGitHubGraphQLBugImporter(GitHubImporterTestCase):
+    importer_class = GitHubGraphQLBugImporter
+
+    def setup_method(self, method):
+        super(TestGitHubGraphQLBugImporter, self).setup_method(method)
+        self.tm.github_token = 'sekrit'
+        self.tm.graphql_url = 'http://localhost/graphql'
+        self.server = None
+
+    def teardown_method(self, method):
+        if self.server is not None:
+            self.server.stop()
+
+    def serve(self, **kwargs):
+        self.server = LocalGraphQLServer(**kwargs)
+        self.tm.graphql_url = self.server.url
+
+    def test_issue_list_is_followed_to_the_end(self):
+        self.serve(cursor2filename={
+            None: 'graphql-issue-list-1.json',
+            'Y3Vyc29yOjQy': 'graphql-issue-list-2.json',
+            'Y29tbWVudDoz': 'graphql-issue-comments.json',
+        })
+        bugs = self.crawl([self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues?state=all')])
+
+        assert len(self.server.requests) == 3
+        headers, payload = self.server.requests[0]
+        assert headers['Authorization'] == 'bearer sekrit'
+        variables = payload['variables']
+        assert variables['owner'] == 'openhatch'
+        assert variables['first'] == 100
+        assert variables['states'] is None
+
+        assert len(bugs) == 2
+        # Issue 42 waited on its second page of comments.
+        headers, payload = self.server.requests[2]
+        assert payload['variables']['number'] == 42
+        bug, = [b for b in bugs if b['title'] == 'yo dawg']
+        assert bug['status'] == 'open'
+        assert bug['looks_closed'] == False
+        # The author, the assignee and two other commenters, one of them
+        # on the second page.
+        assert bug['people_involved'] == 4
+        assert bug['submitter_username'] == 'openhatch'
+        assert bug['submitter_realname'] == 'OpenHatch'
+        assert bug['date_reported'] == printable_datetime(
+            datetime.datetime(2012, 3, 12, 19, 24, 42))
+        assert bug['canonical_bug_link'] == (
+            'https://github.com/openhatch/tests/issues/42')
+        assert bug['good_for_newcomers'] == True
+        assert bug['concerns_just_documentation'] == False
+
+        bug, = [b for b in bugs if b['title'] != 'yo dawg']
+        assert bug['looks_closed'] == True
+        assert bug['people_involved'] == 1
+        assert bug['submitter_realname'] == ''
+        assert bug['concerns_just_documentation'] == True
+
+    def test_failed_comment_page_hands_the_issue_on(self):
+        requests = self.respond(self.first_request(
+            'https://api.github.com/repos/openhatch/tests/issues'),
+            'graphql-issue-list-1.json')
+        comments_request, = [r for r in requests
+                              if 'graphql_issue' in r.meta]
+        bug, = comments_request.errback(
+            autoresponse.Autoresponder.manufacture_http_failure(502))
+        # Only the commenters on the first page are counted.
+        assert bug['people_involved'] == 3
+
+    def test_states_come_from_the_query_url(self):
+        assert self.im.graphql_states(
+            'https://api.github.com/repos/openhatch/tests/issues') == ['OPEN']
+        assert self.im.graphql_states(
+            'https://api.github.com/repos/openhatch/tests/issues'
+            '?state=closed') == ['CLOSED']
+
+    def test_process_bugs_asks_for_them_together(self):
+        self.serve(filename='graphql-issue-show.json')
+        bugs = self.crawl(self.im.process_bugs([
+            ('https://api.github.com/repos/openhatch/tests/issues/42', None),
+            ('https://api.github.com/repos/openhatch/tests/issues/9999', None),
+        ]))
+
+        assert len(self.server.requests) == 1
+        query = self.server.requests[0][1]['query']
+        assert 'issue42: issue(number: 42)' in query
+        assert 'issue9999: issue(number: 9999)' in query
+        # Issue 9999 is gone, and GitHub says so in the errors.
+        assert len(bugs) == 1
+        assert bugs[0]['people_involved'] == 1
+
+
+class TestGitHubIncrementalSync(GitHubImporterTestCase):
+    query_url = 'https://api.github.com/repos/openhatch/tests/issues'
+
+    def run_query(self, filename, tmpdir):
+        # Each run gets a fresh importer, as it would from the command line.
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        self.im = GitHubBugImporter(self.tm)
+        request = self.first_request(self.query_url)
+        return request, self.respond(request, filename)
+
+    def test_later_runs_only_fetch_updated_issues(self, tmpdir):
+        request, bugs = self.run_query('issue-list', tmpdir)
+        assert 'since' not in request.url
+        assert [b['title'] for b in bugs] == ['yo dawg']
+
+        # Nothing has changed, but the stored issue is still handed on.
+        request, bugs = self.run_query('issue-list-empty', tmpdir)
+        params = dict(urlparse.parse_qsl(urlparse.urlsplit(request.url).query))
+        assert params['sort'] == 'updated'
+        assert params['state'] == 'all'
+        assert 'since' in params
+        assert [b['title'] for b in bugs] == ['yo dawg']
+
+        # Once the issue is closed, an open query drops it.
+        request, bugs = self.run_query('issue-list-closed', tmpdir)
+        assert bugs == []
+        request, bugs = self.run_query('issue-list-empty', tmpdir)
+        assert bugs == []
+
+    def etag_keys(self):
+        return set(key for key in self.im.store if key.startswith('etag:'))
+
+    def test_synced_runs_keep_no_etags(self, tmpdir):
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        for run in range(3):
+            self.im = GitHubBugImporter(self.tm)
+            request = self.first_request(self.query_url)
+            self.respond(request, 'issue-list-empty',
+                         headers={'ETag': '"run%d"' % run})
+            if run == 0:
+                first_run_keys = self.etag_keys()
+            else:
+                assert 'since' in request.url
+                assert 'If-None-Match' not in request.headers
+        # Only the first run's URL, which has no since, was worth keeping.
+        assert len(first_run_keys) == 1
+        assert self.etag_keys() == first_run_keys
+
+    def test_unfinished_run_does_not_move_the_sync_time(self, tmpdir):
+        self.run_query('issue-list', tmpdir)
+        since = self.im.store['sync:' + self.query_url]
+
+        self.tm.cache_path = tmpdir.join('cache').strpath
+        self.im = GitHubBugImporter(self.tm)
+        request = self.first_request(self.query_url)
+        base = request.url
+        # The first page says there are two, and the second never comes.
+        self.respond(request, 'issue-list-empty',
+                     link='<%s&page=2>; rel="last"' % base)
+        assert self.im.store['sync:' + self.query_url] == since
@@ -5,7 +5,8 @@ import twisted
 
 from bugimporters.tests import (Bug, ReactorManager, TrackerModel,
         FakeGetPage, ObjectFromDict)
-from bugimporters.google import GoogleBugParser
+import bugimporters.google
+from bugimporters.google import GoogleBugImporter, GoogleBugParser
 from mock import Mock
 
 
@@ -36,7 +37,7 @@ trac_data_transit = {
 
 importer_data_transits = {'bug': bug_data_transit, 'trac': trac_data_transit}
 
-class MockGoogleTrackerModel(mock.Mock):
+class MockGoogleTrackerModel(TrackerModel):
     tracker_name='SymPy'
     google_name='sympy'
     bitesized_type='label'
@@ -77,7 +78,7 @@ I don't see for example the solvers module"""},
                 bug_url='http://code.google.com/p/sympy/issues/detail?id=1215')
         gbp.bug_atom = bug_atom
 
-        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel)
+        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel())
         wanted = {'title': 'fix html documentation',
                   'description': """http://docs.sympy.org/modindex.html
 
@@ -125,7 +126,7 @@ I don't see for example the solvers module"""},
                 bug_url='http://code.google.com/p/sympy/issues/detail?id=1215')
         gbp.bug_atom = bug_atom
 
-        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel)
+        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel())
         wanted = {'title': 'fix html documentation',
                   'description': """http://docs.sympy.org/modindex.html
 
@@ -173,7 +174,7 @@ I don't see for example the solvers module"""},
                 bug_url='http://code.google.com/p/sympy/issues/detail?id=1215')
         gbp.bug_atom = bug_atom
 
-        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel)
+        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel())
         wanted = {'title': 'fix html documentation',
                   'description': """http://docs.sympy.org/modindex.html
 
@@ -221,7 +222,7 @@ I don't see for example the solvers module"""},
                 bug_url='http://code.google.com/p/sympy/issues/detail?id=1215')
         gbp.bug_atom = bug_atom
 
-        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel)
+        got = gbp.get_parsed_data_dict(MockGoogleTrackerModel())
         wanted = {'title': 'fix html documentation',
                   'description': """http://docs.sympy.org/modindex.html
 
@@ -241,3 +242,100 @@ I don't see for example the solvers module""",
                   }
         self.assertEqual(wanted, got)
 
+
+
+class GoogleTrackerModel(TrackerModel):
+    tracker_name = 'SymPy'
+    google_name = 'sympy'
+
+
+class TestGoogleQueryPaging(object):
+    def setup_method(self, method):
+        self.tm = GoogleTrackerModel()
+        self.im = GoogleBugImporter(self.tm, ReactorManager(),
+                                    data_transits=importer_data_transits)
+        # The tests answer URLs themselves; keep the reactor out of it.
+        self.im.push_urls_onto_reactor = lambda *args: None
+        self.handled = []
+        self.im.handle_bug_atom = lambda issue, gbp: self.handled.append(
+            (gbp.bug_id, issue.title.text, sorted(self.im.priority_waiting_urls)))
+
+    def load(self, filename):
+        return open(os.path.join(HERE, 'sample-data', 'google',
+                                 filename)).read()
+
+    def test_pages_are_followed_as_entries_are_handled(self):
+        self.tm.query_page_size = 2
+        query = Mock()
+        query.get_query_url.return_value = (
+            'https://code.google.com/feeds/issues/p/sympy/issues/full')
+        self.im.process_queries([query])
+        url, callback, c_args, errback, e_args = self.im.get_next_waiting_url()
+        assert url == ('https://code.google.com/feeds/issues/p/sympy/issues/'
+                       'full?start-index=1&max-results=2')
+
+        callback(self.load('issues-page-1.atom'), **c_args)
+        next_page = ('https://code.google.com/feeds/issues/p/sympy/issues/'
+                     'full?start-index=3&max-results=2')
+        # The next page was asked for before the first issue was handled.
+        assert self.handled == [
+            (1215, 'fix html documentation', [next_page]),
+            (1216, 'integrate(1/x) is wrong', [next_page])]
+
+        url, callback, c_args, errback, e_args = self.im.get_next_waiting_url()
+        assert url == next_page
+        callback(self.load('issues-page-2.atom'), **c_args)
+        assert self.handled[-1][:2] == (1217, 'add a Documentation label')
+        assert not self.im.has_waiting_urls()
+
+    def test_full_page_without_next_link_asks_for_more(self):
+        self.tm.query_page_size = 1
+        query_url = ('https://code.google.com/feeds/issues/p/sympy/issues/'
+                     'full?start-index=3&max-results=1')
+        self.im.handle_query_atom(self.load('issues-page-2.atom'), query_url)
+        assert list(self.im.priority_waiting_urls) == [
+            'https://code.google.com/feeds/issues/p/sympy/issues/'
+            'full?start-index=4&max-results=1']
+
+    def test_duplicate_issues_are_handled_once(self):
+        self.im.handle_query_atom(self.load('issues-page-2.atom'))
+        self.im.handle_query_atom(self.load('issues-page-2.atom'))
+        assert len(self.handled) == 1
+
+    def test_entries_are_read_without_private_atom_functions(self,
+                                                              monkeypatch):
+        monkeypatch.setattr(bugimporters.google, '_xml_element_from_tree',
+                            None)
+        self.im.handle_query_atom(self.load('issues-page-1.atom'))
+        assert [title for bug_id, title, urls in self.handled] == [
+            'fix html documentation', 'integrate(1/x) is wrong']
+
+    def test_seen_bug_urls_are_bounded(self, monkeypatch):
+        monkeypatch.setattr(bugimporters.google, 'SEEN_BUG_URLS_SIZE', 1)
+        self.im = GoogleBugImporter(self.tm, ReactorManager(),
+                                    data_transits=importer_data_transits)
+        self.im.push_urls_onto_reactor = lambda *args: None
+        self.im.handle_bug_atom = lambda issue, gbp: self.handled.append(
+            gbp.bug_id)
+        self.im.handle_query_atom(self.load('issues-page-1.atom'))
+        assert len(self.im.seen_bug_urls) == 1
+
+    def test_next_page_waits_while_the_waiting_list_is_full(self):
+        self.tm.query_page_size = 2
+        self.tm.max_waiting_urls = 1
+        self.im.process_bugs([
+            ('http://code.google.com/p/sympy/issues/detail?id=1', None)])
+        query_url = ('https://code.google.com/feeds/issues/p/sympy/issues/'
+                     'full?start-index=1&max-results=2')
+        self.im.handle_query_atom(self.load('issues-page-1.atom'), query_url)
+        # The issues on the page are handled, but the next page is held.
+        assert len(self.handled) == 2
+        assert not self.im.priority_waiting_urls
+        assert len(self.im.held_urls) == 1
+
+        # Once the bug has been fetched, the page is let back in.
+        self.im.get_next_waiting_url()
+        self.im.release_held_urls()
+        assert list(self.im.priority_waiting_urls) == [
+            'https://code.google.com/feeds/issues/p/sympy/issues/'
+            'full?start-index=3&max-results=2']
@@ -0,0 +1,107 @@
+import datetime
+import json
+import os
+import StringIO
+import tarfile
+
+import bugimporters.google_archive
+from bugimporters.google_archive import (GoogleCodeArchiveBugImporter,
+        iter_archive_issues)
+from bugimporters.tests import ReactorManager, TrackerModel
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE = os.path.join(HERE, 'sample-data', 'google-archive')
+
+
+class GoogleArchiveTrackerModel(TrackerModel):
+    tracker_name = 'SymPy'
+    google_name = 'sympy'
+    bitesized_type = 'label'
+    bitesized_text = 'EasyToFix'
+    documentation_type = 'label'
+    documentation_text = 'Documentation'
+    archive_path = ARCHIVE
+
+
+class TestIterArchiveIssues(object):
+    def test_issues_list_is_read_an_issue_at_a_time(self):
+        issues = [{'id': n, 'title': u'caf\xe9 %d' % n, 'stars': n * 1.5}
+                  for n in range(20)]
+        f = StringIO.StringIO(json.dumps({'totalPages': 1, 'issues': issues}))
+        # A tiny chunk size splits values, and characters, across reads.
+        assert list(iter_archive_issues(f, chunk_size=7)) == issues
+
+    def test_single_issue(self):
+        with open(os.path.join(ARCHIVE, 'sympy', 'issue-1216.json')) as f:
+            issues = list(iter_archive_issues(f, chunk_size=16))
+        assert [issue['id'] for issue in issues] == [1216]
+
+    def test_list_of_issues(self):
+        f = StringIO.StringIO('[{"id": 1, "comments": []}, {"id": 2}]')
+        assert [issue['id'] for issue in iter_archive_issues(f)] == [1, 2]
+
+
+class TestGoogleCodeArchiveBugImporter(object):
+    def setup_method(self, method):
+        self.tm = GoogleArchiveTrackerModel()
+        self.bugs = []
+        self.im = GoogleCodeArchiveBugImporter(
+            self.tm, ReactorManager(),
+            data_transits={'bug': {'update': self.bugs.append}})
+
+    def bugs_by_link(self):
+        return dict((bug['canonical_bug_link'], bug) for bug in self.bugs)
+
+    def test_issue_is_parsed_like_the_feeds_api(self):
+        self.im.process_queries([])
+        bugs = self.bugs_by_link()
+        assert len(bugs) == 2
+        # The same issue as in test_create_google_data_dict_with_everything.
+        wanted = {'title': 'fix html documentation',
+                  'description': """http://docs.sympy.org/modindex.html
+
+I don't see for example the solvers module""",
+                  'status': 'Fixed',
+                  'importance': 'Critical',
+                  'people_involved': 3,
+                  'date_reported': datetime.datetime(2008, 11, 24, 11, 15, 58),
+                  'last_touched': datetime.datetime(2009, 12, 06, 23, 01, 11),
+                  'looks_closed': True,
+                  'submitter_username': 'fabian.seoane',
+                  'submitter_realname': '',
+                  'canonical_bug_link': 'http://code.google.com/p/sympy/issues/detail?id=1215',
+                  'good_for_newcomers': False,
+                  'concerns_just_documentation': True,
+                  '_project_name': 'SymPy',
+                  }
+        assert wanted == bugs[
+            'http://code.google.com/p/sympy/issues/detail?id=1215']
+
+        bug = bugs['http://code.google.com/p/sympy/issues/detail?id=1216']
+        assert bug['status'] == ''
+        assert bug['looks_closed'] == False
+        # The owner was cleared again.
+        assert bug['people_involved'] == 1
+        assert bug['good_for_newcomers'] == True
+
+    def test_large_files_are_memory_mapped(self, monkeypatch):
+        monkeypatch.setattr(bugimporters.google_archive, 'MMAP_THRESHOLD', 0)
+        self.im.process_queries([])
+        assert len(self.bugs) == 2
+
+    def test_tarball(self, tmpdir):
+        path = tmpdir.join('sympy.tar.gz').strpath
+        with tarfile.open(path, 'w:gz') as tarball:
+            tarball.add(os.path.join(ARCHIVE, 'sympy'), arcname='sympy')
+        self.tm.archive_path = path
+        self.im.process_queries([])
+        assert sorted(self.bugs_by_link()) == [
+            'http://code.google.com/p/sympy/issues/detail?id=1215',
+            'http://code.google.com/p/sympy/issues/detail?id=1216']
+
+    def test_process_bugs_reads_only_those_bugs(self):
+        self.im.process_bugs([
+            ('http://code.google.com/p/sympy/issues/detail?id=1216', None)])
+        assert list(self.bugs_by_link()) == [
+            'http://code.google.com/p/sympy/issues/detail?id=1216']
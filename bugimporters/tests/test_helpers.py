@@ -0,0 +1,113 @@
+import codecs
+import datetime
+import StringIO
+
+import bugimporters.helpers
+from bugimporters.helpers import (BoundedDict, keyword_matcher,
+        string2naive_datetime, utf8_file_from_bytes,
+        wrap_file_object_in_utf8_check)
+
+
+class TestBoundedDict(object):
+    def test_forgets_oldest_key(self):
+        d = BoundedDict(2)
+        d['a'] = 1
+        d['b'] = 2
+        d['a'] = 3
+        d['c'] = 4
+        assert d.items() == [('a', 3), ('c', 4)]
+
+
+class TestWrapFileObjectInUTF8Check(object):
+    def test_strips_bom_and_yields_lines(self):
+        f = StringIO.StringIO(codecs.BOM_UTF8 + 'id,summary\n1,caf\xc3\xa9\n')
+        lines = list(wrap_file_object_in_utf8_check(f))
+        assert lines == ['id,summary\n', '1,caf\xc3\xa9\n']
+
+    def test_unicode_is_encoded_as_utf8(self):
+        f = StringIO.StringIO(u'\ufeffid,summary\n1,caf\xe9\n')
+        lines = list(wrap_file_object_in_utf8_check(f))
+        assert lines == ['id,summary\n', '1,caf\xc3\xa9\n']
+
+    def test_read_returns_the_rest(self):
+        f = StringIO.StringIO('a\nb\nc\n')
+        wrapped = wrap_file_object_in_utf8_check(f)
+        assert wrapped.readline() == 'a\n'
+        assert wrapped.read() == 'b\nc\n'
+        assert wrapped.readline() == ''
+
+    def test_invalid_utf8_raises(self):
+        f = StringIO.StringIO('good\nbad \xff\n')
+        wrapped = wrap_file_object_in_utf8_check(f)
+        assert wrapped.next() == 'good\n'
+        try:
+            wrapped.next()
+        except UnicodeDecodeError:
+            pass
+        else:
+            assert False, 'Expected a UnicodeDecodeError'
+
+
+class TestUTF8FileFromBytes(object):
+    def test_utf8_is_read_as_it_is(self):
+        body = codecs.BOM_UTF8 + 'id,summary\n1,caf\xc3\xa9\n'
+        f = utf8_file_from_bytes(body, 'utf-8')
+        assert list(f) == ['id,summary\n', '1,caf\xc3\xa9\n']
+
+    def test_other_encodings_are_transcoded(self):
+        f = utf8_file_from_bytes('id,summary\n1,caf\xe9\n', 'latin-1')
+        assert list(f) == ['id,summary\n', '1,caf\xc3\xa9\n']
+
+    def test_invalid_utf8_still_raises(self):
+        f = utf8_file_from_bytes('good\nbad \xff\n')
+        assert f.next() == 'good\n'
+        try:
+            f.next()
+        except UnicodeDecodeError:
+            pass
+        else:
+            assert False, 'Expected a UnicodeDecodeError'
+
+
+class TestString2NaiveDatetime(object):
+    def test_iso_dates_are_converted_to_utc(self):
+        assert string2naive_datetime('2012-03-12T19:24:42Z') == \
+            datetime.datetime(2012, 3, 12, 19, 24, 42)
+        assert string2naive_datetime('2008-11-24T11:15:58.000Z') == \
+            datetime.datetime(2008, 11, 24, 11, 15, 58)
+        assert string2naive_datetime('2010-02-22T19:46:30-0500 ') == \
+            datetime.datetime(2010, 2, 23, 0, 46, 30)
+        assert string2naive_datetime('2010-01-04 23:04:29 +05:30') == \
+            datetime.datetime(2010, 1, 4, 17, 34, 29)
+        assert string2naive_datetime('2005-12-05 23:20') == \
+            datetime.datetime(2005, 12, 5, 23, 20)
+
+    def test_format_is_remembered_per_tracker(self, monkeypatch):
+        monkeypatch.setattr(bugimporters.helpers, '_date_format_by_tracker', {})
+        assert string2naive_datetime('Dec 9, 2009 9:59:59 AM', 'Trac') == \
+            datetime.datetime(2009, 12, 9, 9, 59, 59)
+        assert bugimporters.helpers._date_format_by_tracker == {
+            'Trac': '%b %d, %Y %I:%M:%S %p'}
+
+    def test_other_dates_fall_back_to_dateutil(self):
+        assert string2naive_datetime('Tue Mar 16 2010 10:00') == \
+            datetime.datetime(2010, 3, 16, 10, 0)
+
+
+class TestKeywordMatcher(object):
+    def test_any_of_matches_whole_values(self):
+        matcher = keyword_matcher('easy,bitesize')
+        assert matcher.any_of(['bug', 'easy'])
+        assert not matcher.any_of(['easyish'])
+        assert not matcher.any_of([])
+
+    def test_in_text_matches_anywhere(self):
+        matcher = keyword_matcher('easy,a.b')
+        assert matcher.in_text('easy, documentation')
+        assert matcher.in_text('not so easyish')
+        # Keywords are not regular expressions.
+        assert matcher.in_text('a.b')
+        assert not matcher.in_text('axb')
+
+    def test_compiled_once_per_text(self):
+        assert keyword_matcher('easy') is keyword_matcher('easy')
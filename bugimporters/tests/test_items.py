@@ -0,0 +1,50 @@
+import pickle
+
+import pytest
+
+from bugimporters.items import BUG_FIELDS, BugRecord, ParsedBug
+
+
+class TestBugRecord(object):
+    def test_has_the_fields_of_parsed_bug(self):
+        assert sorted(BUG_FIELDS) == sorted(ParsedBug.fields)
+
+    def test_reads_and_writes_like_a_dict(self):
+        record = BugRecord({'title': 'Crash'}, status='new')
+        record['looks_closed'] = False
+        assert record['title'] == 'Crash'
+        assert 'status' in record
+        assert 'importance' not in record
+        assert record.get('importance', 'none') == 'none'
+        with pytest.raises(KeyError):
+            record['importance']
+        # Fields come out in a fixed order.
+        assert record.keys() == ['title', 'status', 'looks_closed']
+        assert dict(record) == {'title': 'Crash', 'status': 'new',
+                                'looks_closed': False}
+        del record['status']
+        assert len(record) == 2
+
+    def test_rejects_unknown_fields(self):
+        record = BugRecord()
+        with pytest.raises(KeyError):
+            record['tracker'] = None
+        with pytest.raises(KeyError):
+            record['update']
+        assert 'update' not in record
+
+    def test_compares_equal_to_dicts(self):
+        record = BugRecord(title='Crash', people_involved=2)
+        assert record == {'title': 'Crash', 'people_involved': 2}
+        assert {'title': 'Crash', 'people_involved': 2} == record
+        assert record != {'title': 'Crash'}
+
+    def test_to_item(self):
+        record = BugRecord(title='Crash', _tracker_name='Twisted')
+        item = record.to_item()
+        assert isinstance(item, ParsedBug)
+        assert dict(item) == dict(record)
+
+    def test_pickles(self):
+        record = BugRecord(title='Crash', people_involved=2)
+        assert pickle.loads(pickle.dumps(record)) == record
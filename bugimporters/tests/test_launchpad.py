@@ -0,0 +1,270 @@
+import datetime
+import json
+import os
+
+import mock
+import twisted.python.failure
+
+import bugimporters.launchpad
+from bugimporters.launchpad import LaunchpadBugImporter, LaunchpadBug
+from bugimporters.tests import ReactorManager, TrackerModel
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LP_DATA = os.path.join(HERE, 'sample-data', 'launchpad')
+
+
+class LaunchpadTrackerModel(TrackerModel):
+    tracker_name = 'Bazaar'
+    bitesized_tag = 'easy'
+    documentation_tag = 'doc'
+
+
+def load(filename):
+    return open(os.path.join(LP_DATA, filename)).read()
+
+
+def respond_to_waiting_urls(importer, url2filename):
+    """Answers the importer's waiting URLs from sample data, in place of
+    the reactor, until there are none left. Returns the URLs fetched."""
+    fetched = []
+    while importer.waiting_urls:
+        url, callback, c_args, errback, e_args = (
+            importer.get_next_waiting_url())
+        fetched.append(url)
+        callback(load(url2filename[url]), **c_args)
+    return fetched
+
+
+class LaunchpadImporterTestCase(object):
+    '''Sets up a LaunchpadBugImporter whose bugs end up in self.bugs, and
+    whose URLs the tests answer themselves.'''
+    def setup_method(self, method):
+        bugimporters.launchpad.person_cache.clear()
+        self.tm = LaunchpadTrackerModel()
+        self.bugs = []
+        self.im = LaunchpadBugImporter(
+            self.tm, ReactorManager(),
+            data_transits={'bug': {'update': self.bugs.append}})
+        # Keep the reactor out of it.
+        self.im.push_urls_onto_reactor = lambda *args: None
+
+
+class TestLaunchpadPersonCache(LaunchpadImporterTestCase):
+    def make_lp_bug(self, web_link):
+        lp_bug = LaunchpadBug(self.im.tm)
+        task = json.loads(load('bugs_task_839461'))
+        task['web_link'] = web_link
+        lp_bug.parse_task(task)
+        lp_bug.parse_bug(json.loads(load('bugs_839461')))
+        return lp_bug
+
+    def test_shared_owner_is_fetched_once(self):
+        subscriptions = load('bugs_839461_subscriptions')
+        for web_link in ['https://bugs.launchpad.net/bzr/+bug/1',
+                         'https://bugs.launchpad.net/bzr/+bug/2',
+                         'https://bugs.launchpad.net/bzr/+bug/3']:
+            lp_bug = self.make_lp_bug(web_link)
+            self.im.handle_subscriptions(json.loads(subscriptions), lp_bug)
+            self.im.request_person(lp_bug)
+
+        fetched = respond_to_waiting_urls(
+            self.im, {'https://api.launchpad.net/1.0/~vila': '~vila'})
+
+        assert fetched == ['https://api.launchpad.net/1.0/~vila']
+        assert sorted(b['canonical_bug_link'] for b in self.bugs) == [
+            'https://bugs.launchpad.net/bzr/+bug/1',
+            'https://bugs.launchpad.net/bzr/+bug/2',
+            'https://bugs.launchpad.net/bzr/+bug/3']
+        for bug in self.bugs:
+            assert bug['submitter_username'] == 'vila'
+            assert bug['submitter_realname'] == 'Vincent Ladeuil'
+
+    def test_cached_owner_needs_no_fetch(self):
+        bugimporters.launchpad.person_cache[
+            'https://api.launchpad.net/1.0/~vila'] = {
+            'name': 'vila', 'display_name': 'Vincent Ladeuil'}
+        lp_bug = self.make_lp_bug('https://bugs.launchpad.net/bzr/+bug/839461')
+        self.im.handle_subscriptions(
+            json.loads(load('bugs_839461_subscriptions')), lp_bug)
+        self.im.request_person(lp_bug)
+
+        assert not self.im.waiting_urls
+        assert len(self.bugs) == 1
+        assert self.bugs[0]['people_involved'] == 1
+        assert self.bugs[0]['submitter_realname'] == 'Vincent Ladeuil'
+
+
+class TestLaunchpadBugFanOut(LaunchpadImporterTestCase):
+    def test_bug_and_subscriptions_are_fetched_together(self):
+        task = json.loads(load('bugs_task_839461'))
+        self.im.process_bugs([(task['web_link'], task)])
+
+        # Both documents are requested straight away.
+        assert sorted(self.im.waiting_urls) == [
+            'https://api.launchpad.net/1.0/bugs/839461',
+            'https://api.launchpad.net/1.0/bugs/839461/subscriptions']
+
+        respond_to_waiting_urls(self.im, {
+            'https://api.launchpad.net/1.0/bugs/839461': 'bugs_839461',
+            'https://api.launchpad.net/1.0/bugs/839461/subscriptions':
+                'bugs_839461_subscriptions',
+            'https://api.launchpad.net/1.0/~vila': '~vila',
+            })
+
+        assert len(self.bugs) == 1
+        bug = self.bugs[0]
+        assert bug['canonical_bug_link'] == (
+            'https://bugs.launchpad.net/bzr/+bug/839461')
+        assert bug['status'] == 'Confirmed'
+        assert bug['people_involved'] == 1
+        assert bug['submitter_username'] == 'vila'
+        assert bug['_project_name'] == 'Bazaar'
+
+    def test_tasks_of_one_bug_share_its_documents(self):
+        task = json.loads(load('bugs_task_839461'))
+        other_task = dict(task,
+                          web_link='https://bugs.launchpad.net/ubuntu/'
+                                   '+source/bzr/+bug/839461',
+                          status='New', importance='Low')
+        self.im.process_bugs([(task['web_link'], task)])
+        url2filename = {
+            'https://api.launchpad.net/1.0/bugs/839461': 'bugs_839461',
+            'https://api.launchpad.net/1.0/bugs/839461/subscriptions':
+                'bugs_839461_subscriptions',
+            'https://api.launchpad.net/1.0/~vila': '~vila',
+            }
+        # Answer the bug document before the second task turns up.
+        bug_url = 'https://api.launchpad.net/1.0/bugs/839461'
+        callback, c_args, errback, e_args = self.im.waiting_urls.pop(bug_url)
+        callback(load(url2filename[bug_url]), **c_args)
+        fetched = [bug_url]
+        self.im.process_bugs([(other_task['web_link'], other_task)])
+        fetched += respond_to_waiting_urls(self.im, url2filename)
+
+        assert sorted(fetched) == [
+            'https://api.launchpad.net/1.0/bugs/839461',
+            'https://api.launchpad.net/1.0/bugs/839461/subscriptions',
+            'https://api.launchpad.net/1.0/~vila']
+        bugs = dict((b['canonical_bug_link'], b) for b in self.bugs)
+        assert len(bugs) == 2
+        assert bugs[task['web_link']]['status'] == 'Confirmed'
+        assert bugs[other_task['web_link']]['status'] == 'New'
+        assert bugs[other_task['web_link']]['importance'] == 'Low'
+        for bug in bugs.values():
+            assert bug['people_involved'] == 1
+            assert bug['submitter_username'] == 'vila'
+        # Finished bugs only stay in the bounded index.
+        assert not self.im.bug_documents
+        assert list(self.im.recent_bug_documents) == [
+            'https://api.launchpad.net/1.0/bugs/839461']
+
+
+class TestLaunchpadIncrementalCrawl(LaunchpadImporterTestCase):
+    def make_query(self, last_polled=None):
+        query = mock.Mock()
+        query.get_query_url.return_value = (
+            'https://api.launchpad.net/1.0/bzr?ws.op=searchTasks')
+        query.last_polled = last_polled
+        return query
+
+    def test_first_run_fetches_everything(self):
+        self.im.process_queries([self.make_query()])
+        assert list(self.im.priority_waiting_urls) == [
+            'https://api.launchpad.net/1.0/bzr?ws.op=searchTasks']
+
+    def test_later_run_asks_for_modified_tasks(self):
+        self.tm.query_page_size = 300
+        query = self.make_query(datetime.datetime(2013, 5, 1, 12, 30))
+        self.im.process_queries([query])
+        assert list(self.im.priority_waiting_urls) == [
+            'https://api.launchpad.net/1.0/bzr?ws.op=searchTasks'
+            '&ws.size=300&modified_since=2013-05-01T12%3A30%3A00']
+
+    def test_next_page_comes_before_bugs(self):
+        self.im.waiting_urls['https://api.launchpad.net/1.0/bugs/1'] = (
+            None, {}, None, {})
+        self.im.handle_bug_list(json.dumps({
+            'entries': [],
+            'next_collection_link': 'https://api.launchpad.net/1.0/bzr'
+                                    '?ws.op=searchTasks&ws.start=75'}))
+        url = self.im.get_next_waiting_url()[0]
+        assert url == ('https://api.launchpad.net/1.0/bzr'
+                       '?ws.op=searchTasks&ws.start=75')
+
+    def test_query_is_marked_polled_only_when_done(self):
+        query = self.make_query()
+        self.im.process_queries([query])
+        self.im.determine_if_finished()
+        assert query.last_polled is None
+        assert not query.save.called
+
+        self.im.get_next_waiting_url()
+        self.im.determine_if_finished()
+        assert query.last_polled == self.im.run_started
+        assert query.save.called
+
+    def fail(self, url, errback, e_args):
+        try:
+            raise IOError('Could not fetch %s' % url)
+        except IOError:
+            errback(twisted.python.failure.Failure(), **e_args)
+
+    def test_query_with_a_failed_page_is_not_marked_polled(self):
+        last_polled = datetime.datetime(2013, 5, 1, 12, 30)
+        query = self.make_query(last_polled)
+        self.im.process_queries([query])
+        url, callback, c_args, errback, e_args = (
+            self.im.get_next_waiting_url())
+        next_page = ('https://api.launchpad.net/1.0/bzr'
+                     '?ws.op=searchTasks&ws.start=75')
+        callback(json.dumps({'entries': [],
+                             'next_collection_link': next_page}), **c_args)
+
+        url, callback, c_args, errback, e_args = (
+            self.im.get_next_waiting_url())
+        assert url == next_page
+        self.fail(url, errback, e_args)
+
+        self.im.determine_if_finished()
+        assert query.last_polled == last_polled
+        assert not query.save.called
+
+    def test_query_with_a_failed_bug_is_not_marked_polled(self):
+        query = self.make_query()
+        self.im.process_queries([query])
+        url, callback, c_args, errback, e_args = (
+            self.im.get_next_waiting_url())
+        task = json.loads(load('bugs_task_839461'))
+        callback(json.dumps({'entries': [task]}), **c_args)
+
+        bug_url = 'https://api.launchpad.net/1.0/bugs/839461'
+        callback, c_args, errback, e_args = self.im.waiting_urls.pop(bug_url)
+        self.fail(bug_url, errback, e_args)
+        self.im.waiting_urls.clear()
+
+        self.im.determine_if_finished()
+        assert query.last_polled is None
+        assert not query.save.called
+
+    def test_next_page_waits_while_bugs_are_backed_up(self):
+        self.tm.max_waiting_urls = 2
+        task = json.loads(load('bugs_task_839461'))
+        next_page = ('https://api.launchpad.net/1.0/bzr'
+                     '?ws.op=searchTasks&ws.start=75')
+        self.im.waiting_urls['https://api.launchpad.net/1.0/bugs/1'] = (
+            None, {}, None, {})
+        self.im.waiting_urls['https://api.launchpad.net/1.0/bugs/2'] = (
+            None, {}, None, {})
+        self.im.handle_bug_list(json.dumps({
+            'entries': [task],
+            'next_collection_link': next_page}))
+        assert [held[0] for held in self.im.held_urls] == [next_page]
+        assert next_page not in self.im.priority_waiting_urls
+
+        # The page is let back in once the bugs drain below the limit.
+        while self.im.waiting_list_is_full():
+            self.im.waiting_urls.popitem()
+        self.im.release_held_urls()
+        assert not self.im.held_urls
+        assert self.im.get_next_waiting_url()[0] == next_page
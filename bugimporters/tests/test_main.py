@@ -0,0 +1,61 @@
+import pytest
+
+import bugimporters.main
+import bugimporters.trac
+from bugimporters.main import TrackerConfig
+
+
+class TestTrackerConfig(object):
+    def make_config(self, **extra):
+        entry = dict(tracker_name='Twisted', bugimporter='trac',
+                     base_url='http://twistedmatrix.com/trac/',
+                     queries=['http://twistedmatrix.com/trac/query'])
+        entry.update(extra)
+        return TrackerConfig(entry)
+
+    def test_keys_become_attributes(self):
+        config = self.make_config(bitesized_text='easy', old_trac=True)
+        assert config.tracker_name == 'Twisted'
+        assert config.get_base_url() == 'http://twistedmatrix.com/trac/'
+        assert config.queries == ('http://twistedmatrix.com/trac/query',)
+        assert config.bitesized_text == 'easy'
+        assert config.old_trac
+        # Keys it was not given fall back to defaults.
+        assert config.max_connections == 5
+        assert config.as_appears_in_distribution == ''
+
+    def test_base_url_and_matchers_are_prepared(self):
+        config = self.make_config(base_url=' http://twistedmatrix.com/trac',
+                                  bitesized_text='easy,trivial')
+        assert config.get_base_url() == 'http://twistedmatrix.com/trac/'
+        assert config.get_keyword_matcher('bitesized_text').any_of(['trivial'])
+        assert config.get_keyword_matcher('documentation_text') is None
+
+    def test_bugimporter_aliases_are_resolved(self):
+        config = self.make_config()
+        assert config.bugimporter == 'trac.TracBugImporter'
+        assert (config.get_bug_import_class() is
+                bugimporters.trac.TracBugImporter)
+
+    def test_is_read_only(self):
+        config = self.make_config()
+        with pytest.raises(AttributeError):
+            config.tracker_name = 'Other'
+
+    def test_mistakes_are_reported_on_load(self):
+        with pytest.raises(ValueError):
+            TrackerConfig(dict(tracker_name='Twisted'))
+        with pytest.raises(ValueError):
+            self.make_config(bugimporter='nosuchtracker')
+        with pytest.raises(ValueError):
+            self.make_config(bugimporter='trac.NoSuchClass')
+        with pytest.raises(ValueError):
+            self.make_config(bugimporter='nosuchmodule.NoSuchClass')
+        with pytest.raises(ValueError):
+            self.make_config(bug_project_name_format='{tracker}')
+        with pytest.raises(ValueError):
+            self.make_config(bitesized_text=['easy'])
+
+    def test_dict2obj_does_not_validate(self):
+        query = bugimporters.main.dict2obj({'get_query_url': lambda: 'url'})
+        assert query.get_query_url() == 'url'
@@ -1,8 +1,10 @@
 import datetime
 import os
 
+import bugimporters.helpers
+import bugimporters.items
 import bugimporters.roundup
-from bugimporters.tests import ObjectFromDict
+from bugimporters.tests import TrackerModel
 import bugimporters.tests
 import bugimporters.main
 import autoresponse
@@ -16,7 +18,7 @@ class TestRoundupBugImporter(object):
 
     def setup_class(cls):
         # Set up the RoundupTrackerModel that will be used here.
-        cls.tm = ObjectFromDict(dict(
+        cls.tm = TrackerModel(
                 tracker_name='Mercurial',
                 base_url='http://mercurial.selenic.com/bts/',
                 closed_status='resolved',
@@ -27,7 +29,7 @@ class TestRoundupBugImporter(object):
                 as_appears_in_distribution='',
                 bugimporter='roundup.RoundupBugImporter',
                 queries = ['http://mercurial.selenic.com/bts/issue?@action=export_csv&@columns=id,activity,title,creator,status&@sort=-activity&@group=priority&@filter=status,assignedto&@pagesize=50&@startwith=0&status=-1,1,2,3,4,5,6,7,9,10'],
-                ))
+                )
         cls.im = bugimporters.roundup.RoundupBugImporter(
             cls.tm,
             bugimporters.tests.ReactorManager(),
@@ -100,6 +102,116 @@ the module to the output. (Long live lambda.)""")
         assert bug['looks_closed']
         return bug
 
+    def make_export_importer(self, **extra):
+        tm_data = dict(self.tm.__dict__)
+        tm_data.update(export_batch_size=2, **extra)
+        tm = bugimporters.main.dict2obj(tm_data)
+        return bugimporters.roundup.RoundupBugImporter(
+            tm, bugimporters.tests.ReactorManager(), data_transits=None)
+
+    def test_export_urls_are_batched(self):
+        im = self.make_export_importer()
+        requests = list(im.handle_query_csv(open(os.path.join(
+                    HERE, 'sample-data', 'fake-mercurial-csv.csv')).read()))
+        assert len(requests) == 1
+        self.assertEqual(requests[0].url,
+            'http://mercurial.selenic.com/bts/issue?@action=export_csv'
+            '&@columns=id,title,status,priority,creation,activity,creator,'
+            'nosy,topics&@filter=id&id=1550')
+        self.assertEqual(requests[0].meta['bug_ids'], [1550])
+
+        assert len(list(im.prepare_export_urls([1, 2, 3, 4, 5]))) == 3
+
+    def test_export_rows_become_bugs(self):
+        im = self.make_export_importer()
+        results = list(im.handle_export_csv(open(os.path.join(
+                    HERE, 'sample-data', 'roundup-export-batch.csv')).read(),
+                    [1550, 1551, 1552]))
+
+        bugs = [r for r in results if isinstance(r, bugimporters.items.ParsedBug)]
+        requests = [r for r in results if r not in bugs]
+        self.assertEqual(len(bugs), 2)
+
+        bug = bugs[0]
+        self.assertEqual(bug['canonical_bug_link'], 'http://mercurial.selenic.com/bts/issue1550')
+        self.assertEqual(bug['title'], "help('modules') broken by several 3rd party libraries (svn patch attached)")
+        self.assertEqual(bug['status'], 'resolved')
+        self.assertEqual(bug['importance'], 'bug')
+        self.assertEqual(bug['submitter_username'], 'benjhayden')
+        self.assertEqual(bug['people_involved'], 2)
+        self.assertEqual(bug['date_reported'], datetime.datetime(2007, 12, 3, 16, 34, 27).isoformat())
+        self.assertEqual(bug['last_touched'], datetime.datetime(2008, 1, 13, 11, 32, 10).isoformat())
+        self.assertEqual(bug['_tracker_name'], 'Mercurial')
+        assert bug['good_for_newcomers']
+        assert bug['looks_closed']
+
+        assert not bugs[1]['good_for_newcomers']
+        assert not bugs[1]['looks_closed']
+        self.assertEqual(bugs[1]['people_involved'], 3)
+
+        # Issue 1552 was not in the export, so its page gets fetched.
+        self.assertEqual([r.url for r in requests],
+                         ['http://mercurial.selenic.com/bts/issue1552'])
+
+    def test_export_falls_back_to_html_for_messages(self):
+        im = self.make_export_importer(export_html_fallback=True)
+        requests = im.handle_export_csv(open(os.path.join(
+                    HERE, 'sample-data', 'roundup-export-batch.csv')).read(),
+                    [1550])
+        ar = autoresponse.Autoresponder(url2filename={
+                'http://mercurial.selenic.com/bts/issue1550':
+                    os.path.join(HERE, 'sample-data', 'closed-mercurial-bug.html'),
+                }, url2errors={})
+        bugs = ar.respond_recursively(requests)
+        self.assertEqual(len(bugs), 1)
+
+        bug = bugs[0]
+        self.assertEqual(bug['importance'], 'bug')
+        self.assertEqual(bug['submitter_realname'], 'Ben Hayden')
+        self.assertEqual(bug['people_involved'], 2)
+        assert bug['description'].startswith("Instead of listing installed modules")
+
+    def test_export_and_html_modes_agree(self):
+        export_csv = open(os.path.join(
+                HERE, 'sample-data', 'roundup-export-batch.csv')).read()
+        ar = autoresponse.Autoresponder(url2filename={
+                'http://mercurial.selenic.com/bts/issue1550':
+                    os.path.join(HERE, 'sample-data', 'closed-mercurial-bug.html'),
+                }, url2errors={})
+        html_bug = ar.respond_recursively(self.im.prepare_bug_urls([1550]))[0]
+        export_bug = list(self.make_export_importer().handle_export_csv(
+                export_csv, [1550]))[0]
+        fallback_bug = ar.respond_recursively(
+            self.make_export_importer(export_html_fallback=True
+                                      ).handle_export_csv(export_csv, [1550]))[0]
+
+        for field in ('submitter_username', 'people_involved'):
+            self.assertEqual(export_bug[field], html_bug[field])
+        for field in ('submitter_username', 'submitter_realname',
+                      'description', 'people_involved'):
+            self.assertEqual(fallback_bug[field], html_bug[field])
+        # Without the fallback the export cannot know these.
+        self.assertEqual(export_bug['description'], '')
+        self.assertEqual(export_bug['submitter_realname'], '')
+
+    def test_str2datetime_obj_remembers_format_per_tracker(self):
+        rbp = bugimporters.roundup.RoundupBugParser(
+                bug_url='http://mercurial.selenic.com/bts/issue1550')
+        self.assertEqual(rbp.str2datetime_obj('2012-08-31.07:28:13', 'Mercurial'),
+                         datetime.datetime(2012, 8, 31, 7, 28, 13))
+        self.assertEqual(
+            bugimporters.helpers._date_format_by_tracker['Mercurial'],
+            '%Y-%m-%d.%H:%M:%S')
+        # A different format still parses.
+        self.assertEqual(rbp.str2datetime_obj('2012-08-31 07:28', 'Mercurial'),
+                         datetime.datetime(2012, 8, 31, 7, 28))
+        try:
+            rbp.str2datetime_obj('last Tuesday', 'Mercurial')
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected a ValueError'
+
     def test_reimport_same_bug_works(self):
         bug1 = self.test_new_mercurial_bug_import()
         bug2 = self.test_new_mercurial_bug_import()
@@ -112,7 +224,7 @@ class TestRoundupBugsFromPythonProject(object):
 
     def setup_class(cls):
         # Set up the RoundupTrackerModel that will be used here.
-        cls.tm = ObjectFromDict(dict(
+        cls.tm = TrackerModel(
                 tracker_name='Python',
                 base_url='http://bugs.python.org/',
                 closed_status='resolved',
@@ -121,7 +233,7 @@ class TestRoundupBugsFromPythonProject(object):
                 documentation_field='Components',
                 documentation_text='Documentation',
                 as_appears_in_distribution='',
-                ))
+                )
         cls.im = bugimporters.roundup.RoundupBugImporter(
             cls.tm,
             bugimporters.tests.ReactorManager(),
@@ -138,3 +250,22 @@ class TestRoundupBugsFromPythonProject(object):
 
         self.assertEqual(bug['_project_name'], 'Python')
         self.assertEqual(bug['title'], "hasattr doensn't show private (double underscore) attributes exist")
+
+    def test_export_row_counts_the_same_people(self):
+        # georg.brandl is on the nosy list but wrote no message; both
+        # modes count every nosy user.
+        rbp = bugimporters.roundup.RoundupBugParser(
+                bug_url='http://bugs.python.org/issue8264')
+        html_bug = self.im.handle_bug_html(open(os.path.join(
+                        HERE, 'sample-data',
+                        'python-roundup-8264.html')).read(), rbp)
+        export_bug = rbp.get_parsed_data_dict_from_export(self.tm, {
+                'id': '8264', 'title': html_bug['title'],
+                'status': 'open', 'priority': 'normal',
+                'creation': '2010-03-30.10:52:00',
+                'activity': '2010-10-29.10:07:00', 'creator': 'ncw',
+                'nosy': 'georg.brandl;ncw;r.david.murray'})
+
+        self.assertEqual(html_bug['people_involved'], 3)
+        self.assertEqual(export_bug['people_involved'],
+                         html_bug['people_involved'])
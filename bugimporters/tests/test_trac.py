@@ -1,10 +1,12 @@
 import datetime
 import os
 import autoresponse
+import scrapy.http
 
 from bugimporters.tests import (ReactorManager, TrackerModel,
         HaskellTrackerModel)
 from bugimporters.base import printable_datetime
+import bugimporters.trac
 from bugimporters.trac import TracBugImporter, TracBugParser
 import bugimporters.main
 from mock import Mock
@@ -70,6 +72,87 @@ class TestTracBugImporter(object):
 
         assert len(items) == 18
 
+    def test_paginated_query_requests_next_page_when_full(self):
+        tm = TrackerModel(query_page_size=18)
+        im = TracBugImporter(tm, ReactorManager(),
+                data_transits=importer_data_transits)
+        cached_csv_filename = os.path.join(HERE, 'sample-data',
+                'twisted-trac-query-easy-bugs-on-2011-04-13.csv')
+        query_url = 'http://twistedmatrix.com/trac/query?status=new&format=csv'
+        first_page_url = im.query_url_for_page(query_url, 1, 18)
+        requests = list(im.handle_query_csv_page(
+                open(cached_csv_filename).read(), first_page_url, 1))
+
+        # The page was full, so the next page comes first, followed by
+        # this page's 18 tickets.
+        assert len(requests) == 19
+        assert requests[0].url == im.query_url_for_page(query_url, 2, 18)
+        assert requests[0].meta['query_page'] == 2
+        assert requests[1].url == (
+            'http://twistedmatrix.com/trac/ticket/581?format=csv')
+
+    def test_paginated_query_stops_on_short_page(self):
+        tm = TrackerModel(query_page_size=50)
+        im = TracBugImporter(tm, ReactorManager(),
+                data_transits=importer_data_transits)
+        cached_csv_filename = os.path.join(HERE, 'sample-data',
+                'twisted-trac-query-easy-bugs-on-2011-04-13.csv')
+        query_url = 'http://twistedmatrix.com/trac/query?status=new&format=csv'
+        requests = list(im.handle_query_csv_page(
+                open(cached_csv_filename).read(),
+                im.query_url_for_page(query_url, 3, 50), 3))
+
+        assert len(requests) == 18
+        assert all('query_page' not in r.meta for r in requests)
+
+    def respond_to_page(self, request, body, status=200):
+        response = scrapy.http.Response(url=request.url, body=body,
+                                        status=status)
+        response.request = request
+        return list(request.callback(response))
+
+    def test_paginated_query_stops_when_pages_repeat(self):
+        # Older Trac ignores page, and hands back the same tickets every
+        # time.
+        tm = TrackerModel(query_page_size=18)
+        im = TracBugImporter(tm, ReactorManager(),
+                data_transits=importer_data_transits)
+        csv_data = open(os.path.join(HERE, 'sample-data',
+                'twisted-trac-query-easy-bugs-on-2011-04-13.csv')).read()
+        query = bugimporters.main.dict2obj({'get_query_url': lambda:
+            'http://twistedmatrix.com/trac/query?status=new&format=csv'})
+        first_page, = im.process_queries([query])
+        requests = self.respond_to_page(first_page, csv_data)
+        next_page = requests[0]
+        assert next_page.meta['query_page'] == 2
+        assert len(requests) == 19
+
+        assert self.respond_to_page(next_page, csv_data) == []
+
+    def test_page_past_the_end_ends_paging_quietly(self, monkeypatch):
+        errors = []
+        monkeypatch.setattr(bugimporters.trac.logging, 'error',
+                            lambda *args: errors.append(args))
+        tm = TrackerModel(query_page_size=18)
+        im = TracBugImporter(tm, ReactorManager(),
+                data_transits=importer_data_transits)
+        request = im.query_page_request(
+            'http://twistedmatrix.com/trac/query?status=new&format=csv', 2,
+            set())
+        assert 500 in request.meta['handle_httpstatus_list']
+        error_page = ('<!DOCTYPE html>\n<html><body>Page 2 is beyond the '
+                      'number of pages in the query</body></html>\n')
+        assert self.respond_to_page(request, error_page, status=500) == []
+        assert self.respond_to_page(request, error_page) == []
+        assert errors == []
+
+    def test_query_url_for_page(self):
+        url = TracBugImporter.query_url_for_page(
+            'http://twistedmatrix.com/trac/query?status=new&max=5&format=csv',
+            4, 100)
+        assert url == ('http://twistedmatrix.com/trac/query?'
+                       'status=new&format=csv&max=100&page=4')
+
     def test_bug_parser(self):
         ### As an aside:
         # TracBugParser is amusing, as it pulls data from two different sources.
@@ -146,6 +229,41 @@ class TestTracBugImporter(object):
         assert item['_tracker_name'] == self.tm.tracker_name
         return item
 
+    def test_bug_html_can_be_parsed_in_a_thread_pool(self, monkeypatch):
+        import threading
+        import twisted.internet.defer
+        import twisted.internet.threads
+
+        threads = []
+
+        def defer_to_pool(reactor, pool, f, *args, **kwargs):
+            # Run f in a thread of its own, and hand back its result, as
+            # the reactor would once the pool was done with it.
+            assert pool.max == 2
+            results = []
+            thread = threading.Thread(
+                target=lambda: results.append(f(*args, **kwargs)))
+            thread.start()
+            thread.join()
+            threads.append(thread)
+            return twisted.internet.defer.succeed(results[0])
+
+        monkeypatch.setattr(twisted.internet.threads, 'deferToThreadPool',
+                            defer_to_pool)
+        monkeypatch.setattr(self.tm, 'parse_threads', 2)
+        monkeypatch.setattr(self.im, 'handle_parsed_bug_html',
+                            lambda tbp: (threading.current_thread(), tbp))
+        tbp = TracBugParser(
+                bug_url='http://twistedmatrix.com/trac/ticket/4298')
+        d = self.im.handle_bug_html('<html><p>Hi</p></html>', tbp)
+
+        handled = []
+        d.addCallback(handled.append)
+        assert len(threads) == 1
+        # The page was parsed in the pool, and handled back on this thread.
+        assert tbp.bug_html.text_content() == 'Hi'
+        assert handled == [(threading.current_thread(), tbp)]
+
     def test_handle_bug_html_for_existing_bug(self):
         item_first_time = self.test_handle_bug_html_for_new_bug()
         item_second_time = self.test_handle_bug_html_for_new_bug()
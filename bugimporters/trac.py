@@ -21,6 +21,7 @@ import csv
 import datetime
 import feedparser
 import importlib
+import itertools
 import lxml
 import lxml.html
 import twisted.web.error
@@ -36,7 +37,8 @@ import yaml
 
 from bugimporters.base import BugImporter, printable_datetime
 from bugimporters.helpers import (string2naive_datetime, cached_property,
-        unicodify_strings_when_inputted, wrap_file_object_in_utf8_check)
+        unicodify_strings_when_inputted, wrap_file_object_in_utf8_check,
+        utf8_file_from_bytes, html_parser_for_encoding, set_query_params)
 import bugimporters.items
 import bugimporters.main
 
@@ -55,13 +57,43 @@ class TracBugImporter(BugImporter):
             ### test suite.
 
         # Add all the queries to the waiting list
+        page_size = self.get_query_page_size()
         for query in queries:
             query_url = query.get_query_url()
             print query_url
+            if page_size:
+                # Page through the query rather than asking Trac for every
+                # matching ticket in one enormous CSV file.
+                yield self.query_page_request(query_url, 1, set())
+                continue
             yield scrapy.http.Request(
                 url=query_url,
                 callback=self.handle_query_csv_response)
 
+    def get_query_page_size(self):
+        # If the tracker sets query_page_size, queries are fetched in pages
+        # of that many tickets using Trac's max/page query parameters.
+        return getattr(self.tm, 'query_page_size', None)
+
+    def query_page_request(self, query_url, page, seen_ids):
+        r = scrapy.http.Request(
+            url=self.query_url_for_page(query_url, page,
+                                        self.get_query_page_size()),
+            callback=self.handle_query_csv_response)
+        r.meta['query_page'] = page
+        # The ids of the tickets on the query's earlier pages.
+        r.meta['query_seen_ids'] = seen_ids
+        if page > 1:
+            # Trac answers a page past the end of the query with an error
+            # page, which handle_query_csv_page takes as the end.
+            r.meta['handle_httpstatus_list'] = [500]
+        return r
+
+    @staticmethod
+    def query_url_for_page(query_url, page, page_size):
+        return set_query_params(query_url, [('max', str(page_size)),
+                                            ('page', str(page))])
+
     def handle_timeline_rss(self, timeline_rss):
         # There are two steps to updating the timeline.
         # First step is to use the actual timeline to update the date_reported and
@@ -70,7 +102,7 @@ class TracBugImporter(BugImporter):
         # Parse the returned timeline RSS feed.
         for entry in feedparser.parse(timeline_rss).entries:
             # Format the data.
-            base_url = self.tm.base_url
+            base_url = self.tm.get_base_url()
             entry_url = entry.link.rsplit("#", 1)[0]
             entry_date = printable_datetime(
                 datetime.datetime(*entry.date_parsed[0:6]))
@@ -119,22 +151,75 @@ class TracBugImporter(BugImporter):
             tb_times.save()
 
     def handle_query_csv_response(self, response):
-        return self.handle_query_csv(response.body)
+        meta = response.request.meta
+        page = meta.get('query_page')
+        if page is None:
+            return self.handle_query_csv(response.body)
+        if response.status != 200:
+            # The page before was full, and this one is past the end.
+            return []
+        return self.handle_query_csv_page(response.body,
+                                          response.request.url, page,
+                                          meta.get('query_seen_ids'))
+
+    def handle_query_csv_page(self, query_csv, query_url, page,
+                              seen_ids=None):
+        if seen_ids is None:
+            seen_ids = set()
+        if page > 1 and self.looks_like_html(query_csv):
+            # Trac's error page for a page past the end of the query.
+            return
+        page_size = self.get_query_page_size()
+        bug_ids = self.query_csv2bug_ids(query_csv) or []
+        new_ids = [bug_id for bug_id in bug_ids if bug_id not in seen_ids]
+        seen_ids.update(new_ids)
+
+        # A full page means there may be more tickets, so ask for the next
+        # page straight away. Trac has no cheap way of telling us the total
+        # up front, so a short page is how we know we are done. Older Trac
+        # ignores page, and newer Trac does not page a query that fits in
+        # one, so a page with nothing new on it is the end too.
+        if len(bug_ids) >= page_size and new_ids:
+            yield self.query_page_request(query_url, page + 1, seen_ids)
+
+        # Schedule this page's tickets without waiting for the rest of
+        # the query.
+        if new_ids:
+            for r in self.process_bugs([
+                    (self.bug_id2url(bug_id), None)
+                    for bug_id in new_ids]):
+                yield r
+
+    @staticmethod
+    def looks_like_html(text):
+        return text.lstrip()[:9].lower() in ('<!doctype', '<html>')
 
     def handle_query_csv(self, query_csv):
-        # Remove any Unicode oddities before we process query_csv
-        in_stream = StringIO.StringIO(query_csv)
-        out_stream = wrap_file_object_in_utf8_check(in_stream)
-        query_csv = out_stream.read()
+        bug_ids = self.query_csv2bug_ids(query_csv)
+        if bug_ids is None:
+            return
+
+        # Now we pass a sequence of (bug URL, optional extra data) tuples to
+        # self.process_bugs.
+        return self.process_bugs([
+                (self.bug_id2url(bug_id), None)
+                for bug_id in bug_ids])
+
+    def query_csv2bug_ids(self, query_csv):
+        # Remove any Unicode oddities before we process query_csv. The
+        # lines are checked one at a time as csv.DictReader asks for them.
+        lines = wrap_file_object_in_utf8_check(StringIO.StringIO(query_csv))
 
         # If the "csv" starts with an HTML stanza, log that and die.
-        if query_csv.lower().strip().startswith('<!doctype'):
+        first_line = ''
+        for first_line in lines:
+            if first_line.strip():
+                break
+        if first_line.lower().strip().startswith('<!doctype'):
             logging.error("We got HTML instead of actual CSV data.")
-            return
+            return None
 
-        # Turn the string into a list so csv.DictReader can handle it.
-        query_csv_list = query_csv.split('\n')
-        dictreader = csv.DictReader(query_csv_list)
+        dictreader = csv.DictReader(itertools.chain([first_line], lines))
         bug_ids = []
         for line in dictreader:
             if 'id' in line:
@@ -142,12 +227,7 @@ class TracBugImporter(BugImporter):
             else:
                 logging.warning("Curious: We ran into a really odd line in Roundup.")
                 logging.warning("%s", line)
-
-        # Now we pass a sequence of (bug URL, optional extra data) tuples to
-        # self.process_bugs.
-        return self.process_bugs([
-                (self.bug_id2url(bug_id), None)
-                for bug_id in bug_ids])
+        return bug_ids
 
     def bug_id2url(self, bug_id):
         url = urlparse.urljoin(self.tm.get_base_url(),
@@ -173,12 +253,12 @@ class TracBugImporter(BugImporter):
 
     def handle_bug_csv_response(self, response):
         tbp = response.request.meta['tbp']
-        bug_csv = response.body_as_unicode().encode('utf-8')
-        return self.handle_bug_csv(bug_csv, tbp)
+        return self.handle_bug_csv(response.body, tbp,
+                                   encoding=response.encoding)
 
-    def handle_bug_csv(self, bug_csv, tbp):
+    def handle_bug_csv(self, bug_csv, tbp, encoding=None):
         # Pass the TracBugParser the CSV data
-        tbp.set_bug_csv_data(bug_csv)
+        tbp.set_bug_csv_data(bug_csv, encoding=encoding)
 
         # Now fetch the bug HTML
         r = scrapy.http.Request(
@@ -204,14 +284,21 @@ class TracBugImporter(BugImporter):
             return failure
 
     def handle_bug_html_response(self, response):
-        bug_html = response.body_as_unicode().encode('utf-8')
         tbp = response.request.meta['tbp']
-        return self.handle_bug_html(bug_html, tbp)
+        return self.handle_bug_html(response.body, tbp,
+                                    encoding=response.encoding)
 
-    def handle_bug_html(self, bug_html, tbp):
+    def handle_bug_html(self, bug_html, tbp, encoding=None):
         # Pass the TracBugParser the HTML data
-        tbp.set_bug_html_data(bug_html)
+        return self.parse_then(self.handle_parsed_bug_html,
+                               self.set_bug_html_data, tbp, bug_html, encoding)
 
+    @staticmethod
+    def set_bug_html_data(tbp, bug_html, encoding):
+        tbp.set_bug_html_data(bug_html, encoding=encoding)
+        return tbp
+
+    def handle_parsed_bug_html(self, tbp):
         # Get the parsed data dict from the TracBugParser
         data = tbp.get_parsed_data_dict(self.tm)
         data['_tracker_name'] = self.tm.tracker_name
@@ -228,7 +315,7 @@ class TracBugImporter(BugImporter):
                 'last_touched': last_touched,
                 })
 
-        return bugimporters.items.ParsedBug(data)
+        return data.to_item()
 
     def generate_bug_project_name(self, tbp):
         return self.tm.bug_project_name_format.format(
@@ -275,7 +362,7 @@ class TracBugParser(object):
         return cleaner.clean_html(lxml.html.tostring(div))
 
     @staticmethod
-    def page2date_opened(doc):
+    def page2date_opened(doc, tracker_key=None):
         span_or_a = doc.cssselect(
             '''.date p:contains("Opened") span,
             .date p:contains("Opened") a''')
@@ -283,24 +370,25 @@ class TracBugParser(object):
             tag = span_or_a[0]
         else:
             tag = doc.cssselect('''.date p:contains("Opened")''')[0]
-        return TracBugParser._span2date(tag)
+        return TracBugParser._span2date(tag, tracker_key)
 
     @staticmethod
-    def page2date_modified(doc):
+    def page2date_modified(doc, tracker_key=None):
         try:
             span = doc.cssselect(
                 '''.date p:contains("Last modified") span,
                 .date p:contains("Last modified") a''')[0]
         except IndexError:
-            return TracBugParser.page2date_opened(doc)
-        return TracBugParser._span2date(span)
+            return TracBugParser.page2date_opened(doc, tracker_key)
+        return TracBugParser._span2date(span, tracker_key)
 
     @staticmethod
-    def _span2date(span):
+    def _span2date(span, tracker_key=None):
         date_string = span.attrib['title']
         date_string = date_string.replace('in Timeline', '')
         date_string = date_string.replace('See timeline at ', '')
-        return printable_datetime(string2naive_datetime(date_string))
+        return printable_datetime(
+            string2naive_datetime(date_string, tracker_key))
 
     @staticmethod
     def all_people_in_changes(doc):
@@ -333,14 +421,20 @@ class TracBugParser(object):
         except KeyError:
             return ''
 
-    def set_bug_csv_data(self, bug_csv):
-        bug_csv_list = bug_csv.split('\n')
-        dr = csv.DictReader(bug_csv_list)
+    def set_bug_csv_data(self, bug_csv, encoding=None):
+        # The CSV is read straight out of the response body; it is only
+        # transcoded if Trac sent something other than UTF-8.
+        dr = csv.DictReader(utf8_file_from_bytes(bug_csv, encoding))
         self.bug_csv = dr.next()
 
-    def set_bug_html_data(self, bug_html):
+    def set_bug_html_data(self, bug_html, encoding=None):
         self.bug_html_as_bytes = bug_html
-        self.bug_html = lxml.html.fromstring(bug_html)
+        if encoding and type(bug_html) != unicode:
+            # Let lxml decode the raw bytes itself.
+            self.bug_html = lxml.html.fromstring(
+                bug_html, parser=html_parser_for_encoding(encoding))
+        else:
+            self.bug_html = lxml.html.fromstring(bug_html)
 
     @staticmethod
     @unicodify_strings_when_inputted
@@ -356,7 +450,7 @@ class TracBugParser(object):
         # Seems that some Trac bug trackers don't give all the information
         # below. For now, just put the offending item inside a try catch and
         # give it a null case.
-        ret = bugimporters.items.ParsedBug()
+        ret = bugimporters.items.BugRecord()
         ret.update({'title': self.bug_csv['summary'],
                'description': TracBugParser.string_un_csv(
                         self.bug_csv['description']),
@@ -405,21 +499,22 @@ class TracBugParser(object):
         # FIXME: Need time zone
         if not tm.old_trac:
             # All is fine, proceed as normal.
-            ret['date_reported'] = TracBugParser.page2date_opened(self.bug_html)
-            ret['last_touched'] = TracBugParser.page2date_modified(self.bug_html)
+            ret['date_reported'] = TracBugParser.page2date_opened(
+                self.bug_html, tm.tracker_name)
+            ret['last_touched'] = TracBugParser.page2date_modified(
+                self.bug_html, tm.tracker_name)
 
         # Check for the bitesized keyword
         if tm.bitesized_type:
-            b_list = tm.bitesized_text.split(',')
-            ret['good_for_newcomers'] = any(
-                    b in self.bug_csv[tm.bitesized_type] for b in b_list)
+            ret['good_for_newcomers'] = tm.get_keyword_matcher(
+                    'bitesized_text').in_text(self.bug_csv[tm.bitesized_type])
         else:
             ret['good_for_newcomers'] = False
         # Check whether this is a documentation bug.
         if tm.documentation_type:
-            d_list = tm.documentation_text.split(',')
-            ret['concerns_just_documentation'] = any(
-                    d in self.bug_csv[tm.documentation_type] for d in d_list)
+            ret['concerns_just_documentation'] = tm.get_keyword_matcher(
+                    'documentation_text').in_text(
+                    self.bug_csv[tm.documentation_type])
         else:
             ret['concerns_just_documentation'] = False
 